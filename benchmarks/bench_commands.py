@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""Benchmark http requests, text over tcp and wake-on-lan commands as well as remote entity command parameters
+(repeat, delay, hold and sequences) against local stand-in devices with increasing concurrency.
+
+Usage (from the repository root):
+
+    python benchmarks/bench_commands.py --concurrency 1,4,16,64 --requests 200 --latency 20 --size 1024
+
+The results (throughput and latency percentiles per scenario and concurrency level) are printed and written as json
+to benchmarks/results/ or the file set with --output so different runs can be compared"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from common import Histogram, metadata, summarize, describe, write_results
+
+import ucapi # pylint: disable=wrong-import-order
+
+import driver # pylint: disable=wrong-import-order
+import commands # pylint: disable=wrong-import-order
+import remote # pylint: disable=wrong-import-order
+
+from devices import StandInDevices
+
+ENTITY_ID = "benchmark"
+
+
+
+def scenarios(devices: StandInDevices, args: argparse.Namespace) -> dict:
+    """Return all benchmark scenarios as name -> coroutine function that executes one operation and returns the status code"""
+
+    http_url = f"http://127.0.0.1:{devices.http_port}/status?latency={args.latency}&size={args.size}"
+    tcp_address = f"127.0.0.1:{devices.tcp_port}"
+    wol_param = f"AA:BB:CC:DD:EE:FF, host=127.0.0.1, port={devices.udp_port}"
+
+    entity_config = {
+        "Features": {},
+        "Simple Commands": {
+            "HTTP": {"Type": "get", "Parameter": {"url": http_url}},
+            "TCP": {"Type": "tcp-text", "Parameter": {"address": tcp_address, "text": "PING"}},
+            "WOL": {"Type": "wol", "Parameter": wol_param},
+        }
+    }
+
+    all_scenarios = {
+        "http-get": lambda: commands.execute("get", f"url=\"{http_url}\"", ENTITY_ID),
+        "http-post": lambda: commands.execute("post", f"url=\"{http_url}\", data=\"power=on\"", ENTITY_ID),
+        "tcp-text": lambda: commands.execute("tcp-text", f"{tcp_address}, PING", ENTITY_ID),
+        "wol": lambda: commands.execute("wol", wol_param, ENTITY_ID),
+        "remote-repeat": lambda: remote.handle_params(ENTITY_ID, entity_config, {"command": "HTTP", "repeat": 5}),
+        "remote-delay": lambda: remote.handle_params(ENTITY_ID, entity_config, {"command": "TCP", "repeat": 3, "delay": args.delay}),
+        "remote-hold": lambda: remote.handle_params(ENTITY_ID, entity_config, {"command": "TCP", "hold": args.hold}),
+        "remote-sequence": lambda: remote.handle_params(ENTITY_ID, entity_config, {"sequence": ["HTTP", "TCP", "WOL", "HTTP"]}),
+    }
+    if devices.unix_path:
+        all_scenarios["tcp-text-unix"] = lambda: commands.execute("tcp-text", f"unix:{devices.unix_path}, PING", ENTITY_ID)
+
+    if args.scenarios:
+        return {name: all_scenarios[name] for name in args.scenarios.split(",")}
+    return all_scenarios
+
+
+
+async def run_level(operation, concurrency: int, total: int) -> dict:
+    """Execute the operation total times with the given amount of concurrent workers and return throughput and latency percentiles"""
+
+    histogram = Histogram()
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                status = await operation()
+            except Exception as e:
+                logging.debug(f"Benchmark operation failed: {e}")
+                status = ucapi.StatusCodes.SERVER_ERROR
+            histogram.record((time.perf_counter() - start) * 1_000_000, status != ucapi.StatusCodes.OK)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_ops": round(histogram.count / duration, 1) if duration else 0,
+        **summarize(histogram),
+    }
+
+
+
+async def main(args: argparse.Namespace):
+    """Start the stand-in devices and run all scenarios for all concurrency levels"""
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = metadata({"requests": args.requests, "latency_ms": args.latency, "body_size": args.size, "delay_ms": args.delay, "hold_ms": args.hold})
+    results["scenarios"] = {}
+
+    with StandInDevices(latency=args.latency, body_size=args.size) as devices:
+        for name, operation in scenarios(devices, args).items():
+            results["scenarios"][name] = []
+            for concurrency in levels:
+                # Remote command parameters execute several commands per operation
+                total = args.requests if not name.startswith("remote-") else max(concurrency, args.requests // 5)
+                result = await run_level(operation, concurrency, total)
+                results["scenarios"][name].append(result)
+                print(f"{name:16} c={concurrency:<4} {result['throughput_ops']:>9.1f} ops/s  {describe(result)}")
+        results["devices"] = {"http_requests": devices.http_requests, "tcp_messages": devices.tcp_messages, "udp_packets": devices.udp_packets}
+
+    print(f"Results written to {write_results(results, 'commands', args.output)}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark integration commands against local stand-in devices")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma separated list of concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="operations per scenario and concurrency level")
+    parser.add_argument("--latency", type=float, default=0, help="response latency of the stand-in devices in milliseconds")
+    parser.add_argument("--size", type=int, default=256, help="http response body size in bytes")
+    parser.add_argument("--delay", type=int, default=10, help="delay parameter in milliseconds for the remote-delay scenario")
+    parser.add_argument("--hold", type=int, default=100, help="hold parameter in milliseconds for the remote-hold scenario")
+    parser.add_argument("--scenarios", default="", help="comma separated list of scenarios to run (default: all)")
+    parser.add_argument("--output", default="", help="json results file (default: benchmarks/results/commands-<time>.json)")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the integration modules")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(name)-14s | %(message)s")
+    for logger in ("commands", "remote", "sensor", "config", "metrics", "timing"):
+        logging.getLogger(logger).setLevel(arguments.log_level)
+
+    driver.loop.run_until_complete(main(arguments))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmarks for the per-command cpu work (parameter parsing, response processing and configuration handling)
+with stored baselines and regression thresholds.
+
+Usage (from the repository root):
+
+    python benchmarks/bench_micro.py --save-baseline   # store the current results as baseline for this machine
+    python benchmarks/bench_micro.py                   # compare with the baseline, exits with 1 on regressions
+
+Baselines are stored per cpu architecture in benchmarks/baselines/ so results from a x86-64 development machine and the
+aarch64 Remote are not mixed up. A case counts as regression if it is slower than the baseline by more than the threshold"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+
+from common import ROOT, metadata, write_results
+
+import config # pylint: disable=wrong-import-order
+import commands # pylint: disable=wrong-import-order
+import selects # pylint: disable=wrong-import-order
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines")
+SIZES = (10, 100, 1000, 10000)
+
+
+
+def custom_entities_yaml(commands_count: int) -> str:
+    """Return a synthetic custom entities configuration with the given amount of commands spread over entities with 100 commands each"""
+
+    lines = ["_vars:", "  host: 192.168.1.10", "  port: \"8080\""]
+    per_entity = min(commands_count, 100)
+    for entity in range(max(1, commands_count // per_entity)):
+        lines += [f"Entity{entity}:", "  Features:", "    'On':", "      Type: wol", "      Parameter: AA:BB:CC:DD:EE:FF",
+                  "    'Off':", "      Type: get", "      Parameter: http://${host}:${port}/off", "  Simple Commands:"]
+        for command in range(per_entity):
+            if command % 3 == 0:
+                lines += [f"    CMD_{command}:", "      Type: tcp-text", "      Parameter:", "        address: ${host}:23", f"        text: KEY {command}"]
+            elif command % 3 == 1:
+                lines += [f"    CMD_{command}:", "      Type: post", "      Parameter:", "        url: http://${host}:${port}/api",
+                          "        json:", "          command: key", f"          number: {command}"]
+            else:
+                lines += [f"    CMD_{command}:", "      Type: get", f"      Parameter: http://${{host}}:${{port}}/key/{command}"]
+        lines += ["  Selects:", "    Inputs:"] + [f"    - CMD_{command}" for command in range(0, per_entity, 10)]
+    return "\n".join(lines) + "\n"
+
+
+
+def cases(name_filter: str = "") -> dict:
+    """Return all benchmark cases as name -> function without arguments. Only prepares the configuration cases if they match the filter"""
+
+    smart_quotes = "url=“http://192.168.1.10/api”, json=“{‘power’: ‘on’}”"
+    http_param = "url=\"http://192.168.1.10:8080/api/v1/command\", json=\"{'command': 'volume', 'value': 42}\", " \
+                 "headers=\"{'Authorization': 'Bearer abcdef'}\", timeout=5, verify=false, ffg=true"
+    http_param_large = ", ".join(f"key{i}=\"{'v' * 50}\"" for i in range(200))
+    http_param_quotes = "url=\"http://x/\", data=\"" + "\\\"" * 2000 + "\""
+    tcp_param = "192.168.1.10:23, \"POWER ON\\r\", response_ok=\"^OK\", response_error=\"^ERR\", timeout=2, response_wait=true"
+    tcp_param_large = "192.168.1.10:23, \"" + "x" * 20000 + "\""
+    control = "PWR\\x0D\\x0A" * 4 + "\\\\x0D"
+    control_large = "\\x0D\\x0A" * 5000
+    response = "{\"power\": \"on\", \"volume\": 42, \"input\": \"HDMI1\"}"
+    response_large = "{\"power\": \"on\", \"padding\": \"" + "x" * 100_000 + "\", \"volume\": 42}"
+    response_lines = "line\r\n" * 20_000
+    binary = "\x00\x01" * 5000
+    body_large = response_large.encode("utf-8")
+
+    options = [f"INPUT_{i}" if i % 2 else {f"INPUT_{i}": f"Video Input {i}"} for i in range(50)]
+
+    all_cases = {
+        "normalize_quotes/plain": lambda: commands.normalize_quotes(http_param),
+        "normalize_quotes/smart": lambda: commands.normalize_quotes(smart_quotes),
+        "normalize_quotes/large": lambda: commands.normalize_quotes(http_param_large),
+        "parse_http_params/typical": lambda: commands.parse_http_params(http_param),
+        "parse_http_params/200-params": lambda: commands.parse_http_params(http_param_large),
+        "parse_http_params/escaped-quotes": lambda: commands.parse_http_params(http_param_quotes),
+        "parse_tcp_text_params/typical": lambda: commands.parse_tcp_text_params(tcp_param),
+        "parse_tcp_text_params/20k-text": lambda: commands.parse_tcp_text_params(tcp_param_large),
+        "tcp_text_process_control_data/typical": lambda: commands.tcp_text_process_control_data(control),
+        "tcp_text_process_control_data/10k-escapes": lambda: commands.tcp_text_process_control_data(control_large),
+        "is_printable/short": lambda: commands.is_printable(response),
+        "is_printable/100k": lambda: commands.is_printable(response_large),
+        "is_printable/binary": lambda: commands.is_printable(binary),
+        "decode_body/100k": lambda: commands.decode_body(body_large, "application/json"),
+        "decode_body/100k-latin-1": lambda: commands.decode_body(body_large, "text/html; charset=ISO-8859-1"),
+        "update_response/full": lambda: commands.update_response(response, "tcp-text"),
+        "update_response/full-100k": lambda: commands.update_response(response_large, "tcp-text"),
+        "update_response/full-20k-lines": lambda: commands.update_response(response_lines, "tcp-text"),
+        "update_response/regex": lambda: commands.update_response(response, "http-request"),
+        "update_response/regex-100k": lambda: commands.update_response(response_large, "http-request"),
+        "update_response/regex-nomatch-20k-lines": lambda: commands.update_response(response_lines, "http-request"),
+        "_resolve_select_option/50-options": lambda: [selects._resolve_select_option(o, True) for o in options], # pylint: disable=protected-access
+    }
+
+    for size in SIZES:
+        if name_filter and name_filter not in f"validate_yaml/{size}-commands substitute_yaml_vars/{size}-commands":
+            continue
+        yaml_string = custom_entities_yaml(size)
+        parsed = config.validate_yaml(yaml_string)
+        variables = parsed.pop("_vars")
+        all_cases[f"validate_yaml/{size}-commands"] = lambda y=yaml_string: config.validate_yaml(y)
+        all_cases[f"substitute_yaml_vars/{size}-commands"] = lambda p=parsed, v=variables: config.substitute_yaml_vars(p, v)
+
+    return all_cases
+
+
+
+def measure(function, repeat: int, min_time: float) -> dict:
+    """Return the minimum and median time per call in microseconds of several runs that take at least min_time seconds each"""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    runs = [timer.timeit(number) / number * 1_000_000 for _ in range(repeat)]
+    return {"min_us": round(min(runs), 3), "median_us": round(statistics.median(runs), 3), "loops": number}
+
+
+
+def main(args: argparse.Namespace) -> int:
+    """Run all cases, compare them with the baseline and return the exit code"""
+
+    # Use a temporary config file as update_response reads the configured regular expressions
+    work_dir = tempfile.mkdtemp(prefix="uc-bench-micro-")
+    config.Setup.set("cfg_path", os.path.join(work_dir, "config.json"))
+    config.Setup.set("rq_response_regex", r"\"volume\": (\d+)")
+
+    baseline_file = args.baseline or os.path.join(BASELINE_PATH, f"micro-{platform.machine().lower()}.json")
+    baseline = {}
+    if os.path.isfile(baseline_file) and not args.save_baseline:
+        with open(baseline_file, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("cases", {})
+
+    results = metadata({"repeat": args.repeat, "min_time_s": args.min_time, "threshold": args.threshold})
+    results["cases"] = {}
+    regressions = []
+
+    for name, function in cases(args.filter).items():
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(function, args.repeat, args.min_time)
+        line = f"{name:45} {result['min_us']:>12.2f} us"
+        base = baseline.get(name)
+        if base:
+            ratio = result["min_us"] / base["min_us"]
+            result["baseline_ratio"] = round(ratio, 3)
+            line += f"  {ratio:>6.2f}x baseline"
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        results["cases"][name] = result
+        print(line)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {baseline_file}")
+    else:
+        print(f"Results written to {write_results(results, 'micro', args.output)}")
+
+    if regressions:
+        print(f"{len(regressions)} case(s) are more than {args.threshold}x slower than the baseline: {', '.join(regressions)}")
+        return 1
+    if not baseline and not args.save_baseline:
+        print(f"No baseline found in {baseline_file}. Use --save-baseline to create one")
+    return 0
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for parsing and response processing hot paths")
+    parser.add_argument("--filter", default="", help="only run cases that contain this text")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured runs per case")
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum duration of each run in seconds")
+    parser.add_argument("--threshold", type=float, default=1.25, help="maximum allowed ratio to the baseline before a case counts as regression")
+    parser.add_argument("--baseline", default="", help="baseline file (default: benchmarks/baselines/micro-<architecture>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as new baseline")
+    parser.add_argument("--output", default="", help="json results file (default: benchmarks/results/micro-<time>.json)")
+    parser.add_argument("--log-level", default="ERROR", help="log level of the integration modules")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(name)-14s | %(message)s")
+    for logger in ("commands", "config", "selects", "sensor"):
+        logging.getLogger(logger).setLevel(arguments.log_level)
+
+    sys.exit(main(arguments))
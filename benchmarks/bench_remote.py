@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+"""Simulate one or more Remotes that connect to the websocket server of the integration and replay a command mix
+(button mashes, held keys, select cycling and command sequences) at a target rate to test the real entry points
+(media player, custom remote and select command handlers) of the whole driver.
+
+The integration is started as a separate process with a generated configuration that points all commands to local
+stand-in devices. The round-trip latency of each command (request until status response) is measured per command kind.
+An additional probe client periodically requests the driver version to measure the event loop lag of the integration.
+
+Usage (from the repository root):
+
+    python benchmarks/bench_remote.py --clients 4 --rate 40 --duration 30 --mix mash=6,hold=1,select=2,sequence=1"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from common import ROOT, INTG_PATH, Histogram, metadata, summarize, describe, write_results
+from devices import StandInDevices
+
+REMOTE_ID = "remote-custom-bench"
+SELECT_ID = "select-custom-bench-inputs"
+MP_ID = "tcp-text"
+ENTITY_IDS = [REMOTE_ID, SELECT_ID, MP_ID, "http-get"]
+
+
+
+def custom_entities(devices: StandInDevices) -> str:
+    """Return the custom entities yaml configuration for the simulated remote entity with a select entity"""
+
+    http_url = f"http://127.0.0.1:{devices.http_port}/"
+    tcp_address = f"127.0.0.1:{devices.tcp_port}"
+
+    return f"""_vars:
+  http: "{http_url}"
+  tcp: "{tcp_address}"
+Bench:
+  Features:
+    'On':
+      Type: tcp-text
+      Parameter:
+        address: ${{tcp}}
+        text: POWER ON
+    'Off':
+      Type: tcp-text
+      Parameter:
+        address: ${{tcp}}
+        text: POWER OFF
+  Simple Commands:
+    VOL_UP:
+      Type: tcp-text
+      Parameter:
+        address: ${{tcp}}
+        text: VOL UP
+    VOL_DOWN:
+      Type: tcp-text
+      Parameter:
+        address: ${{tcp}}
+        text: VOL DOWN
+    INPUT_1:
+      Type: get
+      Parameter: ${{http}}input/1
+    INPUT_2:
+      Type: get
+      Parameter: ${{http}}input/2
+    INPUT_3:
+      Type: get
+      Parameter: ${{http}}input/3
+    MENU:
+      Type: post
+      Parameter:
+        url: ${{http}}menu
+        json:
+          command: menu
+    WAKE:
+      Type: wol
+      Parameter: AA:BB:CC:DD:EE:FF, host=127.0.0.1, port={devices.udp_port}
+  Selects:
+    Inputs:
+    - INPUT_1
+    - INPUT_2
+    - INPUT_3
+"""
+
+
+
+def command_mix(devices: StandInDevices, args: argparse.Namespace) -> dict:
+    """Return all command kinds as name -> function that returns a new (entity_id, cmd_id, params) tuple"""
+
+    keys = itertools.cycle(["VOL_UP", "VOL_UP", "VOL_UP", "VOL_DOWN"])
+    sources = itertools.cycle([f"127.0.0.1:{devices.tcp_port}, PING", f"127.0.0.1:{devices.tcp_port}, STATUS"])
+
+    return {
+        "mash": lambda: (REMOTE_ID, "send_cmd", {"command": next(keys)}),
+        "hold": lambda: (REMOTE_ID, "send_cmd", {"command": "VOL_UP", "hold": args.hold}),
+        "select": lambda: (SELECT_ID, "select_next", {"cycle": "true"}),
+        "sequence": lambda: (REMOTE_ID, "send_cmd_sequence", {"sequence": ["WAKE", "On", "INPUT_2", "MENU"]}),
+        "power": lambda: (REMOTE_ID, random.choice(["on", "off"]), None),
+        "source": lambda: (MP_ID, "select_source", {"source": next(sources)}),
+    }
+
+
+
+class RemoteClient:
+    """Minimal websocket client that speaks the integration api protocol like a Remote"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.events = 0
+        self._ws = None
+        self._reader = None
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+
+    async def connect(self):
+        """Connect to the integration and start reading messages"""
+        self._ws = await websockets.connect(self.url, max_size=None)
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        """Close the connection"""
+        if self._ws:
+            await self._ws.close()
+        if self._reader:
+            self._reader.cancel()
+
+    def request(self, msg: str, msg_data: dict | None = None) -> asyncio.Future:
+        """Send a request and return a future with the response message"""
+        req_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = future
+        payload = {"kind": "req", "id": req_id, "msg": msg}
+        if msg_data is not None:
+            payload["msg_data"] = msg_data
+        asyncio.create_task(self._ws.send(json.dumps(payload)))
+        return future
+
+    def entity_command(self, entity_id: str, cmd_id: str, params: dict | None) -> asyncio.Future:
+        """Send an entity command and return a future with the response message"""
+        msg_data = {"entity_id": entity_id, "cmd_id": cmd_id}
+        if params:
+            msg_data["params"] = params
+        return self.request("entity_command", msg_data)
+
+    async def _read(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                match message.get("kind"):
+                    case "resp":
+                        future = self._pending.pop(message.get("req_id"), None)
+                        if future and not future.done():
+                            future.set_result(message)
+                    case "event":
+                        self.events += 1
+                    case "req":
+                        # Requests from the integration to the remote
+                        if message.get("msg") == "get_localization_cfg":
+                            await self._ws.send(json.dumps({
+                                "kind": "resp", "req_id": message["id"], "code": 200, "msg": "localization_cfg",
+                                "msg_data": {"language_code": "en_US"}
+                            }))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed"))
+
+
+
+def free_port() -> int:
+    """Return a free local tcp port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+
+def start_integration(entities_yaml: str, work_dir: str, port: int, log_level: str, metrics_port: int | None = None) -> subprocess.Popen:
+    """Start the integration driver in a separate process with the given custom entities configuration in work_dir
+    and optionally serve its metrics on metrics_port"""
+
+    shutil.copy(os.path.join(ROOT, "driver.json"), work_dir)
+    with open(os.path.join(work_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"setup_complete": True, "custom_entities_set": bool(entities_yaml)}, f)
+    with open(os.path.join(work_dir, "custom_entities.yaml"), "w", encoding="utf-8") as f:
+        f.write(entities_yaml)
+
+    env = dict(os.environ)
+    env.update({
+        "UC_INTEGRATION_HTTP_PORT": str(port),
+        "UC_INTEGRATION_INTERFACE": "127.0.0.1",
+        "UC_DISABLE_MDNS_PUBLISH": "true",
+        "UC_LOG_LEVEL": log_level,
+        "UC_CONFIG_HOME": work_dir,
+    })
+    if metrics_port:
+        # The event loop monitor is deactivated by default. Its lag is read from the metrics endpoint after the run
+        env.update({"UC_METRICS_PORT": str(metrics_port), "UC_METRICS_INTERFACE": "127.0.0.1", "UC_LOOP_MONITOR": "true"})
+    log = open(os.path.join(work_dir, "integration.log"), "w", encoding="utf-8") # pylint: disable=consider-using-with
+    return subprocess.Popen([sys.executable, os.path.join(INTG_PATH, "driver.py")], cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+
+async def scrape_metrics(port: int) -> dict[str, float]:
+    """Return all metrics of the integration metrics endpoint as "name{labels}" -> value"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    await writer.drain()
+    body = (await reader.read()).decode("utf-8").split("\r\n\r\n", 1)[-1]
+    writer.close()
+
+    values = {}
+    for line in body.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+
+
+async def connect(url: str, timeout: float = 20) -> RemoteClient:
+    """Connect a new client and retry until the integration accepts connections"""
+    deadline = time.monotonic() + timeout
+    while True:
+        client = RemoteClient(url)
+        try:
+            await client.connect()
+            return client
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+
+async def probe(client: RemoteClient, histogram: Histogram, interval: float, stop: asyncio.Event):
+    """Periodically request the driver version and record the round trip time. As the request is answered directly
+    by the event loop of the integration an increase of this time shows the event loop lag"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.request("get_driver_version"), 30)
+            histogram.record((time.perf_counter() - start) * 1_000_000)
+        except (asyncio.TimeoutError, ConnectionError):
+            histogram.record((time.perf_counter() - start) * 1_000_000, True)
+        await asyncio.sleep(interval)
+
+
+
+async def run_client(client: RemoteClient, mix: dict, weights: dict, rate: float, duration: float, timeout: float, histograms: dict, codes: dict):
+    """Send commands from the mix in an open loop with the given rate and record the round trip latency of each command"""
+
+    names = list(weights)
+    pending = set()
+
+    async def track(name: str, future: asyncio.Future, start: float):
+        try:
+            response = await asyncio.wait_for(future, timeout)
+            code = response.get("code")
+        except asyncio.TimeoutError:
+            code = "timeout"
+        except ConnectionError:
+            code = "closed"
+        histograms[name].record((time.perf_counter() - start) * 1_000_000, code != 200)
+        codes[str(code)] = codes.get(str(code), 0) + 1
+
+    interval = 1 / rate
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < duration:
+        name = random.choices(names, weights=[weights[n] for n in names])[0]
+        entity_id, cmd_id, params = mix[name]()
+        task = asyncio.create_task(track(name, client.entity_command(entity_id, cmd_id, params), time.perf_counter()))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        sent += 1
+        # Keep the rate constant even if sending was delayed
+        await asyncio.sleep(max(0, start + sent * interval - time.perf_counter()))
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+
+async def main(args: argparse.Namespace):
+    """Start the stand-in devices and the integration, connect all clients and replay the command mix"""
+
+    weights = {}
+    for item in args.mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+
+    results = metadata({"clients": args.clients, "rate": args.rate, "duration_s": args.duration, "mix": weights,
+                        "latency_ms": args.latency, "hold_ms": args.hold})
+    work_dir = tempfile.mkdtemp(prefix="uc-bench-remote-")
+
+    with StandInDevices(latency=args.latency) as devices:
+        mix = command_mix(devices, args)
+        unknown = set(weights) - set(mix)
+        if unknown:
+            raise SystemExit(f"Unknown command kinds in mix: {', '.join(unknown)}. Available: {', '.join(mix)}")
+
+        port = free_port()
+        metrics_port = free_port()
+        process = start_integration(custom_entities(devices), work_dir, port, args.log_level, metrics_port)
+        url = f"ws://127.0.0.1:{port}/ws"
+        clients = []
+        try:
+            probe_client = await connect(url)
+            for _ in range(args.clients):
+                client = await connect(url)
+                await client.request("subscribe_events", {"entity_ids": ENTITY_IDS})
+                clients.append(client)
+
+            # Baseline round trip time without load
+            idle = Histogram()
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(probe_client, idle, args.probe_interval, stop))
+            await asyncio.sleep(1)
+            stop.set()
+            await probe_task
+
+            histograms = {name: Histogram() for name in weights}
+            codes = {}
+            lag = Histogram()
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(probe_client, lag, args.probe_interval, stop))
+            start = time.perf_counter()
+            await asyncio.gather(*(run_client(client, mix, weights, args.rate / args.clients, args.duration, args.timeout, histograms, codes)
+                                   for client in clients))
+            duration = time.perf_counter() - start
+            stop.set()
+            await probe_task
+
+            total = Histogram()
+            results["commands"] = {}
+            for name, histogram in histograms.items():
+                total.merge(histogram)
+                results["commands"][name] = summarize(histogram)
+                print(f"{name:10} {describe(results['commands'][name])}")
+            results["total"] = {"duration_s": round(duration, 3), "throughput_ops": round(total.count / duration, 1), **summarize(total)}
+            results["status_codes"] = codes
+            results["events"] = sum(client.events for client in clients)
+            results["probe_idle"] = summarize(idle)
+            results["probe_load"] = summarize(lag)
+            results["event_loop_lag_p99_ms"] = round(max(0, lag.percentile(99) - idle.percentile(50)) / 1000, 2)
+            # Event loop lag and blocking measured by the loop monitor of the integration itself
+            try:
+                values = await scrape_metrics(metrics_port)
+                results["integration_loop_lag_ms"] = {key.split('"')[1]: round(value * 1000, 2) for key, value in values.items()
+                                                      if key.startswith("uc_requests_event_loop_lag_seconds{")}
+                results["integration_loop_blocked"] = values.get("uc_requests_event_loop_blocked", 0)
+            except (OSError, ValueError) as e:
+                print(f"Could not read integration metrics: {e}")
+
+            print(f"{'total':10} {results['total']['throughput_ops']:.1f} cmds/s  {describe(results['total'])}")
+            print(f"{'probe':10} idle {describe(results['probe_idle'])}")
+            print(f"{'':10} load {describe(results['probe_load'])}")
+            if "integration_loop_lag_ms" in results:
+                print(f"{'':10} integration loop lag {results['integration_loop_lag_ms']}  blocked {results['integration_loop_blocked']:.0f} times")
+            print(f"status codes: {codes}  entity change events: {results['events']}")
+        finally:
+            for client in clients:
+                await client.close()
+            process.terminate()
+            process.wait(10)
+        results["devices"] = {"http_requests": devices.http_requests, "tcp_messages": devices.tcp_messages, "udp_packets": devices.udp_packets}
+
+    print(f"Integration log: {os.path.join(work_dir, 'integration.log')}")
+    print(f"Results written to {write_results(results, 'remote', args.output)}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate Remotes sending command mixes to the integration websocket server")
+    parser.add_argument("--clients", type=int, default=2, help="number of simulated remotes")
+    parser.add_argument("--rate", type=float, default=20, help="total commands per second of all clients")
+    parser.add_argument("--duration", type=float, default=20, help="duration in seconds")
+    parser.add_argument("--mix", default="mash=6,hold=1,select=2,sequence=1,power=1,source=1",
+                        help="comma separated command kinds with weights (mash, hold, select, sequence, power, source)")
+    parser.add_argument("--latency", type=float, default=5, help="response latency of the stand-in devices in milliseconds")
+    parser.add_argument("--hold", type=int, default=300, help="hold time in milliseconds for held keys")
+    parser.add_argument("--timeout", type=float, default=30, help="time in seconds after which a missing response counts as timeout")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="interval of the event loop lag probe in seconds")
+    parser.add_argument("--output", default="", help="json results file (default: benchmarks/results/remote-<time>.json)")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the integration")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""Shared helpers for all benchmark scripts to summarize and store results"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTG_PATH = os.path.join(ROOT, "intg-requests")
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results")
+
+if INTG_PATH not in sys.path:
+    sys.path.insert(0, INTG_PATH)
+
+from metrics import Histogram, PERCENTILES # pylint: disable=wrong-import-position
+
+
+
+def git_revision() -> str:
+    """Return the current git revision to be able to assign results to a code version"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+
+def metadata(settings: dict) -> dict:
+    """Return the common header of all result files"""
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+    }
+
+
+
+def summarize(histogram: Histogram) -> dict:
+    """Return the count, errors, latency percentiles and the maximum of a histogram in milliseconds"""
+    result = {"operations": histogram.count, "errors": histogram.errors}
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = round(histogram.percentile(p) / 1000, 2)
+    result["max_ms"] = round(histogram.max / 1000, 2)
+    return result
+
+
+
+def describe(result: dict) -> str:
+    """Return the percentiles of a summarized result as one line"""
+    return " ".join(f"p{p}={result[f'p{p}_ms']:.1f}ms" for p in PERCENTILES) + f"  max={result['max_ms']:.1f}ms  errors={result['errors']}"
+
+
+
+def write_results(results: dict, name: str, output: str = "") -> str:
+    """Write the results as json to output or benchmarks/results/<name>-<time>.json and return the file path"""
+    if not output:
+        os.makedirs(RESULTS_PATH, exist_ok=True)
+        output = os.path.join(RESULTS_PATH, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return output
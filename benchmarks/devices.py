@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""Local stand-in devices for benchmarks: a http server with configurable latency and body size,
+a tcp (and unix socket) server that answers each terminated message and a udp sink for wake-on-lan packets"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+
+
+class StandInDevices:
+    """Runs all stand-in devices on their own event loop in a background thread so they don't compete
+    with the event loop of the integration code that is benchmarked"""
+
+    def __init__(self, latency: float = 0, body_size: int = 64, terminator: bytes = b"\n", response: bytes = b"OK\n"):
+        """
+        :param latency: default response latency of all devices in milliseconds
+        :param body_size: default http response body size in bytes
+        :param terminator: message terminator of the tcp server
+        :param response: response of the tcp server for each received message
+        """
+        self.latency = latency
+        self.body_size = body_size
+        self.terminator = terminator
+        self.response = response
+        self.http_port = None
+        self.tcp_port = None
+        self.udp_port = None
+        self.unix_path = None
+        self.http_requests = 0
+        self.tcp_messages = 0
+        self.udp_packets = 0
+        self._loop = None
+        self._thread = None
+        self._servers = []
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start all devices and wait until they accept connections"""
+        self._thread = threading.Thread(target=self._run, name="stand-in-devices", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+
+    def stop(self):
+        """Stop all devices"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_args):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start_servers())
+        self._ready.set()
+        self._loop.run_forever()
+        for server in self._servers:
+            server.close()
+        self._loop.close()
+
+    async def _start_servers(self):
+        http = await asyncio.start_server(self._handle_http, "127.0.0.1", 0)
+        tcp = await asyncio.start_server(self._handle_tcp, "127.0.0.1", 0)
+        self._servers.extend([http, tcp])
+        self.http_port = http.sockets[0].getsockname()[1]
+        self.tcp_port = tcp.sockets[0].getsockname()[1]
+
+        if hasattr(asyncio, "start_unix_server"):
+            self.unix_path = os.path.join(tempfile.mkdtemp(prefix="uc-bench-"), "device.sock")
+            self._servers.append(await asyncio.start_unix_server(self._handle_tcp, self.unix_path))
+
+        devices = self
+
+        class _UdpSink(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                devices.udp_packets += 1
+
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(_UdpSink, local_addr=("127.0.0.1", 0))
+        self.udp_port = transport.get_extra_info("sockname")[1]
+
+    def body(self, size: int) -> bytes:
+        """Return a json body with a few typical status values padded to the given size"""
+        body = {"power": "on", "volume": 42, "input": "HDMI1", "padding": ""}
+        base = len(json.dumps(body))
+        body["padding"] = "x" * max(0, size - base)
+        return json.dumps(body).encode("utf-8")
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length:
+                    await reader.readexactly(length)
+
+                method, target = request_line.decode("latin-1").split()[:2]
+                query = parse_qs(urlsplit(target).query)
+                latency = float(query.get("latency", [self.latency])[0])
+                size = int(query.get("size", [self.body_size])[0])
+                status = int(query.get("status", [200])[0])
+                self.http_requests += 1
+
+                if latency:
+                    await asyncio.sleep(latency / 1000)
+
+                body = self.body(size)
+                # Like many devices the status body only changes with the requested size, so it can be revalidated with an ETag
+                etag = f'"{size}"'
+                if status == 200 and headers.get("if-none-match") == etag:
+                    status, body = 304, b""
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} Status\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nETag: {etag}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                )
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    await reader.readuntil(self.terminator)
+                except asyncio.IncompleteReadError as e:
+                    if not e.partial:
+                        break
+                self.tcp_messages += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency / 1000)
+                writer.write(self.response)
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Run the stand-in devices until interrupted")
+    parser.add_argument("--latency", type=float, default=0, help="response latency in milliseconds")
+    parser.add_argument("--size", type=int, default=64, help="http response body size in bytes")
+    args = parser.parse_args()
+
+    with StandInDevices(latency=args.latency, body_size=args.size) as devices:
+        print(f"http://127.0.0.1:{devices.http_port}/  tcp 127.0.0.1:{devices.tcp_port}  unix:{devices.unix_path}  udp 127.0.0.1:{devices.udp_port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""Replay entity commands recorded by the integration (UC_COMMAND_RECORD_FILE) against local stand-in devices.
+
+All hosts, urls, tcp addresses and wake-on-lan targets of the given custom entities configuration and the recorded
+media player commands are redirected to the stand-in devices. The integration is started in a separate process and the
+recorded commands are sent over its websocket server with the recorded timing (optionally accelerated) to reproduce the
+real traffic shape. Latencies and status codes of the replay are compared with the recorded ones.
+
+Usage (from the repository root):
+
+    python benchmarks/replay.py commands.jsonl commands.jsonl.1 --config custom_entities.yaml --speed 10"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+
+import yaml
+
+from common import Histogram, metadata, summarize, describe, write_results
+from devices import StandInDevices
+from bench_remote import connect, free_port, start_integration
+
+import config # pylint: disable=wrong-import-order
+
+_URL = re.compile(r"https?://[^/\s\"',]+")
+_ADDRESS = re.compile(r"unix:[^,\s\"]+|[\w.\-]+:\d+|\[[0-9a-fA-F:]+\]:\d+")
+_WOL_PARAMS = ("host=", "port=", "interface=", "family=")
+
+
+
+def redirect(cmd_type: str, param, devices: StandInDevices):
+    """Return the command parameter with all targets replaced by the stand-in devices"""
+
+    http = f"http://127.0.0.1:{devices.http_port}"
+    tcp = f"127.0.0.1:{devices.tcp_port}"
+
+    match cmd_type:
+        case "wol":
+            if isinstance(param, dict):
+                return {**param, "host": "127.0.0.1", "port": devices.udp_port}
+            parts = [part.strip() for part in str(param).split(",") if not part.strip().startswith(_WOL_PARAMS)]
+            return ", ".join(parts + ["host=127.0.0.1", f"port={devices.udp_port}"])
+        case "tcp-text":
+            if isinstance(param, dict):
+                return {**param, "address": tcp}
+            return _ADDRESS.sub(tcp, str(param), count=1)
+        case _:
+            if isinstance(param, dict):
+                return {**param, "url": _URL.sub(http, str(param.get("url", "")))}
+            return _URL.sub(http, str(param))
+
+
+
+def redirect_entities(path: str, devices: StandInDevices) -> tuple[str, list[str]]:
+    """Return the custom entities configuration with all commands redirected to the stand-in devices
+    and the entity ids of all remote and select entities"""
+
+    with open(path, "r", encoding="utf-8") as f:
+        entities = yaml.safe_load(f) or {}
+
+    variables = entities.pop("_vars", {}) or {}
+    # Host rate limits and auth tokens don't apply to the stand-in devices
+    entities.pop("_hosts", None)
+    entities.pop("_auth", None)
+    entities = config.substitute_yaml_vars(entities, variables)
+    entity_ids = []
+
+    for name, entity in entities.items():
+        entity_ids.append(f"{config.Setup.get('custom_entities_prefix')}{name.lower()}")
+        for select in (entity.get("Selects") or {}):
+            entity_ids.append(f"{config.Setup.get('custom_entities_select_prefix')}{name.lower()}-{select.lower()}")
+        for group in ("Features", "Simple Commands"):
+            for command in (entity.get(group) or {}).values():
+                command["Parameter"] = redirect(command.get("Type", ""), command.get("Parameter"), devices)
+
+    return yaml.safe_dump(entities, allow_unicode=True, sort_keys=False), entity_ids
+
+
+
+def media_player_types() -> dict[str, str]:
+    """Return the command type for each media player entity id"""
+    return {config.Setup.get("id-" + cmd): cmd for cmd in config.Setup.all_cmds}
+
+
+
+def load_records(paths: list[str]) -> list[dict]:
+    """Read all records from the given (rotated) record files sorted by time"""
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return sorted(records, key=lambda record: record["t"])
+
+
+
+async def main(args: argparse.Namespace):
+    """Start the stand-in devices and the integration and replay all recorded commands"""
+
+    records = load_records(args.records)
+    if not records:
+        raise SystemExit("No recorded commands found")
+
+    results = metadata({"records": args.records, "config": args.config, "speed": args.speed, "clients": args.clients, "max_gap_s": args.max_gap, "latency_ms": args.latency})
+    work_dir = tempfile.mkdtemp(prefix="uc-bench-replay-")
+    mp_types = media_player_types()
+
+    with StandInDevices(latency=args.latency, body_size=args.size) as devices:
+        entities_yaml, entity_ids = redirect_entities(args.config, devices) if args.config else ("", [])
+        entity_ids = sorted(set(entity_ids) | {record["entity"] for record in records})
+
+        port = free_port()
+        process = start_integration(entities_yaml, work_dir, port, args.log_level)
+        clients = []
+        try:
+            for _ in range(args.clients):
+                client = await connect(f"ws://127.0.0.1:{port}/ws")
+                await client.request("subscribe_events", {"entity_ids": entity_ids})
+                clients.append(client)
+
+            recorded, replayed = {}, {}
+            mismatches = 0
+            pending = set()
+
+            async def send(record: dict, client):
+                nonlocal mismatches
+                key = f"{record['entity']} {record['cmd']}"
+                params = record.get("params")
+                cmd_type = mp_types.get(record["entity"])
+                if cmd_type and params and "source" in params:
+                    params = {**params, "source": redirect(cmd_type, params["source"], devices)}
+
+                start = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(client.entity_command(record["entity"], record["cmd"], params), args.timeout)
+                    code = response.get("code")
+                except (asyncio.TimeoutError, ConnectionError):
+                    code = None
+                replayed.setdefault(key, Histogram()).record((time.perf_counter() - start) * 1_000_000, code != 200)
+                recorded.setdefault(key, Histogram()).record(record["ms"] * 1000, record.get("status") != 200)
+                if code != record.get("status"):
+                    mismatches += 1
+
+            start = time.perf_counter()
+            offset = 0
+            previous = records[0]["t"]
+            for index, record in enumerate(records):
+                # Commands from one websocket client are processed one after another by the integration
+                client = clients[index % len(clients)]
+                if args.speed > 0:
+                    # Shorten long idle periods between recorded commands
+                    offset += min(record["t"] - previous, args.max_gap) / args.speed
+                    previous = record["t"]
+                    await asyncio.sleep(max(0, start + offset - time.perf_counter()))
+                    task = asyncio.create_task(send(record, client))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                else:
+                    await send(record, client)
+            if pending:
+                await asyncio.gather(*pending)
+            duration = time.perf_counter() - start
+
+            results["commands"] = {}
+            total_recorded, total_replayed = Histogram(), Histogram()
+            for key in sorted(replayed):
+                total_recorded.merge(recorded[key])
+                total_replayed.merge(replayed[key])
+                results["commands"][key] = {"recorded": summarize(recorded[key]), "replayed": summarize(replayed[key])}
+                print(f"{key}")
+                print(f"  recorded {describe(results['commands'][key]['recorded'])}")
+                print(f"  replayed {describe(results['commands'][key]['replayed'])}")
+            results["total"] = {"duration_s": round(duration, 3), "status_mismatches": mismatches,
+                                "recorded": summarize(total_recorded), "replayed": summarize(total_replayed)}
+            print(f"total: {total_replayed.count} commands in {duration:.1f} s, {mismatches} status codes differ from the recording")
+        finally:
+            for client in clients:
+                await client.close()
+            process.terminate()
+            process.wait(10)
+
+    print(f"Integration log: {os.path.join(work_dir, 'integration.log')}")
+    print(f"Results written to {write_results(results, 'replay', args.output)}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded entity commands against local stand-in devices")
+    parser.add_argument("records", nargs="+", help="record files written by the integration (including rotated files)")
+    parser.add_argument("--config", default="", help="custom entities yaml configuration that was used while recording")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed factor (1 = recorded timing, 0 = one after another as fast as possible)")
+    parser.add_argument("--clients", type=int, default=1, help="number of simulated remotes the recorded commands are distributed to")
+    parser.add_argument("--max-gap", type=float, default=5, help="maximum idle time in seconds between two recorded commands")
+    parser.add_argument("--latency", type=float, default=5, help="response latency of the stand-in devices in milliseconds")
+    parser.add_argument("--size", type=int, default=256, help="http response body size in bytes")
+    parser.add_argument("--timeout", type=float, default=30, help="time in seconds after which a missing response counts as timeout")
+    parser.add_argument("--output", default="", help="json results file (default: benchmarks/results/replay-<time>.json)")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the integration")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""Module with a cache for access tokens from the _auth block of the custom entities configuration. A token is fetched from
+the login endpoint once per lifetime, refreshed in the background before it expires and added to all http requests with a matching url"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any
+from urllib.parse import SplitResult, urlsplit
+
+from requests import request
+
+import config
+import driver
+import json_path
+import metrics
+import safe_regex
+import workers
+
+_LOG = logging.getLogger(__name__)
+
+_REFRESH_AHEAD = min(0.9, max(0.0, float(os.getenv("UC_AUTH_REFRESH_AHEAD", "0.2"))))
+_EXPIRY_MARGIN = 5 # Seconds a token is treated as expired before the end of its lifetime to not send it while it expires
+_DEFAULT_LIFETIME = 3600
+_DEFAULT_TOKEN = "$.access_token"
+_RETRY_INTERVAL = 30 # Seconds until a failed background refresh is tried again
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+
+class AuthError(Exception):
+    """Raised if a token could not be fetched from the login endpoint or could not be found in its response"""
+
+
+
+class _Token:
+    """Cached token of an _auth entry. A token is replaced if the configuration of the entry has been changed"""
+
+    __slots__ = ("settings", "value", "expires", "refresh_at", "refreshing", "lock")
+
+    def __init__(self, settings: dict[str, Any]):
+        self.settings = settings
+        self.value: str | None = None
+        self.expires = 0.0
+        self.refresh_at = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock() # Only one request per token is sent to the login endpoint at a time
+
+    def valid(self) -> bool:
+        return self.value is not None and time.monotonic() < self.expires
+
+
+
+class _State:
+    """Cached tokens and counters. Tokens are used from worker threads so all access is locked"""
+
+    lock = threading.Lock()
+    tokens: dict[str, _Token] = {}
+    counts = {"fetched": 0, "refreshed": 0, "failed": 0, "injected": 0}
+    gauge_registered = False
+
+
+
+def find(url: str) -> tuple[str, dict[str, Any]] | tuple[None, None]:
+    """Return the name and settings of the _auth entry with the longest url prefix that matches the url or None and None"""
+    try:
+        entries = config.Setup.get("custom_entities_auth", python_dict=True)
+    except Exception as e:
+        _LOG.debug(f"Could not get auth tokens: {e}")
+        return None, None
+
+    found, settings, length = None, None, -1
+    for name, entry in entries.items():
+        prefixes = entry["match"] if isinstance(entry["match"], list) else [entry["match"]]
+        for prefix in prefixes:
+            if matches(url, str(prefix)) and len(str(prefix)) > length:
+                found, settings, length = name, entry, len(str(prefix))
+    return found, settings
+
+
+
+def matches(url: str, prefix: str) -> bool:
+    """Return True if a request url is covered by a match prefix. The scheme, host and port need to be the same
+    and the path needs to start with the path of the prefix at a / boundary to not send the token to other hosts or paths"""
+    request_url, prefix_url = urlsplit(url), urlsplit(prefix)
+    if not prefix_url.scheme or not prefix_url.hostname:
+        return False
+    try:
+        if _origin(request_url) != _origin(prefix_url):
+            return False
+    except ValueError: # Invalid port
+        return False
+    path = prefix_url.path.rstrip("/")
+    return request_url.path in (path, path + "/") or request_url.path.startswith(path + "/")
+
+
+
+def _origin(url: SplitResult) -> tuple[str, str | None, int | None]:
+    scheme = url.scheme.lower()
+    return scheme, url.hostname, url.port or _DEFAULT_PORTS.get(scheme)
+
+
+
+def headers(url: str, request_headers: dict[str, str]) -> tuple[str | None, dict[str, str]]:
+    """Return the name of the matching _auth entry and the header with its token for a request url or None and no header.
+    No token is added if the request already has a header with the same name
+
+    :raises AuthError: If there is no valid token and a new token could not be fetched
+    """
+    name, settings = find(url)
+    if name is None:
+        return None, {}
+    header = settings.get("header", "Authorization")
+    if any(key.lower() == header.lower() for key in request_headers):
+        _LOG.debug(f"The request to {url} already has a {header} header. The token of {name} is not added")
+        return None, {}
+
+    if not _State.gauge_registered:
+        _State.gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_auth_tokens", "Cached auth tokens, tokens fetched or refreshed from login endpoints, failed fetches and requests with a cached token since start", stats)
+
+    value = token(name, settings)
+    with _State.lock:
+        _State.counts["injected"] += 1
+    return name, {header: settings.get("prefix", "Bearer ") + value}
+
+
+
+def renew(name: str, url: str) -> dict[str, str]:
+    """Drop the cached token of an _auth entry after the device rejected it and return the header with a new token
+
+    :raises AuthError: If a new token could not be fetched
+    """
+    with _State.lock:
+        entry = _State.tokens.get(name)
+    if entry is not None:
+        with entry.lock:
+            entry.value = None
+    _LOG.warning(f"The token of {name} has been rejected by {url}. Fetching a new token")
+    found, settings = find(url)
+    if found != name:
+        raise AuthError(f"{name} is no longer configured in _auth for {url}")
+    value = token(name, settings)
+    return {settings.get("header", "Authorization"): settings.get("prefix", "Bearer ") + value}
+
+
+
+def token(name: str, settings: dict[str, Any]) -> str:
+    """Return the cached token of an _auth entry or fetch a new token if there is none or it has expired.
+    A token that has reached the refresh ahead part of its lifetime is returned and refreshed in the background
+
+    :raises AuthError: If a new token could not be fetched
+    """
+    with _State.lock:
+        entry = _State.tokens.get(name)
+        if entry is None or entry.settings != settings:
+            entry = _State.tokens[name] = _Token(settings)
+
+    if entry.valid():
+        if time.monotonic() >= entry.refresh_at and not entry.refreshing:
+            entry.refreshing = True
+            driver.loop.call_soon_threadsafe(_start_refresh, name, entry)
+        return entry.value
+
+    with entry.lock:
+        # Another command could have fetched the token while this command was waiting for the lock
+        if not entry.valid():
+            _fetch(name, entry)
+        return entry.value
+
+
+
+def _start_refresh(name: str, entry: _Token):
+    driver.loop.create_task(_refresh(name, entry))
+
+
+
+@workers.background
+async def _refresh(name: str, entry: _Token):
+    """Fetch a new token in a worker thread while the current token can still be used"""
+    try:
+        await workers.run(_refresh_blocking, name, entry)
+    except workers.WorkersBusyError as w:
+        _LOG.warning(f"Could not refresh the token of {name} in the background: {w}")
+    finally:
+        entry.refreshing = False
+
+
+
+def _refresh_blocking(name: str, entry: _Token):
+    with entry.lock:
+        if entry.valid() and time.monotonic() < entry.refresh_at:
+            return # Already fetched again by a command
+        try:
+            _fetch(name, entry)
+        except AuthError as a:
+            _LOG.warning(f"{a}. The current token is used until it expires")
+            entry.refresh_at = time.monotonic() + _RETRY_INTERVAL
+            return
+    with _State.lock:
+        _State.counts["refreshed"] += 1
+
+
+
+def _fetch(name: str, entry: _Token):
+    """Send the credentials to the login endpoint and store the token from its response. Needs to be called with the lock of the token
+
+    :raises AuthError: If the login endpoint could not be reached, returned an error or the token could not be found in the response
+    """
+    settings = entry.settings
+    params = {
+        "headers": {"User-Agent": config.Setup.get("rq_user_agent"), **(settings.get("headers") or {})},
+        "timeout": config.Setup.get("rq_timeout"),
+        "verify": config.Setup.get("rq_ssl_verify"),
+    }
+    for key in ("data", "json"):
+        if key in settings:
+            params[key] = settings[key]
+    if "username" in settings:
+        params["auth"] = (str(settings["username"]), str(settings.get("password", "")))
+
+    start = time.monotonic()
+    try:
+        response = request(settings.get("method", "post"), settings["url"], **params)
+        response.raise_for_status()
+        value, expires_in = _extract(settings.get("token", _DEFAULT_TOKEN), response.text)
+    except Exception as e:
+        with _State.lock:
+            _State.counts["failed"] += 1
+        raise AuthError(f"Could not get a token for {name} from {settings['url']}: {e}") from e
+
+    lifetime = float(settings.get("lifetime") or expires_in or _DEFAULT_LIFETIME)
+    entry.value = value
+    entry.expires = start + lifetime - min(_EXPIRY_MARGIN, lifetime * 0.05)
+    entry.refresh_at = start + lifetime * (1 - _REFRESH_AHEAD)
+    with _State.lock:
+        _State.counts["fetched"] += 1
+    _LOG.info(f"Got a new token for {name} that is valid for {lifetime:g} seconds")
+
+
+
+def _extract(expression: str, text: str) -> tuple[str, float | None]:
+    """Return the token from the response of the login endpoint and its lifetime from the expires_in value of json responses
+
+    :raises ValueError: If the token could not be found in the response
+    """
+    expires_in = None
+    if json_path.is_json_path(expression):
+        document = json.loads(text)
+        found, value = json_path.compile_path(expression).resolve(document)
+        if isinstance(document, dict) and isinstance(document.get("expires_in"), (int, float)) and document["expires_in"] > 0:
+            expires_in = float(document["expires_in"])
+    else:
+        match = safe_regex.search(expression, text, re.IGNORECASE)
+        found = match is not None
+        value = (match.group(1) if len(match.groups) > 1 else match.group(0)) if match else None
+    if not found or value in (None, ""):
+        raise ValueError(f"The token {expression} could not be found in the response")
+    return str(value), expires_in
+
+
+
+def stats() -> dict[str, int]:
+    """Return the number of cached tokens that can still be used and the counters since start"""
+    with _State.lock:
+        return {"tokens": sum(1 for entry in _State.tokens.values() if entry.valid()), **_State.counts}
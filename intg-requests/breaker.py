@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Module with a circuit breaker per target host that fails commands fast while a device can't be reached"""
+
+import asyncio
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_ENABLED = os.getenv("UC_CIRCUIT_BREAKER", "true").lower() in ("true", "1")
+_FAILURES = int(os.getenv("UC_CIRCUIT_BREAKER_FAILURES", "3"))
+_PROBE_INTERVAL = float(os.getenv("UC_CIRCUIT_BREAKER_PROBE_INTERVAL", "3"))
+_PROBE_TIMEOUT = 2
+
+# Set by the commands module if the current command connected or could not connect to its target
+_connect_failed: ContextVar[list | None] = ContextVar("connect_failed", default=None)
+
+
+
+class _Circuit:
+    """Consecutive connect failures and the time the circuit has been opened for a target"""
+
+    __slots__ = ("failures", "opened", "probe")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened = 0.0
+        self.probe: asyncio.Task | None = None
+
+
+
+_circuits: dict[str, _Circuit] = {}
+_gauge_registered = False
+
+
+
+def enabled() -> bool:
+    """Return True if the circuit breaker is active. Can be deactivated by setting UC_CIRCUIT_BREAKER to false"""
+    return _ENABLED
+
+
+
+def is_open(target: str) -> bool:
+    """Return True if commands for this target should fail fast because it couldn't be reached recently"""
+    circuit = _circuits.get(target)
+    return circuit is not None and circuit.opened > 0
+
+
+
+def watch():
+    """Start watching the current command for connect failures. Returns a token for record()"""
+    return _connect_failed.set([])
+
+
+
+def connect_failed():
+    """Mark the current command as failed to connect to its target. Can be called from worker threads"""
+    attempts = _connect_failed.get()
+    if attempts is not None:
+        attempts.append(False)
+
+
+
+def connected():
+    """Mark the current command as connected to its target. Can be called from worker threads"""
+    attempts = _connect_failed.get()
+    if attempts is not None:
+        attempts.append(True)
+
+
+
+def record(target: str, token, count: bool = True):
+    """Count a connect failure or reset the failures for the target of the current command and open the circuit
+    after UC_CIRCUIT_BREAKER_FAILURES consecutive connect failures. Commands that didn't try to connect, e.g. because they
+    have been rejected before, don't change the circuit. Only stops watching the current command if count is False"""
+    attempts = _connect_failed.get() or []
+    _connect_failed.reset(token)
+
+    if not _ENABLED or not count or not attempts or target in ("unknown", "broadcast"):
+        return
+
+    circuit = _circuits.get(target)
+    if False not in attempts:
+        if circuit is not None:
+            _close(target)
+        return
+
+    if circuit is None:
+        circuit = _circuits[target] = _Circuit()
+    circuit.failures += 1
+    if circuit.opened == 0 and circuit.failures >= _FAILURES:
+        _open(target, circuit)
+
+
+
+def _open(target: str, circuit: _Circuit):
+    global _gauge_registered
+    if not _gauge_registered:
+        _gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_circuit_open", "Targets that currently can't be reached and whose commands fail fast (1 = open)", open_circuits)
+
+    circuit.opened = time.monotonic()
+    _LOG.warning(f"Could not connect to {target} {circuit.failures} times in a row. Commands for {target} will fail immediately \
+until it can be reached again. Checking every {_PROBE_INTERVAL:g} seconds")
+    circuit.probe = asyncio.get_running_loop().create_task(_probe(target))
+
+
+
+def _close(target: str):
+    circuit = _circuits.pop(target)
+    if circuit.opened:
+        _LOG.info(f"{target} can be reached again after {time.monotonic() - circuit.opened:.0f} seconds. Commands will be sent again")
+    if circuit.probe and circuit.probe is not asyncio.current_task():
+        circuit.probe.cancel()
+
+
+
+async def _probe(target: str):
+    """Try to connect to the target in the background until it accepts connections again and close the circuit"""
+    while target in _circuits:
+        await asyncio.sleep(_PROBE_INTERVAL)
+        writer = None
+        try:
+            if target.startswith("unix:"):
+                connection = asyncio.open_unix_connection(target[5:])
+            else:
+                host, _, port = target.rpartition(":")
+                connection = asyncio.open_connection(host.strip("[]"), int(port))
+            _, writer = await asyncio.wait_for(connection, _PROBE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            _LOG.debug(f"{target} can still not be reached: {e}")
+            continue
+        finally:
+            if writer:
+                writer.close()
+        if target in _circuits:
+            _close(target)
+
+
+
+def open_circuits() -> dict[str, int]:
+    """Return all targets with an open circuit"""
+    return {target: 1 for target, circuit in _circuits.items() if circuit.opened}
@@ -3,30 +3,53 @@
 """Module that sends http request, wol or text over tcp command"""
 
 import asyncio
+import codecs
+import functools
+import json
 import logging
+import os
 import ast
 import shlex
 import socket
 import string
+import time
 from typing import Any
 
-from re import sub, search, fullmatch, IGNORECASE
+from re import sub, search, fullmatch, error, IGNORECASE
+from urllib.parse import urlsplit
 from ipaddress import ip_address, IPv4Address, IPv6Address, AddressValueError
 import urllib3 #Needed to optionally deactivate requests ssl verify warning message
 
 import ucapi
-from requests import request
+from requests import request, Response
 from requests import codes as http_codes
 from requests import exceptions as rq_exceptions
 from wakeonlan import wake
 from getmac import get_mac_address
 
+import auth
+import breaker
 import config
+import fire_and_forget
 import sensor
 import i18n
+import json_path
+import metrics
+import ratelimit
+import recorder
+import remote
+import response_cache
+import safe_regex
+import singleflight
+import timing
+import workers
 
 _LOG = logging.getLogger(__name__)
 
+_STREAM_MAX_BYTES = int(os.getenv("UC_STREAM_MAX_BYTES", "1048576"))
+_STREAM_CHUNK_SIZE = 1024
+_UNPARSED = object() # Marks a json response that has not been parsed
+
 
 
 def get_mac(param: str):
@@ -164,8 +187,89 @@ Please check your input and only use straight quotes")
     return result
 
 
-def update_response(response: str, cmd: str):
-    """Parse http request or tcp text response with configured regular expression and update the corresponding sensor entity"""
+def parse_http_params(cmd_param: str) -> dict[str, Any]:
+    """Parse a http request command parameter string with comma separated key="value" pairs into a dictionary.
+    Values are converted to Python data types (e.g. booleans or dicts) where possible
+
+    :raises ValueError: If a parameter is not in the key="value" format or a quote is not closed
+    """
+
+    params = {}
+    key = None
+
+    lexer = shlex.shlex(cmd_param, posix=True) # Use shlex to handle command argument like parameters
+    lexer.whitespace_split = True
+    lexer.whitespace = "," #Use comma as separator
+    lexer.quotes = '"' #Handle everything in double quotes as one value
+
+    #Parse the cmd_param string into a dictionary of parameters
+    for param in lexer:
+        try:
+            key, value = param.split("=", 1)
+        except ValueError as v:
+            if key is None:
+                raise ValueError("The parameter key is incorrectly formatted. Please use a syntax like key=\"value\" in the source parameter") from v
+            raise ValueError("The parameter value for \"" + key + " \" is not in the correct format. \
+Please put it in double quotes and use single quotes inside when the value itself contains double quotes") from v
+
+        #Prevent boolean values from being passed as strings
+        if value.lower() == "true":
+            value = True
+        elif value.lower() == "false":
+            value = False
+
+        try:
+            value = ast.literal_eval(value) #Try to convert value to Python data type (e.g. dicts)
+        except (ValueError, SyntaxError):
+            #Use value as string if ast.literal_eval fails
+            pass
+
+        params[key.strip()] = value
+
+    return params
+
+
+
+def parse_tcp_text_params(cmd_param: str) -> tuple[str | None, str, dict[str, str]]:
+    """Parse a comma separated text over tcp command parameter string into the address, the text
+    and a dictionary with all other key=value parameters
+
+    :raises ValueError: If a quote is not closed
+    """
+
+    params = {}
+    address = None
+    data = ""
+
+    lexer = shlex.shlex(cmd_param, posix=True)
+    lexer.whitespace_split = True
+    lexer.whitespace = ","
+    lexer.quotes = '"'
+    tokens = [token.strip() for token in lexer if token.strip()]
+
+    for token in tokens:
+        if "=" in token:
+            key, value = token.split("=", 1)
+            key = key.strip()
+            if key in {"address", "text", "response_ok", "response_error", "timeout", "response_wait"}:
+                params[key] = value.strip()
+                continue
+        if address is None:
+            address = token
+        elif data == "":
+            data = token
+        else:
+            _LOG.warning("Ignored extra tcp_text parameter: %s", token)
+
+    return params.get("address", address), params.get("text", data), params
+
+
+
+def update_response(response: str | bytes, cmd: str, sensors: dict[str, str] | None = None, state: tuple[str, dict[str, Any]] | None = None):
+    """Parse http request or tcp text response with configured regular expression and update the corresponding sensor entity.
+    Binary http responses are matched with a bytes pattern and shown as hex values. The response sensors of a custom entity
+    with their own regular expression or JSON path (sensor entity id -> expression) are updated from the same response
+    as well as the state of a custom remote entity if the command has a response to state rule (remote entity id, rule)"""
 
     if cmd == "http-request":
         regex = config.Setup.get("rq_response_regex")
@@ -176,17 +280,38 @@ def update_response(response: str, cmd: str):
     else:
         raise Exception("Invalid command for response parsing: " + cmd)
 
-    if regex == "":
+    parsed_response = parse_response(response, regex, nomatch_option, cmd)
+    timing.lap("extract")
+
+    update_response_sensor(cmd, parsed_response, response)
+
+    if sensors:
+        update_entity_sensors(response, sensors, nomatch_option, cmd)
+
+    if state:
+        update_entity_state(response, state, cmd)
+
+
+
+def parse_response(response: str | bytes, regex: str, nomatch_option: str, cmd: str, document: Any = _UNPARSED) -> str:
+    """Return the part of a response that matches a regular expression or JSON path or the no match option.
+    An already parsed json document can be passed to not parse the response again for each JSON path"""
+
+    if regex == "" and isinstance(response, bytes):
+        parsed_response = response
+        _LOG.debug("No regular expression set for the " + cmd + " response sensor. The complete response will be used")
+    elif regex == "":
         parsed_response = " ".join(response.split()).replace("\\\"", "\"") #Remove all line breaks and join them with spaces
         _LOG.debug("No regular expression set for the " + cmd + " response sensor. The complete response will be used")
     else:
-        match = search(regex, response)
-        if match:
-            parsed_response = match.group(1)
-            _LOG.debug("Parsed response from configured regex: " + parsed_response)
-        else:
-            _LOG.warning("No matches found in the " + cmd + " response for the regular expression " + regex)
+        try:
+            matched, parsed_response = find_value(regex, response, cmd, document)
+        except safe_regex.RegexTimeoutError as t:
+            # Not treated as no match as the response could contain a match. Shown as a distinct message in the sensor
+            _LOG.error(t)
+            return i18n.Handler.localize(i18n.Messages.REGEX_TIMEOUT)
 
+        if not matched:
             if nomatch_option == "full":
                 _LOG.debug("The full response will be used instead")
                 parsed_response = response
@@ -196,20 +321,226 @@ def update_response(response: str, cmd: str):
             elif nomatch_option == "empty":
                 _LOG.debug("An empty response will be used instead")
                 parsed_response = ""
+    if isinstance(parsed_response, bytes):
+        parsed_response = parsed_response.hex(" ")
+    return parsed_response
+
+
+
+def find_value(expression: str, response: str | bytes, cmd: str, document: Any = _UNPARSED) -> tuple[bool, str | bytes | None]:
+    """Return True and the first group (or the whole match if the regular expression has no group) or the value of a JSON path
+    in a response or False and None if it couldn't be found
+
+    :raises safe_regex.RegexTimeoutError: If the regular expression could not be evaluated within the time limit
+    """
 
+    if json_path.is_json_path(expression):
+        return find_json_path(expression, response, cmd, document)
+
+    try:
+        match = safe_regex.search(expression.encode("utf-8") if isinstance(response, bytes) else expression, response)
+    except error as e:
+        _LOG.error("Invalid regular expression " + expression + " for the " + cmd + " response: " + str(e))
+        return False, None
+    if match is None:
+        _LOG.warning("No matches found in the " + cmd + " response for the regular expression " + expression)
+        return False, None
+    value = match.group(1) if len(match.groups) > 1 else match.group(0)
+    _LOG.debug("Parsed response from configured regex: " + str(value))
+    return True, value
+
+
+
+def update_response_sensor(cmd: str, parsed_response: str, response: str | bytes):
+    """Update the response sensor entity of the command type with the parsed response"""
     try:
         if cmd == "http-request":
             sensor.update_rq_sensor(config.Setup.get("id-rq-sensor"), parsed_response)
+            response_cache.sensor_updated(response, config.Setup.get("id-rq-sensor"))
         if cmd == "tcp-text":
             sensor.update_tcp_text_sensor(config.Setup.get("id-tcp-text-sensor"), parsed_response)
     except Exception as e:
         _LOG.error(e)
+    timing.lap("sensor")
+
+
+
+def update_entity_sensors(response: str | bytes, sensors: dict[str, str], nomatch_option: str, cmd: str):
+    """Update all response sensors of a custom entity from one response. If several sensors use a JSON path
+    the response is only parsed once instead of searching each path in the response text"""
+
+    document = _UNPARSED
+    if sum(1 for expression in sensors.values() if json_path.is_json_path(expression)) > 1:
+        try:
+            document = json.loads(response)
+        except ValueError as v:
+            _LOG.warning("The " + cmd + " response is not valid json: " + str(v))
+
+    for sensor_id, expression in sensors.items():
+        parsed_response = parse_response(response, expression, nomatch_option, cmd, document)
+        try:
+            sensor.update_entity_sensor(sensor_id, parsed_response)
+            if cmd == "http-request":
+                response_cache.sensor_updated(response, sensor_id)
+        except Exception as e:
+            _LOG.error(e)
+    timing.lap("entity_sensors")
+
+
+
+def update_entity_state(response: str | bytes, state: tuple[str, dict[str, Any]], cmd: str):
+    """Set the state of a custom remote entity from a response with the response to state rule of the command.
+    The state is set to unknown if the value can't be found in the response or is not listed in the rule"""
+
+    entity_id, rule = state
+    try:
+        matched, value = find_value(rule["value"], response, cmd)
+    except safe_regex.RegexTimeoutError as t:
+        _LOG.error(str(t) + ". The state of " + entity_id + " will not be updated")
+        return
+
+    new_state = ucapi.remote.States.UNKNOWN
+    if matched and value is not None:
+        text = (value.hex(" ") if isinstance(value, bytes) else value).strip().lower()
+        new_state = next((ucapi.remote.States[key.upper()] for key in ("on", "off", "unknown") if text in rule[key]), ucapi.remote.States.UNKNOWN)
+        _LOG.debug(f"Response value {text!r} means state {new_state} for {entity_id}")
+
+    try:
+        remote.set_state(entity_id, new_state)
+    except Exception as e:
+        _LOG.error(e)
+    timing.lap("state")
+
+
+
+def find_json_path(expression: str, response: str | bytes, cmd: str, document: Any = _UNPARSED) -> tuple[bool, str | None]:
+    """Return True and the value of a JSON path in a json response as text or False and None if it couldn't be found"""
+
+    try:
+        path = json_path.compile_path(expression)
+        if document is not _UNPARSED:
+            matched, value = path.resolve(document)
+        else:
+            matched, value = path.find(response.decode("utf-8", errors="replace") if isinstance(response, bytes) else response)
+    except ValueError as v:
+        _LOG.warning("Could not find the JSON path " + expression + " in the " + cmd + " response: " + str(v))
+        return False, None
+    if not matched:
+        _LOG.warning("The JSON path " + expression + " could not be found in the " + cmd + " response")
+        return False, None
+    value = json_path.to_text(value)
+    _LOG.debug("Parsed response from configured JSON path: " + value)
+    return True, value
+
+
+
+def get_charset(content_type: str) -> str:
+    """Return the charset from a Content-Type header or UTF-8 if no or an unknown charset has been declared"""
+
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        charset = value.strip(" \"'")
+        if key.strip().lower() == "charset" and charset:
+            try:
+                codecs.lookup(charset)
+                return charset
+            except LookupError:
+                _LOG.debug("Unknown charset " + charset + " in the response. Using UTF-8 instead")
+    return "utf-8"
+
+
+
+def decode_body(content: bytes, content_type: str) -> str:
+    """Decode a http response body with the charset from the Content-Type header or UTF-8.
+    Unlike the text property of the requests module this never runs the slow charset detection for responses without a charset"""
+    return content.decode(get_charset(content_type), errors="replace")
+
+
+
+def json_path_found(path: json_path.JsonPath, body: str | bytes) -> bool:
+    """Return True if the JSON path can already be found in the first part of a streamed json response"""
+    try:
+        return path.find(body.decode("utf-8", errors="replace") if isinstance(body, bytes) else body, partial=True)[0]
+    except ValueError:
+        return False
+
+
+
+def stream_found(expression: json_path.JsonPath | str | bytes, body: str | bytes) -> bool:
+    """Return True if a compiled JSON path or regular expression can already be found in the first part of a streamed response
+
+    :raises safe_regex.RegexTimeoutError: If the regular expression could not be evaluated within the time limit
+    """
+    if isinstance(expression, json_path.JsonPath):
+        return json_path_found(expression, body)
+    return safe_regex.search(expression, body) is not None
+
+
+
+def read_stream(response: Response, binary: bool, max_bytes: int, expressions: list[str]) -> tuple[str | bytes, bool]:
+    """Read a streamed http response until all regular expressions or JSON paths that are used for the response
+    (global response regex, response sensors of the entity and response to state rule) have been found or max_bytes have been read
+    and close the connection. The response is read until the end if one of them is empty or invalid.
+    Returns the body and True if it has been read until the end or False if the connection has been closed before
+    The chunk size doubles with every chunk so the growing body only has to be searched a few times"""
+
+    pending = []
+    for expression in expressions:
+        if not expression:
+            pending = None # The complete response is used
+            break
+        if json_path.is_json_path(expression):
+            try:
+                pending.append(json_path.compile_path(expression))
+            except ValueError:
+                pending = None # Logged when the response is parsed
+                break
+        else:
+            pending.append(expression.encode("utf-8") if binary else expression)
+    decoder = None if binary else codecs.getincrementaldecoder(get_charset(response.headers.get("Content-Type", "")))(errors="replace")
+
+    body = b"" if binary else ""
+    size = 0
+    complete = False
+    chunk_size = _STREAM_CHUNK_SIZE
+    try:
+        while True:
+            if size >= max_bytes:
+                _LOG.info(f"Stopped reading the response after the maximum of {max_bytes} bytes")
+                break
+            chunk = response.raw.read(min(chunk_size, max_bytes - size), decode_content=True)
+            if not chunk:
+                if decoder:
+                    body += decoder.decode(b"", final=True)
+                complete = True
+                break
+            size += len(chunk)
+            body += chunk if binary else decoder.decode(chunk)
+            if pending:
+                try:
+                    pending = [expression for expression in pending if not stream_found(expression, body)]
+                except (safe_regex.RegexTimeoutError, error) as e:
+                    _LOG.debug(f"Stopped searching the streamed response: {e}")
+                    pending = None
+                if pending == []:
+                    _LOG.debug(f"All response expressions have been found after {size} bytes. Closing the connection")
+                    break
+            chunk_size *= 2
+    finally:
+        response.close()
+    recorder.add_response_size(size)
+    return body, complete
 
 
 
-def http_request(method: str, cmd_param: str=None | dict) -> int:
-    """Send a http requests command to the passed url with the passed data and return the status code"""
+def http_request(method: str, cmd_param: str=None | dict, background: bool = False, sensors: dict[str, str] | None = None,
+                 state: tuple[str, dict[str, Any]] | None = None) -> int:
+    """Send a http requests command to the passed url with the passed data and return the status code.
+    Errors are not ignored in fire and forget mode if the request is executed in the background.
+    The response also updates the response sensors of a custom entity (sensor entity id -> expression)
+    and the state of its remote entity (remote entity id, response to state rule)"""
 
+    timing.lap("dispatch")
     rq_ssl_verify = config.Setup.get("rq_ssl_verify")
     rq_fire_and_forget = config.Setup.get("rq_fire_and_forget")
     rq_timeout = config.Setup.get("rq_timeout")
@@ -223,42 +554,19 @@ def http_request(method: str, cmd_param: str=None | dict) -> int:
         if not url:
             _LOG.error("No url parameter found")
             return ucapi.StatusCodes.BAD_REQUEST
+        if "ffg" in params:
+            rq_fire_and_forget = params.pop("ffg")
     else:
         # Normalize unicode quotes so shlex can handle pasted smart quotes
         cmd_param = normalize_quotes(cmd_param)
         if cmd_param.startswith(("http://", "https://")):
             url = cmd_param
         else:
-            lexer = shlex.shlex(cmd_param, posix=True) # Use shlex to handle command argument like parameters
-            lexer.whitespace_split = True
-            lexer.whitespace = "," #Use comma as separator
-            lexer.quotes = '"' #Handle everything in double quotes as one value
-
-            #Parse the cmd_param string into a dictionary of parameters
-            for param in lexer:
-                try:
-                    key, value = param.split("=", 1)
-                except ValueError:
-                    if key is None or "":
-                        key = "Unknown key"
-                        _LOG.error("The parameter key is incorrectly formatted. Please use a syntax like key=\"value\" in the source parameter")
-                    _LOG.error("The parameter value for \"" + key + " \" is not in the correct format. \
-Please put it in double quotes and use single quotes inside when the value itself contains double quotes")
-                    return ucapi.StatusCodes.BAD_REQUEST
-
-                #Prevent boolean values from being passed as strings
-                if value.lower() == "true":
-                    value = True
-                elif value.lower() == "false":
-                    value = False
-
-                try:
-                    value = ast.literal_eval(value) #Try to convert value to Python data type (e.g. dicts)
-                except (ValueError, SyntaxError):
-                    #Use value as string if ast.literal_eval fails
-                    pass
-
-                params[key.strip()] = value
+            try:
+                params = parse_http_params(cmd_param)
+            except ValueError as v:
+                _LOG.error(v)
+                return ucapi.StatusCodes.BAD_REQUEST
 
             url = params.pop("url", None)
             if not url:
@@ -270,6 +578,26 @@ Please put it in double quotes and use single quotes inside when the value itsel
                 _LOG.debug("Custom fire and forget setting " +  str(rq_fire_and_forget) + " defined with 'ffg' command parameter. \
 Ignoring global setting: " + str(config.Setup.get("rq_fire_and_forget")))
 
+    binary = params.pop("binary", False)
+    stream = params.pop("stream", False)
+    try:
+        stream_max_bytes = _STREAM_MAX_BYTES if stream is True else int(stream or 0)
+    except (TypeError, ValueError):
+        _LOG.error("The stream parameter needs to be True or the maximum number of bytes that should be read from the response")
+        return ucapi.StatusCodes.BAD_REQUEST
+    if stream_max_bytes:
+        params["stream"] = True
+    cache_ttl = params.pop("cache", None)
+    if cache_ttl is not None:
+        try:
+            cache_ttl = float(cache_ttl)
+        except (TypeError, ValueError):
+            _LOG.error("The cache parameter needs to be the number of seconds a response can be used without asking the device again")
+            return ucapi.StatusCodes.BAD_REQUEST
+        if method not in response_cache.METHODS:
+            _LOG.warning("The cache parameter can only be used with get and head requests. Ignoring it for this " + method + " request")
+            cache_ttl = None
+
     if "headers" in params:
         if "User-Agent" not in params["headers"]:
             params["headers"].update({"User-Agent": rq_user_agent})
@@ -295,21 +623,82 @@ Ignoring global ssl verification setting: " + str(rq_ssl_verify))
         if not rq_ssl_verify:
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+    cache_entry = None
+    if cache_ttl is not None:
+        sensor_ids = [config.Setup.get("id-rq-sensor"), *(sensors or {})]
+        cache_key = response_cache.key(method, url, {**params, "binary": binary})
+        cache_entry = response_cache.get(cache_key)
+        if cache_entry is not None:
+            if cache_entry.fresh(cache_ttl):
+                response_cache.count("hit")
+                _LOG.info("Using cached response for http-" + method + " request to: " + url)
+                if response_cache.sensor_outdated(cache_entry.body, sensor_ids):
+                    update_response(cache_entry.body, "http-request", sensors, state)
+                elif state:
+                    update_entity_state(cache_entry.body, state, "http-request")
+                return ucapi.StatusCodes.OK
+            # Copy the headers to not change the custom entities configuration
+            params["headers"] = {**params["headers"], **cache_entry.conditional_headers()}
+
     _LOG.debug("Sending http request:")
     _LOG.debug("method: " + method + ", fire_and_forget: " + str(rq_fire_and_forget) + ", url: " + url + ", params: " + str(params))
+    timing.lap("parse")
 
+    def send() -> Response:
+        if timing.enabled():
+            with timing.http_session() as session:
+                return session.request(method, url, **params)
+        return request(method, url, **params)
+
+    complete = True
     try:
-        response = request(method, url, **params)
+        # The token is added after logging the parameters to not show it in the log
+        auth_name, auth_headers = auth.headers(url, params["headers"])
+        if auth_headers:
+            params["headers"] = {**params["headers"], **auth_headers}
+            timing.lap("auth")
+        response = send()
+        breaker.connected()
+        if auth_name and response.status_code == http_codes.unauthorized:
+            # The token has been revoked before the end of its lifetime, e.g. after a restart of the device
+            response.close()
+            params["headers"] = {**params["headers"], **auth.renew(auth_name, url)}
+            response = send()
+        if stream_max_bytes:
+            expressions = [config.Setup.get("rq_response_regex"), *(sensors or {}).values()]
+            if state:
+                expressions.append(state[1]["value"])
+            body, complete = read_stream(response, binary, stream_max_bytes, expressions)
+            if not complete and cache_ttl is not None:
+                _LOG.debug("The response has not been read until the end and will not be cached")
+        else:
+            # Decode the response only once. Binary responses are kept as bytes if the binary command parameter is used
+            body = response.content if binary else decode_body(response.content, response.headers.get("Content-Type", ""))
+            recorder.add_response_size(len(response.content))
+        timing.lap("body")
     except rq_exceptions.Timeout as t:
-        if rq_fire_and_forget:
+        if isinstance(t, rq_exceptions.ConnectTimeout):
+            breaker.connect_failed()
+        else:
+            breaker.connected()
+        if rq_fire_and_forget and not background:
             _LOG.info("Got a timeout error but fire and forget mode is active. Return 200/OK status code to the remote")
             _LOG.debug("Ignored error: " + str(t))
             return ucapi.StatusCodes.OK
         _LOG.error("Got a timeout error from Python requests module:")
         _LOG.error(t)
         return ucapi.StatusCodes.TIMEOUT
+    except auth.AuthError as a:
+        if rq_fire_and_forget and not background:
+            _LOG.info("Could not get a token but fire and forget mode is active. Return 200/OK status code to the remote")
+            _LOG.debug("Ignored error: " + str(a))
+            return ucapi.StatusCodes.OK
+        _LOG.error(a)
+        return ucapi.StatusCodes.SERVER_ERROR
     except Exception as e:
-        if rq_fire_and_forget:
+        if isinstance(e, rq_exceptions.ConnectionError) and not isinstance(e, rq_exceptions.SSLError):
+            breaker.connect_failed()
+        if rq_fire_and_forget and not background:
             _LOG.info("Got a requests error but fire and forget mode is active. Return 200/OK status code to the remote")
             _LOG.debug("Ignored error: " + str(e))
             return ucapi.StatusCodes.OK
@@ -317,11 +706,30 @@ Ignoring global ssl verification setting: " + str(rq_ssl_verify))
         _LOG.error(e)
         return ucapi.StatusCodes.CONFLICT
 
+    shown_body = body.hex(" ") if binary else body
+
+    if cache_entry is not None and response.status_code == http_codes.not_modified:
+        response_cache.revalidated(cache_entry)
+        response_cache.count("revalidated")
+        _LOG.info("Sent http-" + method + " request to: " + url + ". Response has not been modified since it has been cached")
+        # The sensor already shows this response unless another request changed it in the meantime
+        if response_cache.sensor_outdated(cache_entry.body, sensor_ids):
+            update_response(cache_entry.body, "http-request", sensors, state)
+        elif state:
+            update_entity_state(cache_entry.body, state, "http-request")
+        return ucapi.StatusCodes.OK
+
+    if cache_ttl is not None:
+        response_cache.count("miss")
+        # A streamed response that has not been read until the end would be used for other expressions later
+        if response.status_code == http_codes.ok and complete:
+            response_cache.put(cache_key, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
     if response.status_code == http_codes.ok:
         _LOG.info("Sent http-" + method + " request to: " + url)
-        if response.text != "":
-            _LOG.info("Server response: " + response.text)
-            update_response(response.text, "http-request")
+        if body:
+            _LOG.info("Server response: " + shown_body)
+            update_response(body, "http-request", sensors, state)
         else:
             _LOG.debug("Received 200 - OK status code")
         return ucapi.StatusCodes.OK
@@ -333,18 +741,18 @@ Ignoring global ssl verification setting: " + str(rq_ssl_verify))
         _LOG.error(e)
         if 400 <= response.status_code <= 499:
             if response.status_code == 404:
-                if response.text != "":
-                    _LOG.info("Server response: " + response.text)
-                    update_response(response.text, "http-request")
+                if body:
+                    _LOG.info("Server response: " + shown_body)
+                    update_response(body, "http-request", sensors, state)
                 return ucapi.StatusCodes.NOT_FOUND
             return ucapi.StatusCodes.BAD_REQUEST
         return ucapi.StatusCodes.SERVER_ERROR
 
     if response.raise_for_status() is None:
         _LOG.info("Received informational or redirection http status code: " + str(response.status_code))
-        if response.text != "":
-            _LOG.info("Server response: " + response)
-            update_response(response.text, "http-request")
+        if body:
+            _LOG.info("Server response: " + shown_body)
+            update_response(body, "http-request", sensors, state)
         return ucapi.StatusCodes.OK
 
 
@@ -355,8 +763,11 @@ def is_printable(s):
 
 
 
-async def tcp_text(cmd_param: str, entity_config: dict[str, Any] = None) -> str:
-    """Send a text over TCP command to the passed address and return the status code."""
+async def tcp_text(cmd_param: str, entity_config: dict[str, Any] = None, sensors: dict[str, str] | None = None,
+                   state: tuple[str, dict[str, Any]] | None = None) -> str:
+    """Send a text over TCP command to the passed address and return the status code.
+    The response also updates the response sensors of a custom entity (sensor entity id -> expression)
+    and the state of its remote entity (remote entity id, response to state rule)"""
 
     timeout = config.Setup.get("tcp_text_timeout")
     response_wait = config.Setup.get("tcp_text_response_wait")
@@ -376,34 +787,14 @@ async def tcp_text(cmd_param: str, entity_config: dict[str, Any] = None) -> str:
         if not response_error and entity_config and "tcp_response_error" in entity_config:
             response_error = entity_config["tcp_response_error"]
     else:
-        params = {}
-        address = None
-        data = ""
-
         # Normalize unicode quotes so shlex can handle pasted smart quotes
         cmd_param = normalize_quotes(cmd_param)
-        lexer = shlex.shlex(cmd_param, posix=True)
-        lexer.whitespace_split = True
-        lexer.whitespace = ","
-        lexer.quotes = '"'
-        tokens = [token.strip() for token in lexer if token.strip()]
-
-        for token in tokens:
-            if "=" in token:
-                key, value = token.split("=", 1)
-                key = key.strip()
-                if key in {"address", "text", "response_ok", "response_error", "timeout", "response_wait"}:
-                    params[key] = value.strip()
-                    continue
-            if address is None:
-                address = token
-            elif data == "":
-                data = token
-            else:
-                _LOG.warning("Ignored extra tcp_text parameter: %s", token)
+        try:
+            address, data, params = parse_tcp_text_params(cmd_param)
+        except ValueError as v:
+            _LOG.error("Invalid text over tcp parameter: " + str(v))
+            return ucapi.StatusCodes.BAD_REQUEST
 
-        address = params.get("address", address)
-        data = params.get("text", data)
         response_ok = params.get("response_ok", "")
         response_error = params.get("response_error", "")
 
@@ -425,8 +816,16 @@ async def tcp_text(cmd_param: str, entity_config: dict[str, Any] = None) -> str:
         _LOG.error("No address parameter found for tcp_text command")
         return ucapi.StatusCodes.BAD_REQUEST
 
-    host, port = address.split(":")
-    port = int(port)
+    # Addresses starting with unix: point to a local unix domain socket instead of a host and port
+    socket_path = None
+    if address.startswith("unix:"):
+        socket_path = address[5:]
+        if not socket_path:
+            _LOG.error("No socket path found in unix socket address: " + address)
+            return ucapi.StatusCodes.BAD_REQUEST
+    else:
+        host, port = address.split(":")
+        port = int(port)
     data = data.strip().strip('"\'')  # Remove spaces and (double) quotes
 
     if timeout != config.Setup.get("tcp_text_timeout"):
@@ -434,10 +833,21 @@ async def tcp_text(cmd_param: str, entity_config: dict[str, Any] = None) -> str:
 
     _LOG.debug(f"address: {address}, text: {repr(data)}, timeout: {timeout}, response_wait: {response_wait}, \
 terminator: {repr(terminator)}")
+    timing.lap("parse")
 
     writer = None
     try:
-        reader, writer = await asyncio.open_connection(host, port)
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            if timing.enabled():
+                # Resolve the host name separately to measure the dns lookup and connect to the first resolved address
+                addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+                host = addresses[0][4][0]
+                timing.lap("dns")
+            reader, writer = await asyncio.open_connection(host, port)
+        breaker.connected()
+        timing.lap("connect")
         if data.startswith("raw="):
             raw_data = data[4:].replace(" ", "").replace("0x", "")
             try:
@@ -452,12 +862,15 @@ terminator: {repr(terminator)}")
                 data = data + terminator
             writer.write((data).encode("utf-8"))
         await writer.drain()
+        timing.lap("write")
 
         received_message = ""
         binary_message = ""
         if response_wait:
             try:
                 received_data = await asyncio.wait_for(reader.read(1024), timeout)
+                timing.lap("ttfb")
+                recorder.add_response_size(len(received_data))
                 try:
                     received_message = received_data.decode("utf-8")
                 except UnicodeDecodeError:
@@ -466,9 +879,14 @@ terminator: {repr(terminator)}")
                 _LOG.warning("Timeout while waiting for a response message from the server")
                 return ucapi.StatusCodes.TIMEOUT
     except Exception as e:
+        if writer is None:
+            breaker.connect_failed()
         _LOG.error("An error occurred while connecting to the server:")
         _LOG.error(e)
-        _LOG.info("Please check if host and port are correct and can be reached from the network in which the integration is running")
+        if socket_path:
+            _LOG.info("Please check if the socket path is correct and the socket can be accessed by the integration")
+        else:
+            _LOG.info("Please check if host and port are correct and can be reached from the network in which the integration is running")
         return ucapi.StatusCodes.BAD_REQUEST
     finally:
         if writer:
@@ -481,16 +899,22 @@ terminator: {repr(terminator)}")
         else:
             _LOG.error("The server could not be reached or the connection was rejected")
 
-    _LOG.info("Sent raw text " + repr(format(data)) + " over TCP to " + address)
+    if socket_path:
+        _LOG.info("Sent raw text " + repr(format(data)) + " over unix socket " + socket_path)
+    else:
+        _LOG.info("Sent raw text " + repr(format(data)) + " over TCP to " + address)
 
     if received_message != "" or binary_message != "":
         if is_printable(received_message) and received_message.strip():
             processed_message = received_message.replace("\r", "\n")
             _LOG.info("Received text response: " + processed_message)
-            update_response(processed_message, "tcp-text")
+            message = processed_message
         else:
             _LOG.info("Received binary response: " + binary_message)
-            update_response(binary_message, "tcp-text")
+            message = binary_message
+        # The text has already been sent. Parse the response in a thread of the event loop instead of a command worker thread
+        # that could be busy. Waiting for risky regular expressions that are evaluated in a separate process would block the event loop
+        await asyncio.to_thread(update_response, message, "tcp-text", sensors, state)
 
     if response_ok or response_error:
 
@@ -509,14 +933,22 @@ terminator: {repr(terminator)}")
         if response_ok:
             _LOG.debug("Expected ok response defined: " + repr(response_ok))
             try:
-                ok_match = search(flags=IGNORECASE, pattern=response_ok, string=match_text)
+                ok_match = await asyncio.to_thread(safe_regex.search, response_ok, match_text, IGNORECASE)
+            except safe_regex.RegexTimeoutError as t:
+                # Same status code as a response that didn't arrive in time. The cause is only shown in the log
+                _LOG.error(t)
+                return ucapi.StatusCodes.TIMEOUT
             except Exception:
                 _LOG.error("Invalid regular expression for response_ok: " + repr(response_ok))
                 return ucapi.StatusCodes.BAD_REQUEST
         if response_error:
             _LOG.debug("Expected error response defined: " + repr(response_error))
             try:
-                error_match = search(flags=IGNORECASE, pattern=response_error, string=match_text)
+                error_match = await asyncio.to_thread(safe_regex.search, response_error, match_text, IGNORECASE)
+            except safe_regex.RegexTimeoutError as t:
+                # Same status code as a response that didn't arrive in time. The cause is only shown in the log
+                _LOG.error(t)
+                return ucapi.StatusCodes.TIMEOUT
             except Exception:
                 _LOG.error("Invalid regular expression for response_error: " + repr(response_error))
                 return ucapi.StatusCodes.BAD_REQUEST
@@ -598,7 +1030,9 @@ async def wol(cmd_param: str | dict)  -> ucapi.StatusCodes:
                 address, password = address.split("/")
                 _LOG.info("Using SecureOn password for address: " + address)
             try:
-                mac = get_mac(address)
+                mac = await workers.run(get_mac, address)
+            except workers.WorkersBusyError:
+                raise
             except ValueError as v:
                 _LOG.error(v)
                 _LOG.error(f"Used WoL parameter \"{value}\" is not a valid hostname, mac or ip address")
@@ -616,7 +1050,9 @@ async def wol(cmd_param: str | dict)  -> ucapi.StatusCodes:
 
     try:
         # Unpack macs list with * and params dict with **
-        await asyncio.gather(asyncio.to_thread(wake, *macs, **params), asyncio.sleep(0))
+        await workers.run(wake, *macs, **params)
+    except workers.WorkersBusyError:
+        raise
     except ValueError as v:
         _LOG.error(v)
         return ucapi.StatusCodes.BAD_REQUEST
@@ -627,7 +1063,9 @@ async def wol(cmd_param: str | dict)  -> ucapi.StatusCodes:
             try:
                 params_without_family = dict(params)
                 params_without_family.pop("family", None)
-                await asyncio.gather(asyncio.to_thread(wake, *macs, **params_without_family), asyncio.sleep(0))
+                await workers.run(wake, *macs, **params_without_family)
+            except workers.WorkersBusyError:
+                raise
             except Exception as fallback_error:
                 _LOG.error("Got an error message from Python wakeonlan module:")
                 _LOG.error(fallback_error)
@@ -642,3 +1080,142 @@ async def wol(cmd_param: str | dict)  -> ucapi.StatusCodes:
     else:
         _LOG.info("Sent wake on lan magic packet to mac address(es)): " + str(macs))
     return ucapi.StatusCodes.OK
+
+
+
+def get_target(cmd_type: str, cmd_param: str | dict) -> str:
+    """Return the target of a command as host:port (http requests & text over tcp), unix:path (text over tcp)
+    or the broadcast address (wol) without fully parsing the command parameters. Used to label and group commands per target"""
+
+    try:
+        if cmd_type == "wol":
+            if isinstance(cmd_param, dict):
+                return str(cmd_param.get("host", "broadcast"))
+            match = search(r"(?:^|,)\s*host\s*=\s*([^,\s]+)", cmd_param)
+            return match.group(1) if match else "broadcast"
+
+        if cmd_type == "tcp-text":
+            if isinstance(cmd_param, dict):
+                address = str(cmd_param["address"])
+            else:
+                match = search(r"(?:^|,)\s*address\s*=\s*\"?([^\",\s]+)", cmd_param) or search(r"^\s*\"?([^\",\s]+)", cmd_param)
+                if not match:
+                    return "unknown"
+                address = match.group(1)
+            # Host names are case insensitive like the host names of urls and the _hosts block. Socket paths are not
+            return address if address.startswith("unix:") else address.lower()
+
+        if isinstance(cmd_param, dict):
+            url = cmd_param["url"]
+        elif cmd_param.startswith(("http://", "https://")):
+            url = cmd_param
+        else:
+            match = search(r"(?:^|,)\s*url\s*=\s*\"?([^\",\s]+)", cmd_param)
+            if not match:
+                return "unknown"
+            url = match.group(1)
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return f"{parts.hostname}:{port}"
+    except Exception:
+        return "unknown"
+
+
+
+def is_fire_and_forget(cmd_type: str, cmd_param: str | dict) -> bool:
+    """Return True if the errors of a http request command should be ignored because of the global fire and forget setting
+    or its ffg parameter without fully parsing the command parameters"""
+
+    if cmd_type in ("wol", "tcp-text"):
+        return False
+    if isinstance(cmd_param, dict):
+        return str(cmd_param.get("ffg", config.Setup.get("rq_fire_and_forget"))).lower() == "true"
+    match = search(r"(?:^|,)\s*ffg\s*=\s*\"?(\w+)", cmd_param)
+    if match:
+        return match.group(1).lower() == "true"
+    return bool(config.Setup.get("rq_fire_and_forget"))
+
+
+
+async def execute(cmd_type: str, cmd_param: str | dict, entity_id: str, entity_config: dict[str, Any] = None, background: bool = False,
+                  state_rule: dict[str, Any] | None = None, remote_id: str | None = None) -> ucapi.StatusCodes:
+    """Send a wol, text over tcp or http request command depending on the command type, record its latency and return the status code.
+    Http requests in fire and forget mode are queued for execution in the background and return OK right away.
+    The response of a custom entity command with a response to state rule sets the state of its remote entity.
+    Commands of a select entity pass the id of its remote entity as remote_id to update the response sensors and the state of the remote entity"""
+
+    if cmd_type not in ("wol", "tcp-text", "get", "post", "put", "delete", "patch", "head"):
+        _LOG.error(f"Unknown command type {cmd_type} for entity {entity_id}")
+        return ucapi.StatusCodes.BAD_REQUEST
+
+    target = get_target(cmd_type, cmd_param)
+
+    # Wake-on-lan commands are never blocked so devices can still be woken up
+    if cmd_type != "wol" and breaker.is_open(target):
+        if is_fire_and_forget(cmd_type, cmd_param):
+            _LOG.info(f"{target} can currently not be reached but fire and forget mode is active. Return 200/OK status code to the remote")
+            return ucapi.StatusCodes.OK
+        _LOG.warning(f"Skipped {cmd_type} command as {target} can currently not be reached")
+        metrics.Collector.command_started(cmd_type)
+        metrics.Collector.record(cmd_type, target, entity_id, 0, ucapi.StatusCodes.SERVICE_UNAVAILABLE)
+        return ucapi.StatusCodes.SERVICE_UNAVAILABLE
+
+    if not background and is_fire_and_forget(cmd_type, cmd_param):
+        run = functools.partial(execute, cmd_type, cmd_param, entity_id, entity_config, background=True, state_rule=state_rule,
+                                remote_id=remote_id)
+        if fire_and_forget.submit(target, run, f"http-{cmd_type} request to {target} ({entity_id})"):
+            _LOG.info(f"Queued http-{cmd_type} request to {target} in fire and forget mode. Return 200/OK status code to the remote")
+            return ucapi.StatusCodes.OK
+        _LOG.warning("Too many fire and forget requests are waiting. Sending the request directly")
+
+    sensors = sensor.entity_sensors(remote_id or entity_id, entity_config) if cmd_type != "wol" else None
+    state = (remote_id or entity_id, state_rule) if state_rule and cmd_type != "wol" else None
+
+    cmd_status = ucapi.StatusCodes.SERVER_ERROR
+    start = time.perf_counter()
+    timing_token = timing.start(cmd_type, target, entity_id)
+    breaker_token = breaker.watch() if cmd_type != "wol" else None
+    metrics.Collector.command_started(cmd_type)
+
+    async def send() -> ucapi.StatusCodes:
+        if not await ratelimit.acquire(target):
+            return ratelimit.TOO_MANY_REQUESTS
+
+        match cmd_type:
+            case "wol":
+                return await wol(cmd_param)
+
+            case "tcp-text":
+                return await tcp_text(cmd_param, entity_config, sensors, state)
+
+            case _:
+                _LOG.info(f"Executing HTTP request with method {cmd_type} and parameter {cmd_param}")
+                # The Python requests library is blocking. Run it in a command worker thread to not block the event loop
+                return await workers.run(http_request, cmd_type, cmd_param, background, sensors, state)
+
+    shared = cancelled = False
+    try:
+        if singleflight.enabled(cmd_type):
+            # Identical commands that are sent while this command is running share its status code and sensor update
+            key = (cmd_type, repr(cmd_param))
+            if sensors:
+                key += tuple(sensors)
+            if state:
+                key += (state[0], repr(state_rule))
+            cmd_status, shared = await singleflight.run(key, send)
+        else:
+            cmd_status = await send()
+    except workers.WorkersBusyError as w:
+        _LOG.error(f"Rejected {cmd_type} command for {target}: {w}")
+        cmd_status = ucapi.StatusCodes.CONFLICT
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        metrics.Collector.record(cmd_type, target, entity_id, time.perf_counter() - start, cmd_status)
+        timing.finish(timing_token, cmd_status)
+        if breaker_token:
+            # Cancelled commands didn't finish their connection attempt
+            breaker.record(target, breaker_token, count=not shared and not cancelled)
+
+    return cmd_status
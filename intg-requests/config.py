@@ -5,9 +5,13 @@ import os
 import re
 import logging
 from collections import Counter, defaultdict
+from urllib.parse import urlsplit
 from yaml import safe_load, dump, YAMLError
 import ucapi
 
+import json_path
+import safe_regex
+
 _LOG = logging.getLogger(__name__)
 
 
@@ -79,6 +83,58 @@ def check_duplicate_yaml_simple_commands(yaml_text: str):
 
 
 
+def validate_response_expression(expression: str, name: str):
+    """Checks a user defined regular expression or JSON path that is used for device responses. Regular expressions
+    with constructs that can cause catastrophic backtracking are logged as warning.
+
+    :raises ValueError: If the expression is not a valid regular expression or JSON path.
+    """
+    if not expression:
+        return
+    if json_path.is_json_path(expression):
+        try:
+            json_path.compile_path(expression)
+        except ValueError as e:
+            raise ValueError(f"The {name} is not a valid JSON path: {e}") from e
+        return
+    warning = safe_regex.validate(expression, name)
+    if warning:
+        _LOG.warning(warning)
+
+
+
+def validate_state_rule(rule, name: str) -> dict:
+    """Checks a response to state rule of a command and returns it with lower case keys and values.
+
+    :raises ValueError: If the rule has no valid regular expression or JSON path or no values for the on or off state.
+    """
+    if not isinstance(rule, dict):
+        raise ValueError(f"The {name} needs a Value with a regular expression or JSON path and the values for 'On', 'Off' or 'Unknown'")
+
+    normalized = {"value": "", "on": [], "off": [], "unknown": []}
+    for key, values in rule.items():
+        key_lc = str(key).lower()
+        if key_lc not in normalized:
+            raise ValueError(f"Invalid entry '{key}' in the {name}. Only ['Off', 'On', 'Unknown', 'Value'] are allowed and 'On' and 'Off' have to be written in quotes")
+        if key_lc == "value":
+            if not isinstance(values, str) or not values:
+                raise ValueError(f"The Value in the {name} needs to be a regular expression or JSON path")
+            validate_response_expression(values, f"Value in the {name}")
+            normalized["value"] = values
+            continue
+        for value in values if isinstance(values, list) else [values]:
+            if value is None or isinstance(value, (bool, dict, list)):
+                raise ValueError(f"The {key} value {value!r} in the {name} needs to be a text in quotes")
+            normalized[key_lc].append(str(value).strip().lower())
+
+    if not normalized["value"]:
+        raise ValueError(f"The {name} needs a Value with a regular expression or JSON path")
+    if not normalized["on"] and not normalized["off"]:
+        raise ValueError(f"The {name} needs the response values for 'On' or 'Off'")
+    return normalized
+
+
+
 def validate_custom_entities(entities, allowed_second_level, allowed_fourth_level, allowed_types, allowed_features):
     """Validates the custom entities configuration against the allowed second level, fourth level keys and command types and duplicate simple command names."""
     errors = []
@@ -131,6 +187,28 @@ def validate_custom_entities(entities, allowed_second_level, allowed_fourth_leve
 
         entity_config["Features"] = new_features
 
+        # Expected tcp responses for all commands of the entity and in command parameters
+        patterns = [(key, value) for key, value in entity_config.items() if key.lower() in ("tcp_response_ok", "tcp_response_error")]
+        for cmd_name, cmd_value in [*features.items(), *(entity_config.get("Simple Commands", {}) or entity_config.get("simple commands", {})).items()]:
+            parameter = cmd_value.get("Parameter") if isinstance(cmd_value, dict) else None
+            if isinstance(parameter, dict):
+                patterns += [(f"{key} of {cmd_name}", parameter[key]) for key in ("response_ok", "response_error") if key in parameter]
+        for key, pattern in patterns:
+            try:
+                validate_response_expression(str(pattern), f"{key} in entity '{entity_name}'")
+            except ValueError as e:
+                errors.append(str(e))
+
+        # Response to state rules of feature and simple commands
+        for cmd_name, cmd_value in [*features.items(), *(entity_config.get("Simple Commands", {}) or entity_config.get("simple commands", {})).items()]:
+            rule_key = next((key for key in cmd_value if key.lower() == "state"), None) if isinstance(cmd_value, dict) else None
+            if rule_key is None:
+                continue
+            try:
+                cmd_value["State"] = validate_state_rule(cmd_value.pop(rule_key), f"State of {cmd_name} in entity '{entity_name}'")
+            except ValueError as e:
+                errors.append(str(e))
+
         # Simple Commands
         simple_cmds = entity_config.get("Simple Commands", {}) or entity_config.get("simple commands", {})
 
@@ -205,6 +283,28 @@ def validate_custom_entities(entities, allowed_second_level, allowed_fourth_leve
 
         entity_config["Selects"] = new_selects
 
+        # Sensors – each sensor has its own regular expression or JSON path for the responses of the entity commands
+        sensors = entity_config.get("Sensors", {}) or entity_config.get("sensors", {})
+
+        new_sensors = {}
+        if not isinstance(sensors, dict):
+            errors.append(f"Sensors of entity \"{entity_name}\" must contain sensor names with a regular expression or JSON path")
+            sensors = {}
+        for sensor_name, expression in sensors.items():
+            if not isinstance(expression, str) or not expression:
+                errors.append(
+                    f"Sensor \"{sensor_name}\" of entity \"{entity_name}\" needs a regular expression or JSON path as value"
+                )
+                continue
+            try:
+                validate_response_expression(expression, f"expression of sensor '{sensor_name}' in entity '{entity_name}'")
+            except ValueError as e:
+                errors.append(str(e))
+                continue
+            new_sensors[str(sensor_name)] = expression
+
+        entity_config["Sensors"] = new_sensors
+
     if errors:
         raise Exception("Custom entities yaml configuration validation failed with the following errors:\n" + "\n".join(errors))
 
@@ -212,6 +312,89 @@ def validate_custom_entities(entities, allowed_second_level, allowed_fourth_leve
 
 
 
+def validate_yaml_hosts(hosts) -> dict:
+    """Validates the rate limits in the _hosts block of the custom entities configuration.
+
+    :raises Exception: If a host entry is not a dict or contains invalid rate limit values.
+    :returns: The validated _hosts block.
+    """
+    errors = []
+
+    if not isinstance(hosts, dict):
+        raise Exception("Custom entities yaml configuration validation failed with the following errors:\n\
+The _hosts block must contain host names or host:port addresses with a rate and an optional burst value")
+
+    for host, limits in hosts.items():
+        if not isinstance(limits, dict):
+            errors.append(f"Invalid entry for host '{host}' in _hosts. Only a rate and burst value are allowed.")
+            continue
+        for k in limits.keys():
+            if k not in ("rate", "burst"):
+                errors.append(f"Invalid entry '{k}' for host '{host}' in _hosts. Only ['burst', 'rate'] are allowed.")
+        rate = limits.get("rate")
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+            errors.append(f"Invalid rate '{rate}' for host '{host}' in _hosts. The rate must be a number of commands per second greater than 0.")
+        burst = limits.get("burst", 1)
+        if isinstance(burst, bool) or not isinstance(burst, int) or burst < 1:
+            errors.append(f"Invalid burst '{burst}' for host '{host}' in _hosts. The burst must be a whole number of at least 1.")
+
+    if errors:
+        raise Exception("Custom entities yaml configuration validation failed with the following errors:\n" + "\n".join(errors))
+
+    return hosts
+
+
+
+def validate_yaml_auth(auth) -> dict:
+    """Validates the login endpoints and credentials in the _auth block of the custom entities configuration.
+
+    :raises Exception: If an entry is not a dict, has no login endpoint url or url prefix to match or contains invalid values.
+    :returns: The validated _auth block.
+    """
+    errors = []
+    allowed = ("data", "header", "headers", "json", "lifetime", "match", "method", "password", "prefix", "token", "url", "username")
+
+    if not isinstance(auth, dict):
+        raise Exception("Custom entities yaml configuration validation failed with the following errors:\n\
+The _auth block must contain names with the login endpoint url, the credentials and the url prefix of the requests that use the token")
+
+    for name, settings in auth.items():
+        if not isinstance(settings, dict):
+            errors.append(f"Invalid entry for '{name}' in _auth. Only {list(allowed)} are allowed.")
+            continue
+        for k in settings.keys():
+            if k not in allowed:
+                errors.append(f"Invalid entry '{k}' for '{name}' in _auth. Only {list(allowed)} are allowed.")
+        if not isinstance(settings.get("url"), str) or not settings["url"]:
+            errors.append(f"Missing url of the login endpoint for '{name}' in _auth.")
+        match = settings.get("match")
+        if not match or not all(isinstance(prefix, str) and prefix for prefix in (match if isinstance(match, list) else [match])):
+            errors.append(f"Missing match for '{name}' in _auth. Use the url prefix or a list of url prefixes of the requests that need the token.")
+        else:
+            for prefix in (match if isinstance(match, list) else [match]):
+                prefix_url = urlsplit(prefix)
+                if prefix_url.scheme.lower() not in ("http", "https") or not prefix_url.hostname:
+                    errors.append(f"Invalid match '{prefix}' for '{name}' in _auth. The url prefix needs a scheme and host like https://api.example.com/v1.")
+        if str(settings.get("method", "post")).lower() not in ("get", "post"):
+            errors.append(f"Invalid method '{settings['method']}' for '{name}' in _auth. Only get and post are allowed.")
+        lifetime = settings.get("lifetime")
+        if lifetime is not None and (isinstance(lifetime, bool) or not isinstance(lifetime, (int, float)) or lifetime <= 0):
+            errors.append(f"Invalid lifetime '{lifetime}' for '{name}' in _auth. The lifetime must be a number of seconds greater than 0.")
+        if "headers" in settings and not isinstance(settings["headers"], dict):
+            errors.append(f"Invalid headers for '{name}' in _auth. The headers must contain header names with their values.")
+        if "token" in settings:
+            try:
+                validate_response_expression(str(settings["token"]), f"token of '{name}' in _auth")
+            except ValueError as e:
+                errors.append(str(e))
+
+    if errors:
+        raise Exception("Custom entities yaml configuration validation failed with the following errors:\n" + "\n".join(errors))
+
+    return auth
+
+
+
 def validate_yaml(yaml_string: str) -> dict:
     """
     Validates the YAML custom entities configuration against non allowed options, duplicate entity and simple command names.
@@ -243,8 +426,8 @@ def validate_yaml(yaml_string: str) -> dict:
         allowed_features.extend(["on", "off"])
         allowed_features.remove("on_off")
 
-    allowed_second_level = {"features", "simple commands", "selects", "tcp_response_ok", "tcp_response_error"}
-    allowed_fourth_level = {"type", "parameter"}
+    allowed_second_level = {"features", "simple commands", "selects", "sensors", "tcp_response_ok", "tcp_response_error"}
+    allowed_fourth_level = {"type", "parameter", "state"}
     allowed_types = set([cmd.lower() for cmd in Setup.all_cmds])
 
     # Now convert the YAML string to a Python dict for further validation that works with the parsed dict
@@ -255,10 +438,22 @@ def validate_yaml(yaml_string: str) -> dict:
 
     variables = entities.get("_vars", {}) # Get variables block if it exists to add it again after validation
     entities.pop("_vars", {})  # Remove variable block if it exists for validation process
+    hosts = entities.pop("_hosts", {}) # Remove host rate limits block if it exists for validation process
+    auth = entities.pop("_auth", {}) # Remove auth tokens block if it exists for validation process
+
+    if hosts:
+        hosts = validate_yaml_hosts(hosts)
+    if auth:
+        # Url prefixes can use variables so they are checked after the variables have been substituted
+        validate_yaml_auth(substitute_yaml_vars(auth, variables or {}))
 
     validated_config = validate_custom_entities(entities, allowed_second_level, allowed_fourth_level, allowed_types, allowed_features)
 
-    #If the _vars block exists add it again at the top after validation
+    #If the _auth, _hosts and _vars blocks exist add them again at the top after validation
+    if auth:
+        validated_config = {"_auth": auth, **validated_config}
+    if hosts:
+        validated_config = {"_hosts": hosts, **validated_config}
     if variables:
         validated_config = {"_vars": variables, **validated_config}
 
@@ -306,6 +501,7 @@ class Setup:
         "custom_entities_set": False,
         "custom_entities_prefix": "remote-custom-",
         "custom_entities_select_prefix": "select-custom-",
+        "custom_entities_sensor_prefix": "sensor-custom-",
         "custom_entities_title_case_select_options": False,
         "tcp_text_timeout": 2,
         "tcp_text_response_wait": True,
@@ -340,6 +536,11 @@ class Setup:
                         "en": "Text over TCP Response",
                         "de": "Text über TCP Antwort"
                         },
+        "id-latency-sensor": "command-latency",
+        "name-latency-sensor": {
+                        "en": "Command Latency",
+                        "de": "Befehlslatenz"
+                        },
         "id-get": "http-get",
         "name-get": "HTTP Get",
         "id-post": "http-post",
@@ -373,32 +574,42 @@ class Setup:
     rq_ids = [__conf["id-rq-sensor"], __conf["id-get"], __conf["id-post"], __conf["id-patch"], __conf["id-put"], __conf["id-delete"], __conf["id-head"]]
     rq_names = [__conf["name-rq-sensor"], __conf["name-get"], __conf["name-post"], __conf["name-patch"], __conf["name-put"], __conf["name-delete"], __conf["name-head"]]
 
+    @staticmethod
+    def _load_custom_entities():
+        """Return the parsed custom entities yaml file. The result is cached until the file has been changed"""
+        yaml_path = Setup.__conf["yaml_path"]
+        try:
+            mtime = os.path.getmtime(yaml_path)
+        except Exception:
+            # Fallback to direct read if stat fails
+            mtime = None
+
+        # Use cache if file hasn't changed to improve performance
+        if mtime is not None and Setup._custom_entities_cache is not None and Setup._custom_entities_cache_mtime == mtime:
+            return Setup._custom_entities_cache
+
+        with open(yaml_path, "r", encoding="utf-8") as f:
+            raw = safe_load(f)
+        if mtime is not None:
+            Setup._custom_entities_cache = raw
+            Setup._custom_entities_cache_mtime = mtime
+        return raw
+
     @staticmethod
     def get(key, python_dict: bool = False):
-        """Get the value from the specified key in __conf as string or dict from _custom_entities that can also be returned as a string"""
+        """Get the value from the specified key in __conf as string or dict from _custom_entities that can also be returned as a string.
+        The rate limits from the _hosts block of the custom entities can be returned as dict with custom_entities_hosts
+        and the login endpoints from the _auth block with custom_entities_auth"""
         if python_dict:
             if key == "custom_entities":
-                yaml_path = Setup.__conf["yaml_path"]
-                try:
-                    mtime = os.path.getmtime(yaml_path)
-                except Exception:
-                    # Fallback to direct read if stat fails
-                    mtime = None
-
-                # Use cache if file hasn't changed to improve performance
-                if mtime is not None and Setup._custom_entities_cache is not None and Setup._custom_entities_cache_mtime == mtime:
-                    raw = Setup._custom_entities_cache
-                else:
-                    with open(yaml_path, "r", encoding="utf-8") as f:
-                        raw = safe_load(f)
-                    if mtime is not None:
-                        Setup._custom_entities_cache = raw
-                        Setup._custom_entities_cache_mtime = mtime
+                raw = Setup._load_custom_entities()
 
-                # Work on a shallow copy to avoid mutating the cache when popping _vars
+                # Work on a shallow copy to avoid mutating the cache when popping _vars, _hosts and _auth
                 if isinstance(raw, dict):
                     raw_copy = raw.copy()
                     variables = raw_copy.pop("_vars", {})
+                    raw_copy.pop("_hosts", None)
+                    raw_copy.pop("_auth", None)
                 else:
                     raw_copy = raw
                     variables = {}
@@ -407,6 +618,26 @@ class Setup:
                     _LOG.debug("Getting variables from _vars block in custom entities yaml configuration")
 
                 return substitute_yaml_vars(raw_copy, variables)
+            if key == "custom_entities_hosts":
+                if not Setup.__conf["custom_entities_set"]:
+                    return {}
+                raw = Setup._load_custom_entities()
+                if not isinstance(raw, dict) or not raw.get("_hosts"):
+                    return {}
+                # Host names can also be defined as variables. Use lower case host names like in the command targets
+                hosts = {}
+                for host, limits in raw["_hosts"].items():
+                    host = substitute_yaml_vars(str(host), raw.get("_vars") or {})
+                    hosts[host if host.startswith("unix:") else host.lower()] = limits
+                return hosts
+            if key == "custom_entities_auth":
+                if not Setup.__conf["custom_entities_set"]:
+                    return {}
+                raw = Setup._load_custom_entities()
+                if not isinstance(raw, dict) or not raw.get("_auth"):
+                    return {}
+                # Login endpoints, credentials and url prefixes can also use variables
+                return substitute_yaml_vars(raw["_auth"], raw.get("_vars") or {})
             raise ValueError(key + " can not only be returned as a string")
         if key == "custom_entities":
             yaml_path = Setup.__conf["yaml_path"]
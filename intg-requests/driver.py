@@ -12,10 +12,16 @@ import ucapi
 
 import config
 import media_player
+import metrics
+import profiler
+import recorder
 import remote
 import selects
+import sensor
 import setup
 import i18n
+import loop_monitor
+import workers
 
 _LOG = logging.getLogger("driver")  # avoid having __main__ in log messages
 
@@ -72,6 +78,8 @@ async def add_mp(entity_id: str, entity_name: str):
 
 
 
+@recorder.recorded
+@workers.interactive
 async def mp_cmd_handler(entity: ucapi.MediaPlayer, cmd_id: str, _params: dict[str, Any] | None) -> ucapi.StatusCodes:
     """
     Media Player command handler.
@@ -95,7 +103,7 @@ async def mp_cmd_handler(entity: ucapi.MediaPlayer, cmd_id: str, _params: dict[s
 
 async def add_custom_entities(custom_entities: dict[str, Any]) -> None:
     """
-    Adds custom remote and optional select entities using the custom entities configuration.
+    Adds custom remote and optional select and response sensor entities using the custom entities configuration.
 
     :param custom_entities: dictionary of custom entities
     """
@@ -160,6 +168,12 @@ async def add_custom_entities(custom_entities: dict[str, Any]) -> None:
 
             api.available_entities.add(select_definition)
 
+        # Add a sensor entity for each response sensor of the entity
+        for sensor_name in (entity_config.get("Sensors", {}) or {}):
+            sensor_entity_id = sensor.entity_sensor_id(entity_id, sensor_name)
+            _LOG.info(f"Adding response sensor entity \"{sensor_entity_id}\"")
+            await sensor.add_entity_sensor(sensor_entity_id, f"{entity_name} - {sensor_name}", entity_name)
+
 
 
 @api.listens_to(ucapi.Events.CONNECT)
@@ -317,6 +331,20 @@ def setup_logger():
     logging.getLogger("setup").setLevel(level)
     logging.getLogger("config").setLevel(level)
     logging.getLogger("i18n").setLevel(level)
+    logging.getLogger("metrics").setLevel(level)
+    logging.getLogger("timing").setLevel(level)
+    logging.getLogger("recorder").setLevel(level)
+    logging.getLogger("profiler").setLevel(level)
+    logging.getLogger("loop_monitor").setLevel(level)
+    logging.getLogger("workers").setLevel(level)
+    logging.getLogger("entity_queue").setLevel(level)
+    logging.getLogger("breaker").setLevel(level)
+    logging.getLogger("ratelimit").setLevel(level)
+    logging.getLogger("fire_and_forget").setLevel(level)
+    logging.getLogger("singleflight").setLevel(level)
+    logging.getLogger("response_cache").setLevel(level)
+    logging.getLogger("safe_regex").setLevel(level)
+    logging.getLogger("auth").setLevel(level)
     logging.getLogger("getmac").setLevel(level)
 
 
@@ -376,6 +404,12 @@ async def main():
     await setup.init()
     await startcheck()
 
+    recorder.start()
+    profiler.setup(loop)
+    loop_monitor.start(loop)
+    loop.create_task(metrics.summary_task())
+    await metrics.start_server()
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""Module that executes the commands of each custom entity one after another with coalesce and supersede semantics"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+import ucapi
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_ENABLED = os.getenv("UC_ENTITY_QUEUE", "true").lower() in ("true", "1")
+_COALESCE = os.getenv("UC_ENTITY_QUEUE_COALESCE", "true").lower() in ("true", "1")
+_MAX_DEPTH = int(os.getenv("UC_ENTITY_QUEUE_SIZE", "10"))
+
+
+
+class _Job:
+    """A queued command. count is the number of identical commands that have been coalesced into this job"""
+
+    __slots__ = ("run", "future", "context", "coalesce", "supersede", "count")
+
+    def __init__(self, run: Callable[[int], Awaitable[ucapi.StatusCodes]], coalesce: Hashable | None, supersede: Hashable | None):
+        self.run = run
+        self.future = asyncio.get_running_loop().create_future()
+        self.context = contextvars.copy_context()
+        self.coalesce = coalesce
+        self.supersede = supersede
+        self.count = 1
+
+
+
+class _State:
+    """Pending commands per entity and counters since start"""
+
+    queues: dict[str, deque[_Job]] = {}
+    tasks: dict[str, asyncio.Task] = {}
+    coalesced = 0
+    superseded = 0
+    rejected = 0
+    gauge_registered = False
+
+
+
+def enabled() -> bool:
+    """Return True if commands are queued per entity. Can be deactivated by setting UC_ENTITY_QUEUE to false"""
+    return _ENABLED
+
+
+
+async def _worker(queue_id: str):
+    """Execute all pending commands of an entity one after another"""
+    queue = _State.queues[queue_id]
+    loop = asyncio.get_running_loop()
+    try:
+        while queue:
+            job = queue.popleft()
+            try:
+                # Run each command in the context of the caller to keep per-command context variables like the command recording
+                cmd_status = await loop.create_task(job.run(job.count), context=job.context)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                if asyncio.current_task().cancelling():
+                    # The integration is stopped. Don't let the callers of the pending commands wait forever
+                    for pending in queue:
+                        pending.future.cancel()
+                    queue.clear()
+                    raise
+                _LOG.debug(f"A command for {queue_id} has been cancelled. Executing the next pending command")
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(cmd_status)
+    finally:
+        del _State.queues[queue_id]
+        del _State.tasks[queue_id]
+
+
+
+async def submit(queue_id: str, run: Callable[[int], Awaitable[ucapi.StatusCodes]], coalesce: Hashable | None = None,
+                 supersede: Hashable | None = None) -> ucapi.StatusCodes:
+    """Add a command to the queue of an entity and return its status code once it has been executed.
+
+    :param queue_id: id of the entity whose commands are executed one after another
+    :param run: coroutine function that executes the command. Called with the number of identical commands that have been coalesced
+    :param coalesce: key of identical commands. A command with the same key that is still pending executes this command as well
+    :param supersede: key of commands that replace each other. Pending commands with the same key are dropped in favor of this command
+    """
+
+    if not _ENABLED:
+        return await run(1)
+
+    if not _State.gauge_registered:
+        _State.gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_entity_queue", "Pending commands of all entities and coalesced, superseded and rejected commands since start", stats)
+
+    queue = _State.queues.setdefault(queue_id, deque())
+
+    if coalesce is not None and _COALESCE:
+        for job in queue:
+            if job.coalesce == coalesce:
+                job.count += 1
+                _State.coalesced += 1
+                _LOG.debug(f"Coalesced command into a pending identical command for {queue_id} ({job.count} times)")
+                return await asyncio.shield(job.future)
+
+    if supersede is not None:
+        for job in [job for job in queue if job.supersede == supersede]:
+            queue.remove(job)
+            job.future.set_result(ucapi.StatusCodes.OK)
+            _State.superseded += 1
+            _LOG.info(f"Dropped a pending command for {queue_id} as it has been superseded by a newer command")
+
+    if len(queue) >= _MAX_DEPTH:
+        _State.rejected += 1
+        _LOG.error(f"Rejected command for {queue_id} as {len(queue)} commands are already waiting to be executed")
+        return ucapi.StatusCodes.CONFLICT
+
+    job = _Job(run, coalesce, supersede)
+    queue.append(job)
+    if queue_id not in _State.tasks:
+        _State.tasks[queue_id] = asyncio.create_task(_worker(queue_id))
+    return await asyncio.shield(job.future)
+
+
+
+def stats() -> dict[str, Any]:
+    """Return the number of pending commands of all entities as well as coalesced, superseded and rejected commands since start"""
+    return {"pending": sum(len(queue) for queue in _State.queues.values()), "coalesced": _State.coalesced,
+            "superseded": _State.superseded, "rejected": _State.rejected}
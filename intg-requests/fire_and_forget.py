@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""Module that executes fire and forget commands in the background after their status code has already been returned.
+Commands for the same target are executed one after another in the order they have been received"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable
+
+import ucapi
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_QUEUE_SIZE = int(os.getenv("UC_FIRE_AND_FORGET_QUEUE", "64"))
+
+
+
+class _State:
+    """Pending commands per target and counters since start"""
+
+    queues: dict[str, deque[tuple[Callable[[], Awaitable[ucapi.StatusCodes]], str]]] = {}
+    tasks: dict[str, asyncio.Task] = {}
+    pending = 0
+    completed = 0
+    failed = 0
+    overflow = 0
+    gauge_registered = False
+
+
+
+async def _worker(target: str):
+    """Execute all pending commands of a target one after another and log failed commands"""
+    queue = _State.queues[target]
+    try:
+        while queue:
+            run, description = queue.popleft()
+            _State.pending -= 1
+            try:
+                cmd_status = await run()
+            except Exception as e:
+                _LOG.error(f"Fire and forget {description} failed: {e}")
+                _State.failed += 1
+                continue
+            if cmd_status == ucapi.StatusCodes.OK:
+                _State.completed += 1
+            else:
+                _LOG.warning(f"Fire and forget {description} failed with status code {int(cmd_status)}")
+                _State.failed += 1
+    finally:
+        del _State.queues[target]
+        del _State.tasks[target]
+
+
+
+def submit(target: str, run: Callable[[], Awaitable[ucapi.StatusCodes]], description: str) -> bool:
+    """Queue a command for execution in the background. Returns False if UC_FIRE_AND_FORGET_QUEUE commands are already waiting
+    and the command should be executed directly instead.
+
+    :param target: target of the command. Commands with the same target are executed one after another
+    :param run: coroutine function that executes the command and returns its status code
+    :param description: description of the command for log messages
+    """
+
+    if not _State.gauge_registered:
+        _State.gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_fire_and_forget", "Pending fire and forget commands and completed, failed and directly executed commands since start",
+                                         lambda: {"pending": _State.pending, "completed": _State.completed, "failed": _State.failed, "overflow": _State.overflow})
+
+    if _State.pending >= _QUEUE_SIZE:
+        _State.overflow += 1
+        return False
+
+    _State.queues.setdefault(target, deque()).append((run, description))
+    _State.pending += 1
+    if target not in _State.tasks:
+        # Start with an empty context to not mix up the context of the command handler (e.g. the command recording)
+        # with the background execution. Blocking work of background commands uses the background lane of the worker threads
+        _State.tasks[target] = asyncio.get_running_loop().create_task(_worker(target), context=contextvars.Context())
+    return True
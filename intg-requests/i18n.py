@@ -24,6 +24,7 @@ class Messages(StrEnum):
     """Defines all messages used in the integration"""
 
     NO_MATCH = "no_match_found"
+    REGEX_TIMEOUT = "regex_timeout"
 
 
 
@@ -33,13 +34,15 @@ class Strings:
     class en_US:
         """Defines localized strings for English (United States)"""
         messages = {
-            Messages.NO_MATCH: "No match found"
+            Messages.NO_MATCH: "No match found",
+            Messages.REGEX_TIMEOUT: "Parsing the response took too long"
         }
 
     class de_DE:
         """Defines localized strings for German (Germany)"""
         messages = {
-            Messages.NO_MATCH: "Keine Übereinstimmung gefunden"
+            Messages.NO_MATCH: "Keine Übereinstimmung gefunden",
+            Messages.REGEX_TIMEOUT: "Auswertung der Antwort hat zu lange gedauert"
             }
 
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""Module with compiled JSON path expressions like $.status.volume or $.inputs[0]['name'] that are used instead of a
+regular expression to extract a value from a json response. The document is only parsed until the path has been found"""
+
+import functools
+import json
+import re
+from json.decoder import scanstring
+from typing import Any
+
+_STEP = re.compile(r"\.([A-Za-z_][\w-]*)|\[(\d+)\]|\['([^']*)'\]|\[\"([^\"]*)\"\]")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+
+def is_json_path(expression: str) -> bool:
+    """Return True if a response expression is a JSON path instead of a regular expression"""
+    return isinstance(expression, str) and expression.startswith(("$.", "$["))
+
+
+
+class JsonPath:
+    """A parsed JSON path. Keys are str steps and array indexes are int steps"""
+
+    def __init__(self, expression: str):
+        """:raises ValueError: If the expression is not a supported JSON path"""
+        self.expression = expression
+        self.steps: list[str | int] = []
+
+        position = 1
+        while position < len(expression):
+            match = _STEP.match(expression, position)
+            if not match:
+                raise ValueError(f"Invalid JSON path {expression} at position {position}. Use keys like $.key or $['key'] and array indexes like $[0]")
+            key, index, single_quoted, double_quoted = match.groups()
+            if index is not None:
+                self.steps.append(int(index))
+            else:
+                self.steps.append(next(step for step in (key, single_quoted, double_quoted) if step is not None))
+            position = match.end()
+
+    def find(self, document: str, partial: bool = False) -> tuple[bool, Any]:
+        """Return True and the value of the path in a json document or False and None if the path doesn't exist.
+        Values that are not on the path are skipped and the rest of the document is not parsed once the value has been found.
+        With partial the document can be incomplete, e.g. while it's still being received. A value is only returned
+        if it is followed by another character to not return a truncated number
+
+        :raises ValueError: If the document is not valid json or is incomplete without partial
+        """
+        try:
+            idx = _skip(document, 0)
+            for step in self.steps:
+                idx = _find_index(document, idx, step) if isinstance(step, int) else _find_key(document, idx, step)
+                if idx is None:
+                    return False, None
+            value, end = _DECODER.raw_decode(document, idx)
+        except IndexError as e:
+            raise ValueError("Incomplete json document") from e
+        if partial and end >= len(document):
+            raise ValueError("The value could be incomplete")
+        return True, value
+
+    def resolve(self, document: Any) -> tuple[bool, Any]:
+        """Return True and the value of the path in an already parsed json document or False and None if the path doesn't exist"""
+        value = document
+        for step in self.steps:
+            if isinstance(step, int):
+                if not isinstance(value, list) or step >= len(value):
+                    return False, None
+            elif not isinstance(value, dict) or step not in value:
+                return False, None
+            value = value[step]
+        return True, value
+
+
+
+@functools.lru_cache(maxsize=32)
+def compile_path(expression: str) -> JsonPath:
+    """Return the parsed JSON path for an expression. Parsed paths are cached as the expression comes from the configuration
+
+    :raises ValueError: If the expression is not a supported JSON path
+    """
+    return JsonPath(expression)
+
+
+
+def to_text(value: Any) -> str:
+    """Return a found value as sensor text. Strings are used as they are and all other values as json"""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+
+def _skip(document: str, idx: int) -> int:
+    return _WHITESPACE.match(document, idx).end()
+
+
+
+def _skip_value(document: str, idx: int) -> int:
+    """Return the position after the value that starts at idx"""
+    _, end = _DECODER.raw_decode(document, idx)
+    return _skip(document, end)
+
+
+
+def _find_key(document: str, idx: int, key: str) -> int | None:
+    """Return the start of the value of a key in the object at idx or None if it's not an object or doesn't contain the key"""
+    if document[idx] != "{":
+        return None
+    idx = _skip(document, idx + 1)
+    if document[idx] == "}":
+        return None
+    while True:
+        if document[idx] != "\"":
+            raise ValueError(f"Expected a key at position {idx}")
+        name, idx = scanstring(document, idx + 1)
+        idx = _skip(document, idx)
+        if document[idx] != ":":
+            raise ValueError(f"Expected ':' at position {idx}")
+        idx = _skip(document, idx + 1)
+        if name == key:
+            return idx
+        idx = _skip_value(document, idx)
+        if document[idx] == "}":
+            return None
+        if document[idx] != ",":
+            raise ValueError(f"Expected ',' or '}}' at position {idx}")
+        idx = _skip(document, idx + 1)
+
+
+
+def _find_index(document: str, idx: int, index: int) -> int | None:
+    """Return the start of an element in the array at idx or None if it's not an array or has less elements"""
+    if document[idx] != "[":
+        return None
+    idx = _skip(document, idx + 1)
+    if document[idx] == "]":
+        return None
+    for _ in range(index):
+        idx = _skip_value(document, idx)
+        if document[idx] == "]":
+            return None
+        if document[idx] != ",":
+            raise ValueError(f"Expected ',' or ']' at position {idx}")
+        idx = _skip(document, idx + 1)
+    return idx
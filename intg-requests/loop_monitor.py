@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""Module that continuously measures the event loop lag and logs the stack of code that blocks the event loop"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_ENABLED = os.getenv("UC_LOOP_MONITOR", "false").lower() in ("true", "1")
+_INTERVAL = float(os.getenv("UC_LOOP_MONITOR_INTERVAL", "0.5"))
+_THRESHOLD = float(os.getenv("UC_SLOW_CALLBACK_MS", "100")) / 1000
+_SUMMARY_INTERVAL = float(os.getenv("UC_METRICS_LOG_INTERVAL", "300"))
+
+
+
+class _State:
+    """Lag measurements shared between the event loop and the watchdog thread"""
+
+    expected = 0.0
+    last_lag = 0.0
+    blocked = 0
+    histogram = None
+    window = None
+    last_summary = 0.0
+
+
+
+def enabled() -> bool:
+    """Return True if the event loop is monitored. Deactivated by default and activated by setting UC_LOOP_MONITOR to true"""
+    return _ENABLED
+
+
+
+def _tick(loop: asyncio.AbstractEventLoop):
+    """Called by the event loop every interval. The time since the scheduled time is the event loop lag"""
+    now = time.monotonic()
+    lag = max(0.0, now - _State.expected)
+    _State.last_lag = lag
+    _State.histogram.record(lag * 1_000_000)
+    _State.window.record(lag * 1_000_000)
+
+    if _SUMMARY_INTERVAL > 0 and now - _State.last_summary >= _SUMMARY_INTERVAL:
+        _State.last_summary = now
+        log_summary()
+
+    _State.expected = now + _INTERVAL
+    loop.call_later(_INTERVAL, _tick, loop)
+
+
+
+def _watchdog(loop_thread_id: int):
+    """Runs in a separate thread and logs the current stack of the event loop thread if it hasn't run the next tick in time"""
+    reported = 0.0
+    check = _THRESHOLD / 2
+    while True:
+        time.sleep(check)
+        expected = _State.expected
+        blocked = time.monotonic() - expected
+        if blocked > _THRESHOLD and expected != reported:
+            reported = expected
+            _State.blocked += 1
+            frame = sys._current_frames().get(loop_thread_id) # pylint: disable=protected-access
+            stack = "".join(traceback.format_stack(frame)) if frame else "Stack not available"
+            _LOG.warning(f"The event loop has been blocked for more than {blocked * 1000:.0f} ms. Current stack of the event loop thread:\n{stack}")
+
+
+
+def log_summary():
+    """Log the event loop lag percentiles since the last summary"""
+    if _State.window is None or _State.window.count == 0:
+        return
+    message = f"Event loop lag: {_State.window.describe()} | blocked {_State.blocked} times since start"
+    if _State.window.max / 1_000_000 > _THRESHOLD:
+        _LOG.info(message)
+    else:
+        _LOG.debug(message)
+    _State.window = metrics.Histogram()
+
+
+
+def lag() -> dict[str, float]:
+    """Return the last measured event loop lag as well as percentiles and the maximum since the start in seconds"""
+    values = {"last": _State.last_lag}
+    if _State.histogram is None:
+        return values
+    for p in metrics.PERCENTILES:
+        values[f"p{p}"] = _State.histogram.percentile(p) / 1_000_000
+    values["max"] = _State.histogram.max / 1_000_000
+    return values
+
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    """Start measuring the event loop lag and watching for blocking code. The lag is measured every UC_LOOP_MONITOR_INTERVAL seconds (default 0.5)
+    and code that blocks the event loop for more than UC_SLOW_CALLBACK_MS milliseconds (default 100) is logged with its stack"""
+
+    if not _ENABLED:
+        _LOG.debug("Event loop monitor is disabled")
+        return
+
+    # Created here as metrics indirectly imports the driver module which imports this module
+    _State.histogram = metrics.Histogram()
+    _State.window = metrics.Histogram()
+    _State.expected = time.monotonic() + _INTERVAL
+    _State.last_summary = time.monotonic()
+    loop.call_later(_INTERVAL, _tick, loop)
+    threading.Thread(target=_watchdog, args=(threading.get_ident(),), name="loop-monitor", daemon=True).start()
+
+    metrics.Collector.register_gauge("uc_requests_event_loop_lag_seconds", "Event loop scheduling lag (last value, percentiles and maximum since start)", lag)
+    metrics.Collector.register_gauge("uc_requests_event_loop_blocked", "Number of times the event loop has been blocked for longer than the slow callback threshold",
+                                     lambda: _State.blocked)
+    _LOG.debug(f"Monitoring event loop lag every {_INTERVAL:g} s with a slow callback threshold of {_THRESHOLD * 1000:g} ms")
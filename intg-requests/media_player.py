@@ -2,7 +2,6 @@
 
 """Module that includes the media player command assigner thats sends parameters to the commands module depending on the passed entity id"""
 
-import asyncio
 import logging
 from typing import Any
 
@@ -30,12 +29,8 @@ async def mp_cmd_assigner(entity_id: str, cmd_name: str, params: dict[str, Any]
     if entity_id in config.Setup.rq_ids:
         if cmd_name == ucapi.media_player.Commands.SELECT_SOURCE:
             method = entity_id.replace("http-", "")
-
-            # Use asyncio.gather() to run the function in a separate thread and use asyncio.sleep(0) to prevent blocking the event loop
-            # This is needed because the Python requests library is blocking and we want to run it in a non-blocking way
-            cmd_status = await asyncio.gather(asyncio.to_thread(commands.http_request, method, cmd_param), asyncio.sleep(0))
-            #Return the return value of rq_cmd which is the first command in asyncio.gather()
-            return cmd_status[0]
+            cmd_status = await commands.execute(method, cmd_param, entity_id)
+            return cmd_status
 
         _LOG.error("Command not implemented: " + cmd_name)
         return ucapi.StatusCodes.NOT_IMPLEMENTED
@@ -44,7 +39,7 @@ async def mp_cmd_assigner(entity_id: str, cmd_name: str, params: dict[str, Any]
 
     if entity_id == config.Setup.get("id-wol"):
         if cmd_name == ucapi.media_player.Commands.SELECT_SOURCE:
-            cmd_status = await commands.wol(cmd_param)
+            cmd_status = await commands.execute("wol", cmd_param, entity_id)
             return cmd_status
 
         _LOG.error("Command not implemented: " + cmd_name)
@@ -54,7 +49,7 @@ async def mp_cmd_assigner(entity_id: str, cmd_name: str, params: dict[str, Any]
 
     if entity_id == config.Setup.get("id-tcp-text"):
         if cmd_name == ucapi.media_player.Commands.SELECT_SOURCE:
-            cmd_status = await commands.tcp_text(cmd_param)
+            cmd_status = await commands.execute("tcp-text", cmd_param, entity_id)
             return cmd_status
 
         _LOG.error("Command not implemented: " + cmd_name)
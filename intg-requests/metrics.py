@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+"""Module that collects command latency histograms and provides percentile summaries"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+from typing import Callable
+from urllib.parse import urlsplit
+
+import ucapi
+
+import config
+import response_cache
+import sensor
+import timing
+import workers
+
+_LOG = logging.getLogger(__name__)
+
+# Log-linear bucket layout similar to HdrHistogram with 2 significant digits (max. ~1.6% relative error)
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+
+PERCENTILES = (50, 95, 99)
+_MAX_SERIES = max(1, int(os.getenv("UC_METRICS_MAX_SERIES", "200")))
+OTHER = "other" # Label of commands that are recorded after UC_METRICS_MAX_SERIES histograms have been created
+
+
+
+class Histogram:
+    """HDR-style histogram for latency values in microseconds. Only used buckets are stored to keep the memory usage small"""
+
+    __slots__ = ("counts", "count", "total", "max", "errors")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.errors = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < _SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - _SUB_BUCKET_BITS
+        return _SUB_BUCKET_COUNT + (shift - 1) * _SUB_BUCKET_HALF + (value >> shift) - _SUB_BUCKET_HALF
+
+    @staticmethod
+    def _upper_bound(index: int) -> int:
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift = (index - _SUB_BUCKET_COUNT) // _SUB_BUCKET_HALF + 1
+        mantissa = (index - _SUB_BUCKET_COUNT) % _SUB_BUCKET_HALF + _SUB_BUCKET_HALF
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int, error: bool = False):
+        """Add a latency value in microseconds to the histogram"""
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if error:
+            self.errors += 1
+
+    def merge(self, other: "Histogram"):
+        """Add all values from another histogram to this histogram"""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.errors += other.errors
+
+    def percentile(self, percent: float) -> int:
+        """Return the latency value in microseconds at the given percentile"""
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def describe(self) -> str:
+        """Return a short human readable percentile summary of this histogram"""
+        values = " ".join(f"p{p}={self.percentile(p) / 1000:.1f}ms" for p in PERCENTILES)
+        return f"n={self.count} errors={self.errors} {values} max={self.max / 1000:.1f}ms"
+
+
+
+class Collector:
+    """Collects latency histograms for all executed commands labelled by command type, target host and entity id"""
+
+    _histograms: dict[tuple[str, str, str], Histogram] = {}
+    _recorded_since_summary = 0
+    _series_capped = False
+    _inflight: dict[str, int] = {}
+    _gauges: dict[str, tuple[str, Callable[[], float | dict[str, float]]]] = {}
+
+    @classmethod
+    def command_started(cls, cmd_type: str):
+        """Count a command as in-flight until it has been recorded"""
+        cls._inflight[cmd_type] = cls._inflight.get(cmd_type, 0) + 1
+
+    @classmethod
+    def record(cls, cmd_type: str, host: str, entity_id: str, duration: float, cmd_status: ucapi.StatusCodes):
+        """Record the end-to-end duration in seconds and status of a command. Hosts are labelled as host:port.
+        Commands with a new label combination are combined in an "other" histogram per command type
+        after UC_METRICS_MAX_SERIES histograms have been created to limit the memory usage and the size of the metrics endpoint"""
+        key = (cmd_type, host_label(host), entity_id)
+        histogram = cls._histograms.get(key)
+        if histogram is None:
+            if len(cls._histograms) >= _MAX_SERIES:
+                if not cls._series_capped:
+                    cls._series_capped = True
+                    _LOG.warning(f"Recorded commands with {_MAX_SERIES} different command types, hosts and entities. Further combinations are \
+recorded with the host and entity {OTHER}. Change the limit with UC_METRICS_MAX_SERIES")
+                key = (cmd_type, OTHER, OTHER)
+                histogram = cls._histograms.get(key)
+            if histogram is None:
+                histogram = cls._histograms[key] = Histogram()
+        histogram.record(duration * 1_000_000, cmd_status != ucapi.StatusCodes.OK)
+        cls._recorded_since_summary += 1
+        if cls._inflight.get(cmd_type):
+            cls._inflight[cmd_type] -= 1
+
+    @classmethod
+    def inflight(cls) -> dict[str, int]:
+        """Return the number of currently running commands per command type"""
+        return cls._inflight
+
+    @classmethod
+    def register_gauge(cls, name: str, description: str, callback: Callable[[], float | dict[str, float]]):
+        """Register a gauge that is exported by the metrics endpoint. The callback returns either a single value
+        or a dict with the value of a "name" label as key"""
+        cls._gauges[name] = (description, callback)
+
+    @classmethod
+    def gauges(cls) -> dict[str, tuple[str, Callable[[], float | dict[str, float]]]]:
+        """Return all registered gauges"""
+        return cls._gauges
+
+    @classmethod
+    def histograms(cls) -> dict[tuple[str, str, str], Histogram]:
+        """Return all histograms by (command type, host, entity id)"""
+        return cls._histograms
+
+    @classmethod
+    def total(cls) -> Histogram:
+        """Return a histogram with the values of all commands"""
+        total = Histogram()
+        for histogram in cls._histograms.values():
+            total.merge(histogram)
+        return total
+
+    @classmethod
+    def log_summary(cls):
+        """Log a percentile summary for each command type, host and entity and update the latency sensor entity"""
+        if cls._recorded_since_summary == 0:
+            return
+        cls._recorded_since_summary = 0
+
+        _LOG.info("Command latency summary:")
+        for (cmd_type, host, entity_id), histogram in sorted(cls._histograms.items()):
+            _LOG.info(f"  {cmd_type} {host} ({entity_id}): {histogram.describe()}")
+
+        total = cls.total()
+        value = " | ".join(f"p{p} {total.percentile(p) / 1000:.0f} ms" for p in PERCENTILES)
+        value += f" | max {total.max / 1000:.0f} ms | {total.errors} errors ({total.count} commands)"
+        try:
+            sensor.update_latency_sensor(config.Setup.get("id-latency-sensor"), value)
+        except Exception as e:
+            _LOG.error(e)
+
+
+
+async def summary_task():
+    """Periodically log the latency summary. The interval in seconds can be changed with UC_METRICS_LOG_INTERVAL (0 = disabled)"""
+
+    interval = float(os.getenv("UC_METRICS_LOG_INTERVAL", "300"))
+    if interval <= 0:
+        _LOG.debug("Periodic command latency summary is disabled")
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        Collector.log_summary()
+        workers.log_summary()
+        response_cache.log_summary()
+        if timing.enabled():
+            timing.log_history()
+
+
+
+def host_label(target: str) -> str:
+    """Return the host:port of a command target that can also be a url or contain a path or parameters. Unix sockets are labelled with their path"""
+    target = str(target)
+    if target.startswith("unix:"):
+        return target
+    if "://" in target:
+        try:
+            parts = urlsplit(target)
+            return f"{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+        except ValueError:
+            return OTHER
+    return target.split("/", 1)[0].split("?", 1)[0].lower()
+
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+
+def render_prometheus() -> str:
+    """Return all metrics in the Prometheus text exposition format"""
+
+    lines = [
+        "# HELP uc_requests_command_latency_seconds End-to-end latency of executed commands",
+        "# TYPE uc_requests_command_latency_seconds summary",
+    ]
+    counters = []
+    for (cmd_type, host, entity_id), histogram in sorted(Collector.histograms().items()):
+        labels = f'type="{_label(cmd_type)}",host="{_label(host)}",entity="{_label(entity_id)}"'
+        for p in PERCENTILES:
+            lines.append(f'uc_requests_command_latency_seconds{{{labels},quantile="{p / 100}"}} {histogram.percentile(p) / 1_000_000}')
+        lines.append(f"uc_requests_command_latency_seconds_sum{{{labels}}} {histogram.total / 1_000_000}")
+        lines.append(f"uc_requests_command_latency_seconds_count{{{labels}}} {histogram.count}")
+        counters.append(f"uc_requests_command_errors_total{{{labels}}} {histogram.errors}")
+
+    lines.append("# HELP uc_requests_command_errors_total Executed commands that did not return an OK status code")
+    lines.append("# TYPE uc_requests_command_errors_total counter")
+    lines.extend(counters)
+
+    lines.append("# HELP uc_requests_commands_in_flight Currently running commands")
+    lines.append("# TYPE uc_requests_commands_in_flight gauge")
+    for cmd_type, count in sorted(Collector.inflight().items()):
+        lines.append(f'uc_requests_commands_in_flight{{type="{_label(cmd_type)}"}} {count}')
+
+    for name, (description, callback) in sorted(Collector.gauges().items()):
+        try:
+            value = callback()
+        except Exception as e:
+            _LOG.debug(f"Could not get value for gauge {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for label, label_value in sorted(value.items()):
+                lines.append(f'{name}{{name="{_label(label)}"}} {label_value}')
+        else:
+            lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Skip all request headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            body = render_prometheus().encode("utf-8")
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"Not found\n"
+            status = "404 Not Found"
+            content_type = "text/plain; charset=utf-8"
+
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+    except Exception as e:
+        _LOG.debug(f"Error while handling metrics request: {e}")
+    finally:
+        writer.close()
+
+
+
+async def start_server():
+    """Start the Prometheus metrics endpoint on the running event loop if a port has been set with UC_METRICS_PORT"""
+
+    port = os.getenv("UC_METRICS_PORT")
+    if not port:
+        _LOG.debug("Metrics endpoint is disabled. Set UC_METRICS_PORT to activate it")
+        return
+
+    # The endpoint has no authentication. Only listen on other interfaces if this has been set explicitly
+    interface = os.getenv("UC_METRICS_INTERFACE", "127.0.0.1")
+    Collector.register_gauge("uc_requests_threads", "Active threads in the integration process", threading.active_count)
+
+    try:
+        await asyncio.start_server(_handle_metrics_request, interface, int(port))
+    except (OSError, ValueError) as e:
+        _LOG.error(f"Could not start metrics endpoint on {interface}:{port}: {e}")
+        return
+    _LOG.info(f"Serving Prometheus metrics on http://{interface}:{port}/metrics")
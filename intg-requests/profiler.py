@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""Module to record an on-demand cProfile capture of the event loop in the running integration"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+from datetime import datetime
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+_DURATION = float(os.getenv("UC_PROFILE_DURATION", "30"))
+_AT_START = os.getenv("UC_PROFILE_AT_START", "false").lower() in ("true", "1")
+_TOP = int(os.getenv("UC_PROFILE_TOP", "20"))
+
+_profile: cProfile.Profile | None = None
+
+
+
+def running() -> bool:
+    """Return True if a capture is currently recorded"""
+    return _profile is not None
+
+
+
+def start(duration: float | None = None) -> bool:
+    """Start recording a capture of the event loop thread for the given duration in seconds (default UC_PROFILE_DURATION or 30 seconds).
+    Has to be called from the event loop thread. Returns False if a capture is already running"""
+    global _profile
+
+    if _profile is not None:
+        _LOG.warning("A profiler capture is already running")
+        return False
+
+    duration = duration or _DURATION
+    _profile = cProfile.Profile()
+    _profile.enable()
+    asyncio.get_running_loop().call_later(duration, stop)
+    _LOG.info(f"Started profiler capture for {duration:g} seconds")
+    return True
+
+
+
+def stop() -> str | None:
+    """Stop the running capture, write it next to the config file and log the functions with the highest own execution time.
+    Returns the path of the capture file"""
+    global _profile
+
+    if _profile is None:
+        return None
+    profile = _profile
+    profile.disable()
+    _profile = None
+
+    cfg_dir = os.path.dirname(os.path.abspath(config.Setup.get("cfg_path")))
+    path = os.path.join(cfg_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof")
+    try:
+        profile.dump_stats(path)
+    except OSError as o:
+        _LOG.error(f"Could not write profiler capture to {path}: {o}")
+        path = None
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profile, stream=summary)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(_TOP)
+    _LOG.info(f"Profiler capture finished. Top {_TOP} functions by own time:\n{summary.getvalue()}")
+    if path:
+        _LOG.info(f"Profiler capture written to {path}. Open it with e.g. snakeviz or python -m pstats")
+    return path
+
+
+
+def setup(loop: asyncio.AbstractEventLoop):
+    """Start a capture when receiving SIGUSR1 and optionally right after the start of the integration if UC_PROFILE_AT_START is set"""
+
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, start)
+            _LOG.debug(f"Send SIGUSR1 to process {os.getpid()} to record a profiler capture")
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            _LOG.debug(f"Could not register profiler signal handler: {e}")
+
+    if _AT_START:
+        start()
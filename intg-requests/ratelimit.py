@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Module that limits the command rate per target host with token buckets configured in the _hosts block of the custom entities configuration"""
+
+import asyncio
+import logging
+import os
+import time
+
+import config
+import metrics
+import timing
+
+_LOG = logging.getLogger(__name__)
+
+_MAX_WAIT = float(os.getenv("UC_RATE_LIMIT_MAX_WAIT", "10"))
+
+# Status code of rejected commands. Not part of ucapi.StatusCodes but sent to the Remote like all other status codes
+TOO_MANY_REQUESTS = 429
+
+
+
+class _Bucket:
+    """Token bucket of a configured host. Only stores the available tokens and the time they have been calculated"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: int):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+
+
+_hosts: dict[str, tuple[float, int]] = {}
+_buckets: dict[str, _Bucket] = {}
+_throttled = 0
+_rejected = 0
+_gauge_registered = False
+
+
+
+def load():
+    """Read the rate limits from the _hosts block once after the custom entities have been (re)loaded
+    so commands only have to look up their target. Resets all buckets"""
+    global _hosts
+
+    try:
+        hosts = config.Setup.get("custom_entities_hosts", python_dict=True)
+    except Exception as e:
+        _LOG.error(f"Could not get host rate limits: {e}")
+        hosts = {}
+    _hosts = {host: (float(limits["rate"]), int(limits.get("burst", 1))) for host, limits in hosts.items()}
+    _buckets.clear()
+    if _hosts:
+        _LOG.debug(f"Loaded rate limits for {', '.join(_hosts)}")
+
+
+
+def _find_limit(target: str, hosts: dict) -> tuple[str, tuple[float, int]] | tuple[None, None]:
+    """Return the configured host entry and its limits for a command target. Entries with host:port are preferred over entries with only the host"""
+    if target in hosts:
+        return target, hosts[target]
+    host = target.rpartition(":")[0] if ":" in target and not target.startswith("unix:") else target
+    if host in hosts:
+        return host, hosts[host]
+    return None, None
+
+
+
+async def acquire(target: str) -> bool:
+    """Wait until the rate limit of the target host allows to send a command. Returns False without waiting
+    if the command would have to wait longer than UC_RATE_LIMIT_MAX_WAIT seconds"""
+    global _throttled, _rejected, _gauge_registered
+
+    if not _hosts:
+        return True
+
+    key, limits = _find_limit(target, _hosts)
+    if key is None:
+        return True
+
+    if not _gauge_registered:
+        _gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_rate_limited", "Commands that had to wait or have been rejected because of a host rate limit since start",
+                                         lambda: {"throttled": _throttled, "rejected": _rejected})
+
+    rate, burst = limits
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = _Bucket(burst)
+
+    now = time.monotonic()
+    bucket.tokens = min(float(burst), bucket.tokens + (now - bucket.updated) * rate)
+    bucket.updated = now
+
+    # Commands that have to wait reserve their token right away which lets the bucket go negative.
+    # This keeps the commands in the order they have been sent without having to store a queue
+    wait = (1 - bucket.tokens) / rate if bucket.tokens < 1 else 0
+    if wait > _MAX_WAIT:
+        _rejected += 1
+        _LOG.error(f"Rejected command for {target} as it would have to wait {wait:.1f} seconds because of the rate limit of {rate:g} commands per second")
+        return False
+    bucket.tokens -= 1
+
+    if wait > 0:
+        _throttled += 1
+        _LOG.debug(f"Delaying command for {target} by {wait * 1000:.0f} ms because of the rate limit of {rate:g} commands per second")
+        await asyncio.sleep(wait)
+        timing.lap("rate_limit")
+    return True
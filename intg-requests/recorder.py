@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Module that optionally records all received entity commands and their outcome to a rotating json lines file to be able
+to replay the real command traffic with benchmarks/replay.py"""
+
+import functools
+import json
+import logging
+import os
+import queue
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable
+
+_LOG = logging.getLogger(__name__)
+
+_FILE = os.getenv("UC_COMMAND_RECORD_FILE", "")
+_MAX_BYTES = int(os.getenv("UC_COMMAND_RECORD_MAX_BYTES", str(5 * 1024 * 1024)))
+_BACKUPS = int(os.getenv("UC_COMMAND_RECORD_BACKUPS", "3"))
+
+# Sum of all response sizes of the currently handled entity command. A list is used to be able to add sizes
+# from worker threads that run with a copy of the context
+_response_size: ContextVar[list[int] | None] = ContextVar("command_response_size", default=None)
+
+# Separate logger that only writes the records into the file without passing them to the integration log
+_RECORDS = logging.getLogger("recorder.records")
+_RECORDS.propagate = False
+_LISTENER = None
+
+
+
+def enabled() -> bool:
+    """Return True if entity commands are recorded. Can be activated by setting UC_COMMAND_RECORD_FILE to a file path"""
+    return bool(_FILE)
+
+
+
+def start():
+    """Start writing records into the record file in a background thread. Rotates the file when it reaches
+    UC_COMMAND_RECORD_MAX_BYTES (default 5 MB) and keeps UC_COMMAND_RECORD_BACKUPS (default 3) old files"""
+    global _LISTENER
+
+    if not _FILE or _LISTENER:
+        return
+
+    try:
+        handler = RotatingFileHandler(_FILE, maxBytes=_MAX_BYTES, backupCount=_BACKUPS, encoding="utf-8")
+    except OSError as o:
+        _LOG.error(f"Could not open command record file {_FILE}: {o}")
+        return
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    # File writes happen in the listener thread to not block the event loop
+    record_queue = queue.SimpleQueue()
+    _RECORDS.addHandler(QueueHandler(record_queue))
+    _RECORDS.setLevel(logging.INFO)
+    _LISTENER = QueueListener(record_queue, handler)
+    _LISTENER.start()
+    _LOG.info(f"Recording all entity commands to {_FILE}")
+
+
+
+def add_response_size(size: int):
+    """Add the size of a received device response in bytes to the currently recorded entity command"""
+    sizes = _response_size.get()
+    if sizes is not None:
+        sizes.append(size)
+
+
+
+def recorded(handler: Callable[[Any, str, dict | None], Awaitable[Any]]) -> Callable[[Any, str, dict | None], Awaitable[Any]]:
+    """Decorator for entity command handlers that records entity id, command, parameters, time, status code,
+    latency and the response size of each received command. Returns the unchanged handler if recording is deactivated"""
+
+    if not _FILE:
+        return handler
+
+    @functools.wraps(handler)
+    async def wrapper(entity, cmd_id: str, params: dict | None):
+        token = _response_size.set([])
+        received = time.time()
+        start = time.perf_counter()
+        status = None
+        try:
+            status = await handler(entity, cmd_id, params)
+            return status
+        finally:
+            record = {
+                "t": round(received, 3),
+                "entity": entity.id,
+                "cmd": cmd_id,
+                "params": params,
+                "status": int(status) if status is not None else None,
+                "ms": round((time.perf_counter() - start) * 1000, 2),
+                "bytes": sum(_response_size.get()),
+            }
+            _response_size.reset(token)
+            try:
+                _RECORDS.info(json.dumps(record, separators=(",", ":"), default=str))
+            except Exception as e:
+                _LOG.debug(f"Could not record command: {e}")
+
+    return wrapper
@@ -12,6 +12,10 @@ import ucapi
 import driver
 import config
 import commands
+import recorder
+import sensor
+import entity_queue
+import workers
 
 _LOG = logging.getLogger(__name__)
 
@@ -52,8 +56,32 @@ async def update_remote_state(entity_id: str, cmd_id: str):
 
 
 
-async def send_command(entity_id: str, entity_config: dict[str, Any], command: str = None) -> ucapi.StatusCodes:
-    """Send a command depending on the command type from the custom entities configuration"""
+def set_state(entity_id: str, state: ucapi.remote.States):
+    """Set the state of the remote entity from the response of a command with a response to state rule.
+    Also called from command worker threads"""
+
+    if driver.api.configured_entities.get(entity_id) is None:
+        _LOG.debug(f"Entity {entity_id} not found in configured entities. Skip updating attributes")
+        return
+
+    try:
+        sensor.update_attributes(entity_id, {ucapi.remote.Attributes.STATE: state})
+    except Exception as e:
+        raise Exception("Error while updating status attribute for entity id " + entity_id) from e
+
+    _LOG.info(f"Updated remote entity state to {state} from the command response for {entity_id}")
+
+
+
+def has_state_rule(entity_config: dict[str, Any], feature: str) -> bool:
+    """Return True if the state of the remote entity is set from the response of a feature command"""
+    return "State" in (entity_config.get("Features").get(feature.title()) or {})
+
+
+
+async def send_command(entity_id: str, entity_config: dict[str, Any], command: str = None, remote_id: str | None = None) -> ucapi.StatusCodes:
+    """Send a command depending on the command type from the custom entities configuration.
+    remote_id is the id of the remote entity if the command has been sent from one of its select entities"""
 
     features = entity_config.get("Features").keys()
     simple_commands = entity_config.get("Simple Commands").keys()
@@ -65,34 +93,16 @@ async def send_command(entity_id: str, entity_config: dict[str, Any], command: s
         # Use command.title() to match the corresponding entity feature spelling (first letter in upper case) for the command that is used in the entity config
         cmd_type = entity_config.get("Features").get(command.title()).get("Type")
         cmd_param = entity_config.get("Features").get(command.title()).get("Parameter")
+        state_rule = entity_config.get("Features").get(command.title()).get("State")
     elif command in simple_commands:
         cmd_type = entity_config.get("Simple Commands").get(command).get("Type")
         cmd_param = entity_config.get("Simple Commands").get(command).get("Parameter")
+        state_rule = entity_config.get("Simple Commands").get(command).get("State")
     else:
         _LOG.error(f"Feature or simple command {command} not configured in custom entity {entity_id}")
         return ucapi.StatusCodes.NOT_IMPLEMENTED
 
-    match cmd_type:
-        case "wol":
-            cmd_status = await commands.wol(cmd_param)
-
-        case "tcp-text":
-            cmd_status = await commands.tcp_text(cmd_param, entity_config)
-
-        case "get" | "post" | "put" | "delete" | "patch" | "head":
-            http_method = cmd_type
-            _LOG.info(f"Executing HTTP request with method {http_method} and parameter {cmd_param}")
-            # Use asyncio.gather() to run the function in a separate thread and use asyncio.sleep(0) to prevent blocking the event loop
-            # This is needed because the Python requests library is blocking and we want to run it in a non-blocking way
-            cmd_status = await asyncio.gather(asyncio.to_thread(commands.http_request, http_method, cmd_param), asyncio.sleep(0))
-            #Return the return value of rq_cmd which is the first command in asyncio.gather()
-            return cmd_status[0]
-
-        case _:
-            _LOG.error(f"Unknown command type {cmd_type} for custom entity {entity_id}")
-            return ucapi.StatusCodes.BAD_REQUEST
-
-    return cmd_status
+    return await commands.execute(cmd_type, cmd_param, entity_id, entity_config, state_rule=state_rule, remote_id=remote_id)
 
 
 
@@ -183,6 +193,8 @@ Remaining " + str(repeat-1) + " sequence repetition(s) will no longer be execute
 
 
 
+@recorder.recorded
+@workers.interactive
 async def custom_remote_cmd_handler(entity: ucapi.Remote, cmd_id: str, _params: dict[str, Any] | None) -> ucapi.StatusCodes:
     """
     Custom remote entity command handler.
@@ -216,16 +228,29 @@ async def custom_remote_cmd_handler(entity: ucapi.Remote, cmd_id: str, _params:
 
     match cmd_id:
         case ucapi.remote.Commands.ON | ucapi.remote.Commands.OFF | ucapi.remote.Commands.TOGGLE:
-            cmd_status = await send_command(entity_id=entity.id, entity_config=entity_config, command=cmd_id)
-            if cmd_status == ucapi.StatusCodes.OK:
-                await update_remote_state(entity_id=entity.id, cmd_id=cmd_id)
-            else:
-                _LOG.info(f"Command {cmd_id} for entity id {entity.id} failed. State will not be updated")
-            return cmd_status
+            async def power(_count: int) -> ucapi.StatusCodes:
+                cmd_status = await send_command(entity_id=entity.id, entity_config=entity_config, command=cmd_id)
+                if cmd_status != ucapi.StatusCodes.OK:
+                    _LOG.info(f"Command {cmd_id} for entity id {entity.id} failed. State will not be updated")
+                elif has_state_rule(entity_config, cmd_id):
+                    _LOG.debug(f"The state of {entity.id} has been set from the response of the {cmd_id} command")
+                else:
+                    await update_remote_state(entity_id=entity.id, cmd_id=cmd_id)
+                return cmd_status
+
+            # A newer on or off command replaces a pending older on or off command
+            supersede = "power" if cmd_id != ucapi.remote.Commands.TOGGLE else None
+            return await entity_queue.submit(entity.id, power, supersede=supersede)
 
         case ucapi.remote.Commands.SEND_CMD | ucapi.remote.Commands.SEND_CMD_SEQUENCE:
-            cmd_status = await handle_params(entity_id=entity.id, entity_config=entity_config, _params=_params)
-            return cmd_status
+            async def send(count: int) -> ucapi.StatusCodes:
+                params = _params
+                if count > 1:
+                    # Identical commands that were pressed while this command was waiting are sent as additional repetitions
+                    params = {**_params, "repeat": (_params.get("repeat") or 1) * count}
+                return await handle_params(entity_id=entity.id, entity_config=entity_config, _params=params)
+
+            return await entity_queue.submit(entity.id, send, coalesce=(cmd_id, repr(sorted((_params or {}).items()))))
 
         case _:
             _LOG.error(f"Command \"{cmd_id}\" not implemented for custom entities")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""Module with a size limited cache for the responses of http get and head requests that use the cache command parameter.
+Cached responses are revalidated with the ETag and Last-Modified headers of the device"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_MAX_SIZE = int(os.getenv("UC_RESPONSE_CACHE_SIZE", "1024")) * 1024
+_ENTRY_OVERHEAD = 200 # Rough size of an entry without the response body in bytes
+
+METHODS = ("get", "head")
+
+
+
+class Entry:
+    """A cached response with its validators"""
+
+    __slots__ = ("body", "etag", "last_modified", "stored", "size")
+
+    def __init__(self, body: str | bytes, etag: str | None, last_modified: str | None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored = time.monotonic()
+        self.size = (len(body) if isinstance(body, bytes) else len(body.encode("utf-8", "surrogateescape"))) + _ENTRY_OVERHEAD
+
+    def fresh(self, ttl: float) -> bool:
+        """Return True if the response has been stored or revalidated less than ttl seconds ago"""
+        return time.monotonic() - self.stored < ttl
+
+    def conditional_headers(self) -> dict[str, str]:
+        """Return the headers that let the device answer with 304 - Not Modified if the response didn't change"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+
+class _State:
+    """Cached responses in least recently used order and counters. Changed from worker threads so all access is locked"""
+
+    lock = threading.Lock()
+    entries: OrderedDict[Hashable, Entry] = OrderedDict()
+    size = 0
+    counts = {"hit": 0, "revalidated": 0, "miss": 0, "evicted": 0}
+    sensor_bodies: dict[str, str | bytes] = {}
+    gauge_registered = False
+
+
+
+def key(method: str, url: str, params: dict[str, Any]) -> Hashable:
+    """Return the cache key of a request. Requests are only identical if the method, url and all parameters are the same"""
+    return method, url, repr(sorted(params.items()))
+
+
+
+def get(cache_key: Hashable) -> Entry | None:
+    """Return the cached response for this key or None"""
+    with _State.lock:
+        if not _State.gauge_registered:
+            _State.gauge_registered = True
+            metrics.Collector.register_gauge("uc_requests_response_cache", "Cached http responses, their size in bytes and cache hits, revalidations and misses since start", stats)
+        entry = _State.entries.get(cache_key)
+        if entry is not None:
+            _State.entries.move_to_end(cache_key)
+        return entry
+
+
+
+def put(cache_key: Hashable, body: str | bytes, etag: str | None, last_modified: str | None):
+    """Store a response and evict the least recently used responses if the cache would exceed UC_RESPONSE_CACHE_SIZE kilobytes"""
+    entry = Entry(body, etag, last_modified)
+    if entry.size > _MAX_SIZE:
+        _LOG.debug(f"Response with {entry.size} bytes is larger than the response cache and won't be cached")
+        return
+
+    with _State.lock:
+        old = _State.entries.pop(cache_key, None)
+        if old is not None:
+            _State.size -= old.size
+        while _State.entries and _State.size + entry.size > _MAX_SIZE:
+            _, evicted = _State.entries.popitem(last=False)
+            _State.size -= evicted.size
+            _State.counts["evicted"] += 1
+        _State.entries[cache_key] = entry
+        _State.size += entry.size
+
+
+
+def revalidated(entry: Entry):
+    """Mark a cached response as fresh again after the device answered with 304 - Not Modified"""
+    entry.stored = time.monotonic()
+
+
+
+def count(result: str):
+    """Count a cache hit, a revalidated response or a cache miss"""
+    with _State.lock:
+        _State.counts[result] += 1
+
+
+
+def sensor_updated(body: str | bytes, sensor_id: str):
+    """Remember the last response that has been used for a http request response sensor"""
+    _State.sensor_bodies[sensor_id] = body
+
+
+
+def sensor_outdated(body: str | bytes, sensor_ids: list[str]) -> bool:
+    """Return True if a cached response needs to be used for the response sensors because one of them currently shows a different response"""
+    return len(body) > 0 and any(body != _State.sensor_bodies.get(sensor_id) for sensor_id in sensor_ids)
+
+
+
+def hit_ratio() -> float:
+    """Return the share of requests that could be answered from the cache without a new response from the device"""
+    with _State.lock:
+        total = _State.counts["hit"] + _State.counts["revalidated"] + _State.counts["miss"]
+        return (_State.counts["hit"] + _State.counts["revalidated"]) / total if total else 0.0
+
+
+
+def stats() -> dict[str, float]:
+    """Return the number and size of cached responses, the counters since start and the hit ratio"""
+    ratio = hit_ratio()
+    with _State.lock:
+        return {"entries": len(_State.entries), "bytes": _State.size, **_State.counts, "hit_ratio": ratio}
+
+
+
+def log_summary():
+    """Log the hit ratio of the response cache since start if it has been used"""
+    values = stats()
+    if values["hit"] + values["revalidated"] + values["miss"] == 0:
+        return
+    _LOG.info(f"Response cache: {values['hit_ratio']:.0%} hit ratio ({values['hit']} hits, {values['revalidated']} revalidated, {values['miss']} misses), \
+{values['entries']} responses with {values['bytes'] / 1024:.0f} KB cached, {values['evicted']} evicted since start")
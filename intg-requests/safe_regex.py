@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""Module that evaluates user defined regular expressions on device responses with a time and input size budget.
+Patterns with constructs that can cause catastrophic backtracking are detected when the configuration is validated
+and evaluated in a separate process that is stopped if the time budget has been exceeded"""
+
+import functools
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import threading
+from re import _constants as sre_constants
+from re import _parser as sre_parse
+from typing import AnyStr
+
+import metrics
+
+try:
+    import re2 # Optional linear time regex engine (google-re2)
+except ImportError:
+    re2 = None
+
+_LOG = logging.getLogger(__name__)
+
+_TIMEOUT = float(os.getenv("UC_REGEX_TIMEOUT", "1"))
+_MAX_INPUT = int(os.getenv("UC_REGEX_MAX_INPUT", "1048576"))
+_ISOLATION = os.getenv("UC_REGEX_ISOLATION", "risky").lower()
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_ANY = "any"
+_CLASS = "class"
+
+
+
+class RegexTimeoutError(Exception):
+    """Raised if a regular expression could not be evaluated within UC_REGEX_TIMEOUT seconds"""
+
+
+
+class Match:
+    """Groups of a match that can be returned from the isolated process. Supports group() like re.Match"""
+
+    __slots__ = ("groups",)
+
+    def __init__(self, groups: tuple):
+        self.groups = groups
+
+    def group(self, index: int = 0) -> AnyStr | None:
+        """Return the whole match (0) or a subgroup"""
+        return self.groups[index]
+
+
+
+class _State:
+    """Isolated regex process and counters"""
+
+    lock = threading.Lock()
+    process: multiprocessing.Process | None = None
+    connection = None
+    counts = {"inline": 0, "re2": 0, "isolated": 0, "timeouts": 0, "truncated": 0}
+    gauge_registered = False
+
+
+
+@functools.lru_cache(maxsize=128)
+def risk(pattern: AnyStr, flags: int = 0) -> str | None:
+    """Return a description of the first construct in a pattern that can cause catastrophic backtracking or None if none has been found
+
+    :raises re.error: If the pattern is not a valid regular expression
+    """
+    return _walk(sre_parse.parse(pattern, flags), False)
+
+
+
+def validate(pattern: AnyStr, name: str) -> str | None:
+    """Check a user defined pattern when the configuration is saved. Returns a warning message for risky patterns
+
+    :raises ValueError: If the pattern is not a valid regular expression
+    """
+    try:
+        description = risk(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"The {name} {pattern!r} is not a valid regular expression: {e}") from e
+    if description is None:
+        return None
+    if re2 is not None and _re2_supported(pattern):
+        return None
+    return f"The {name} {pattern!r} contains {description} which can take very long on some responses. \
+It will be evaluated in a separate process that is stopped after {_TIMEOUT:g} seconds. Please consider simplifying it"
+
+
+
+def search(pattern: AnyStr, string: AnyStr, flags: int = 0) -> Match | None:
+    """Search a pattern in a response with the time and input size budget. Only the first UC_REGEX_MAX_INPUT characters are searched.
+
+    :raises RegexTimeoutError: If the search took longer than UC_REGEX_TIMEOUT seconds
+    :raises re.error: If the pattern is not a valid regular expression
+    """
+
+    if not _State.gauge_registered:
+        _State.gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_regex", "Regular expression searches per engine, timeouts and truncated responses since start",
+                                         lambda: dict(_State.counts))
+
+    if len(string) > _MAX_INPUT:
+        _State.counts["truncated"] += 1
+        _LOG.debug(f"Only searching the first {_MAX_INPUT} of {len(string)} characters of the response")
+        string = string[:_MAX_INPUT]
+
+    if re2 is not None and _re2_supported(pattern):
+        _State.counts["re2"] += 1
+        match = re2.search(_re2_pattern(pattern, flags), string)
+        return Match((match.group(0),) + match.groups()) if match else None
+
+    if _ISOLATION == "all" or (_ISOLATION == "risky" and risk(pattern, flags) is not None):
+        if _fork_context() is not None:
+            _State.counts["isolated"] += 1
+            return _search_isolated(pattern, string, flags)
+
+    _State.counts["inline"] += 1
+    match = re.search(pattern, string, flags)
+    return Match((match.group(0),) + match.groups()) if match else None
+
+
+
+def _walk(items, in_repeat: bool) -> str | None:
+    """Find nested unbounded quantifiers, overlapping alternatives and backreferences in repeated parts of a parsed pattern"""
+    for op, av in items:
+        if op in _REPEATS:
+            _, high, sub = av
+            if high > 1:
+                if _unbounded(sub):
+                    return "a nested quantifier like (a+)+"
+                if (description := _walk(sub, in_repeat or high == sre_constants.MAXREPEAT)):
+                    return description
+            elif (description := _walk(sub, in_repeat)):
+                return description
+        elif op == sre_constants.SUBPATTERN:
+            if (description := _walk(av[3], in_repeat)):
+                return description
+        elif op == sre_constants.BRANCH:
+            if in_repeat and _overlapping(av[1]):
+                return "a repeated alternation with overlapping alternatives like (a|ab)+"
+            for branch in av[1]:
+                if (description := _walk(branch, in_repeat)):
+                    return description
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if (description := _walk(av[1], in_repeat)):
+                return description
+        elif op == sre_constants.GROUPREF and in_repeat:
+            return "a backreference in a repeated group"
+        # Atomic groups and possessive quantifiers never backtrack into their content
+    return None
+
+
+
+def _unbounded(items) -> bool:
+    """Return True if a parsed pattern contains a quantifier without an upper limit that can backtrack"""
+    for op, av in items:
+        if op in _REPEATS and (av[1] == sre_constants.MAXREPEAT or _unbounded(av[2])):
+            return True
+        if op == sre_constants.SUBPATTERN and _unbounded(av[3]):
+            return True
+        if op == sre_constants.BRANCH and any(_unbounded(branch) for branch in av[1]):
+            return True
+    return False
+
+
+
+def _first(items) -> set | str | None:
+    """Return the possible first characters of a parsed pattern, _ANY, _CLASS for character classes or None if it can be empty"""
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return {av}
+        if op == sre_constants.ANY:
+            return _ANY
+        if op in (sre_constants.IN, sre_constants.NOT_LITERAL, sre_constants.CATEGORY):
+            return _CLASS
+        if op == sre_constants.SUBPATTERN:
+            return _first(av[3])
+        if op in _REPEATS:
+            return _first(av[2])
+        if op == sre_constants.BRANCH:
+            firsts = [_first(branch) for branch in av[1]]
+            if _ANY in firsts or None in firsts:
+                return _ANY
+            if _CLASS in firsts:
+                return _CLASS
+            return set().union(*firsts)
+        if op not in (sre_constants.AT,):
+            return None
+    return None
+
+
+
+def _overlapping(branches) -> bool:
+    """Return True if two alternatives of a branch can start with the same character"""
+    firsts = [_first(branch) for branch in branches]
+    for i, first in enumerate(firsts):
+        for other in firsts[i + 1:]:
+            if first is None or other is None or _ANY in (first, other):
+                return True
+            if first == _CLASS and other == _CLASS:
+                return True
+            if isinstance(first, set) and isinstance(other, set) and first & other:
+                return True
+    return False
+
+
+
+@functools.lru_cache(maxsize=128)
+def _re2_supported(pattern: AnyStr) -> bool:
+    """Return True if the optional re2 engine supports a pattern. Backreferences and lookarounds are not supported"""
+    try:
+        re2.compile(pattern)
+        return True
+    except Exception: # re2 raises different errors depending on the version
+        return False
+
+
+
+def _re2_pattern(pattern: AnyStr, flags: int) -> AnyStr:
+    if flags & re.IGNORECASE:
+        return b"(?i)" + pattern if isinstance(pattern, bytes) else "(?i)" + pattern
+    return pattern
+
+
+
+@functools.lru_cache(maxsize=1)
+def _fork_context():
+    """Return the multiprocessing context for the isolated process or None if fork is not supported on this platform"""
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:
+        _LOG.warning("Regular expressions can't be evaluated in a separate process on this platform. Risky patterns are evaluated without a time limit")
+        return None
+
+
+
+def _serve(connection):
+    """Evaluate regular expressions in the isolated process until the connection is closed"""
+    # The process is forked from the integration. Close all inherited sockets and files so connections of the integration are not kept open
+    signal.set_wakeup_fd(-1)
+    fd = connection.fileno()
+    os.closerange(3, fd)
+    os.closerange(fd + 1, os.sysconf("SC_OPEN_MAX"))
+    while True:
+        try:
+            pattern, string, flags = connection.recv()
+        except EOFError:
+            return
+        try:
+            match = re.search(pattern, string, flags)
+            connection.send(("ok", (match.group(0),) + match.groups() if match else None))
+        except re.error as e:
+            connection.send(("error", str(e)))
+
+
+
+def _start_process():
+    context = _fork_context()
+    connection, child_connection = context.Pipe()
+    _State.process = context.Process(target=_serve, args=(child_connection,), name="regex-worker", daemon=True)
+    _State.process.start()
+    child_connection.close()
+    _State.connection = connection
+    _LOG.debug(f"Started isolated regex process with pid {_State.process.pid}")
+
+
+
+def _stop_process():
+    _State.process.kill()
+    _State.process.join()
+    _State.connection.close()
+    _State.process = None
+    _State.connection = None
+
+
+
+def _search_isolated(pattern: AnyStr, string: AnyStr, flags: int) -> Match | None:
+    """Search a pattern in the isolated process and stop the process if the search takes longer than UC_REGEX_TIMEOUT seconds"""
+
+    if not _State.lock.acquire(timeout=_TIMEOUT):
+        _State.counts["timeouts"] += 1
+        raise RegexTimeoutError(f"Another regular expression is still being evaluated after {_TIMEOUT:g} seconds")
+    try:
+        if _State.process is None or not _State.process.is_alive():
+            _start_process()
+        _State.connection.send((pattern, string, flags))
+        if not _State.connection.poll(_TIMEOUT):
+            _stop_process()
+            _State.counts["timeouts"] += 1
+            raise RegexTimeoutError(f"Evaluating the regular expression {pattern!r} took longer than {_TIMEOUT:g} seconds and has been stopped")
+        status, value = _State.connection.recv()
+    finally:
+        _State.lock.release()
+
+    if status == "error":
+        raise re.error(value)
+    return Match(value) if value is not None else None
@@ -10,6 +10,9 @@ import ucapi
 import driver
 import config
 import remote
+import entity_queue
+import workers
+import recorder
 
 _LOG = logging.getLogger(__name__)
 
@@ -94,7 +97,7 @@ async def set_all_attributes():
 def _get_data(entity: ucapi.Select, custom_config: dict):
     """Get all options and the higher-level remote config for a select entity from the custom configuration.
 
-    Returns a tuple with all options of the given select entity and the higher-level remote entity configuration 
+    Returns a tuple with all options of the given select entity, the higher-level remote entity configuration and its entity id
     """
 
     remote_prefix = config.Setup.get("custom_entities_prefix")
@@ -128,7 +131,7 @@ def _get_data(entity: ucapi.Select, custom_config: dict):
     select_options = None
     for select_name, select_options in selects_config.items():
         if f"{select_prefix}{remote_name.lower()}-{select_name.lower()}" == entity:
-            return select_options, remote_config
+            return select_options, remote_config, remote_id
     if select_options is None:
         _LOG.error(f"No options found for select entity {entity} in custom entities configuration")
         raise ValueError
@@ -136,35 +139,44 @@ def _get_data(entity: ucapi.Select, custom_config: dict):
 
 
 
-async def _execute_command(select_entity_id: str, entity_config: dict[str, Any], command: str, label: str | None = None) -> ucapi.StatusCodes:
+async def _execute_command(select_entity_id: str, entity_config: dict[str, Any], command: str, label: str | None = None,
+                           remote_id: str | None = None) -> ucapi.StatusCodes:
     """Send simple command and update entity attributes with the display label on success.
     
     :param command: simple command id to send (e.g. INPUT_1)
     :param label: display label used for the attribute update; defaults to command if not given
+    :param remote_id: id of the remote entity of the select entity. The command is executed in its command queue where a newer option
+        replaces a pending older option and the response sensors and state of the remote entity are updated from the response
     """
 
     if label is None:
         label = command
 
-    _LOG.debug(f"Executing command '{command}' (label: '{label}') for entity '{select_entity_id}'")
-    _LOG.debug(str(entity_config))
+    async def run(_count: int) -> ucapi.StatusCodes:
+        _LOG.debug(f"Executing command '{command}' (label: '{label}') for entity '{select_entity_id}'")
+        _LOG.debug(str(entity_config))
 
-    cmd_status = await remote.send_command(
-        entity_id=select_entity_id,
-        entity_config=entity_config,
-        command=command,
-    )
+        cmd_status = await remote.send_command(
+            entity_id=select_entity_id,
+            entity_config=entity_config,
+            command=command,
+            remote_id=remote_id,
+        )
 
-    if cmd_status == ucapi.StatusCodes.OK:
-        try:
-            await update_attributes(select_entity_id, label)
-        except Exception as e:
-            _LOG.warning(f"Could not update select entity attributes for {select_entity_id}: {e}")
+        if cmd_status == ucapi.StatusCodes.OK:
+            try:
+                await update_attributes(select_entity_id, label)
+            except Exception as e:
+                _LOG.warning(f"Could not update select entity attributes for {select_entity_id}: {e}")
+
+        return cmd_status
 
-    return cmd_status
+    return await entity_queue.submit(remote_id or select_entity_id, run, supersede=select_entity_id)
 
 
 
+@recorder.recorded
+@workers.interactive
 async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict | None) -> ucapi.StatusCodes:
     """
     Custom select entity command handler.
@@ -193,7 +205,7 @@ async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict |
             pass  #Needed for next/previous commands created before 2.9.0 that don't include any parameters
 
     try:
-        options, remote_config = _get_data(entity.id, custom_entities)
+        options, remote_config, remote_id = _get_data(entity.id, custom_entities)
     except Exception:
         return ucapi.StatusCodes.NOT_FOUND
 
@@ -212,15 +224,15 @@ async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict |
             if pair is None:
                 _LOG.warning(f"Option '{requested_label}' not found in resolved options for {entity.id}")
                 return ucapi.StatusCodes.BAD_REQUEST
-            return await _execute_command(entity.id, remote_config, command=pair[0], label=pair[1])
+            return await _execute_command(entity.id, remote_config, command=pair[0], label=pair[1], remote_id=remote_id)
 
         case ucapi.select.Commands.SELECT_FIRST:
             cmd, lbl = resolved[0]
-            return await _execute_command(entity.id, remote_config, command=cmd, label=lbl)
+            return await _execute_command(entity.id, remote_config, command=cmd, label=lbl, remote_id=remote_id)
 
         case ucapi.select.Commands.SELECT_LAST:
             cmd, lbl = resolved[-1]
-            return await _execute_command(entity.id, remote_config, command=cmd, label=lbl)
+            return await _execute_command(entity.id, remote_config, command=cmd, label=lbl, remote_id=remote_id)
 
         case ucapi.select.Commands.SELECT_NEXT | ucapi.select.Commands.SELECT_PREVIOUS:
             try:
@@ -242,7 +254,7 @@ async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict |
             if idx == -1:
                 _LOG.warning("Couldn't retrieve the current option. Will use the first option instead")
                 cmd, lbl = resolved[0]
-                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl)
+                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl, remote_id=remote_id)
 
             last_index = len(resolved) - 1
 
@@ -255,7 +267,7 @@ async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict |
                 else:
                     next_idx = idx + 1
                 cmd, lbl = resolved[next_idx]
-                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl)
+                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl, remote_id=remote_id)
 
             if cmd_id == ucapi.select.Commands.SELECT_PREVIOUS:
                 if idx == 0:
@@ -266,7 +278,7 @@ async def select_cmd_handler(entity: ucapi.Select, cmd_id: str, _params: dict |
                 else:
                     prev_idx = idx - 1
                 cmd, lbl = resolved[prev_idx]
-                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl)
+                return await _execute_command(entity.id, remote_config, command=cmd, label=lbl, remote_id=remote_id)
 
         case _:
             _LOG.info(f"Unknown command \"{cmd_id}\" for custom select entity with id {entity.id}")
@@ -2,14 +2,32 @@
 
 """Module that includes functions to add a http request response sensor entity"""
 
+import asyncio
 import logging
+from typing import Any
+
 import ucapi
+import config
 import driver
 
 _LOG = logging.getLogger(__name__)
 
 
 
+def update_attributes(entity_id: str, attributes: dict):
+    """Update entity attributes in the event loop. Response sensors and remote states are also updated from command worker threads
+    and the api emits the attribute change event to the event loop which is not thread-safe"""
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is driver.loop:
+        driver.api.configured_entities.update_attributes(entity_id, attributes)
+    else:
+        driver.loop.call_soon_threadsafe(driver.api.configured_entities.update_attributes, entity_id, attributes)
+
+
+
 async def add_rq_sensor(ent_id: str, name: str):
     """Function to add a http request response sensor entity"""
 
@@ -43,7 +61,7 @@ def update_rq_sensor(entity_id: str, response: str):
     attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: response}
 
     try:
-        driver.api.configured_entities.update_attributes(entity_id, attributes_to_send)
+        update_attributes(entity_id, attributes_to_send)
     except Exception as e:
         _LOG.error(e)
         raise Exception("Error while updating sensor value for entity id " + entity_id) from e
@@ -85,9 +103,109 @@ def update_tcp_text_sensor(entity_id: str, response: str):
     attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: response}
 
     try:
-        driver.api.configured_entities.update_attributes(entity_id, attributes_to_send)
+        update_attributes(entity_id, attributes_to_send)
     except Exception as e:
         _LOG.error(e)
         raise Exception("Error while updating sensor value for entity id " + entity_id) from e
 
     _LOG.info("Updated tcp text response sensor value to " + response)
+
+
+
+async def add_latency_sensor(ent_id: str, name: str):
+    """Function to add a command latency sensor entity"""
+
+    definition = ucapi.Sensor(
+        ent_id,
+        name,
+        features=None, #Mandatory although sensor entities have no features
+        attributes={ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: ""},
+        device_class=ucapi.sensor.DeviceClasses.CUSTOM,
+        options=None,
+        icon="uc:arrow-progress",
+        description={
+            "en": "Sensor entity to display latency percentiles and errors of all executed commands",
+            "de": "Sensor Entität zur Anzeige von Latenz-Perzentilen und Fehlern aller ausgeführten Befehle"
+        }
+    )
+
+    driver.api.available_entities.add(definition)
+
+    _LOG.info("Added command latency sensor entity with id " + ent_id + " and name " + str(name))
+
+
+
+def update_latency_sensor(entity_id: str, summary: str):
+    """Update the command latency sensor entity value with the passed percentile summary"""
+
+    if driver.api.configured_entities.get(entity_id) is None:
+        _LOG.debug(f"Entity {entity_id} not found in configured entities. Skip updating attributes")
+        return True
+
+    attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: summary}
+
+    try:
+        update_attributes(entity_id, attributes_to_send)
+    except Exception as e:
+        _LOG.error(e)
+        raise Exception("Error while updating sensor value for entity id " + entity_id) from e
+
+    _LOG.debug("Updated command latency sensor value to " + summary)
+
+
+
+def entity_sensor_id(entity_id: str, sensor_name: str) -> str:
+    """Return the entity id of a response sensor that has been defined in the Sensors block of a custom entity"""
+    entity_name = entity_id.removeprefix(config.Setup.get("custom_entities_prefix"))
+    return f"{config.Setup.get('custom_entities_sensor_prefix')}{entity_name}-{sensor_name.lower()}"
+
+
+
+def entity_sensors(entity_id: str, entity_config: dict[str, Any] | None) -> dict[str, str]:
+    """Return the response sensors of a custom entity as sensor entity id and regular expression or JSON path"""
+    if not entity_config:
+        return {}
+    sensors = entity_config.get("Sensors", {}) or {}
+    return {entity_sensor_id(entity_id, name): str(expression) for name, expression in sensors.items()}
+
+
+
+async def add_entity_sensor(ent_id: str, name: str, entity_name: str):
+    """Function to add a response sensor entity that has been defined in the Sensors block of a custom entity"""
+
+    definition = ucapi.Sensor(
+        ent_id,
+        name,
+        features=None, #Mandatory although sensor entities have no features
+        attributes={ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: ""},
+        device_class=ucapi.sensor.DeviceClasses.CUSTOM,
+        options=None,
+        icon="uc:arrow-progress",
+        description={
+            "en": f"Sensor entity to display a value from the responses of {entity_name} commands",
+            "de": f"Sensor Entität zur Anzeige eines Werts aus den Antworten der Befehle von {entity_name}"
+        }
+    )
+
+    driver.api.available_entities.add(definition)
+
+    _LOG.info("Added response sensor entity with id " + ent_id + " and name " + str(name))
+
+
+
+def update_entity_sensor(entity_id: str, value: str):
+    """Update the value of a response sensor entity of a custom entity"""
+
+    if driver.api.configured_entities.get(entity_id) is None:
+        _LOG.debug(f"Entity {entity_id} not found in configured entities. Skip updating attributes")
+        return True
+
+    attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: value}
+
+    try:
+        update_attributes(entity_id, attributes_to_send)
+    except Exception as e:
+        _LOG.error(e)
+        raise Exception("Error while updating sensor value for entity id " + entity_id) from e
+
+    _LOG.info(f"Updated response sensor {entity_id} value to {value}")
@@ -8,6 +8,8 @@ import ucapi
 
 import config
 import driver
+import profiler
+import ratelimit
 import sensor
 
 _LOG = logging.getLogger(__name__)
@@ -23,6 +25,8 @@ async def init():
 async def add_all_entities():
     """Adds a media player entity for each configured command in config.py and the http response sensor entity"""
 
+    ratelimit.load()
+
     if config.Setup.get("custom_entities_set"):
         _LOG.debug("Get custom entities configuration as Python dict from runtime storage")
         custom_entities = config.Setup.get("custom_entities", python_dict=True)
@@ -51,6 +55,11 @@ async def add_all_entities():
     else:
         await sensor.add_tcp_text_sensor(config.Setup.get("id-tcp-text-sensor"), config.Setup.get("name-tcp-text-sensor"))
 
+    if driver.api.available_entities.contains(config.Setup.get("id-latency-sensor")) or driver.api.configured_entities.contains(config.Setup.get("id-latency-sensor")):
+        _LOG.debug("Entity with id " + config.Setup.get("id-latency-sensor") + " is already in storage as available or configured entity")
+    else:
+        await sensor.add_latency_sensor(config.Setup.get("id-latency-sensor"), config.Setup.get("name-latency-sensor"))
+
 
 
 async def driver_setup_handler(msg: ucapi.SetupDriver) -> ucapi.SetupAction:
@@ -82,6 +91,10 @@ async def driver_setup_handler(msg: ucapi.SetupDriver) -> ucapi.SetupAction:
         if msg.setup_data["setup_action"] == "finish":
             return await finish_setup()
 
+        # Hidden setup action that is not shown in the dropdown and can only be used via the Core API
+        if msg.setup_data["setup_action"] == "profile":
+            return await start_profiler(msg.setup_data)
+
     if isinstance(msg, ucapi.UserDataResponse):
 
         if config.Setup.get("setup_step") == "handle_advanced":
@@ -237,8 +250,8 @@ rq_response_nomatch_option: {str(rq_response_nomatch_option)}")
             {
                 "id": "tcp_text_response_regex",
                 "label": {
-                    "en": "Regular expression for parsing the text over TCP sensor response:",
-                    "de": "Regulärer Ausdruck zum Parsen der Text über TCP-Sensorantwort:"
+                    "en": "Regular expression or JSON path (e.g. $.status.volume) for parsing the text over TCP sensor response:",
+                    "de": "Regulärer Ausdruck oder JSON-Pfad (z.B. $.status.volume) zum Parsen der Text über TCP-Sensorantwort:"
                     },
                 "field": {"text": {
                                     "value": tcp_text_response_regex
@@ -296,8 +309,8 @@ rq_response_nomatch_option: {str(rq_response_nomatch_option)}")
             {
                 "id": "rq_response_regex",
                 "label": {
-                    "en": "Regular expression for parsing the HTTP request sensor response:",
-                    "de": "Regulärer Ausdruck zum Parsen der HTTP-Anfrage-Sensorantwort:"
+                    "en": "Regular expression or JSON path (e.g. $.status.volume) for parsing the HTTP request sensor response:",
+                    "de": "Regulärer Ausdruck oder JSON-Pfad (z.B. $.status.volume) zum Parsen der HTTP-Anfrage-Sensorantwort:"
                     },
                 "field": {"text": {
                                     "value": rq_response_regex
@@ -402,6 +415,7 @@ async def handle_response_advanced(msg: ucapi.UserDataResponse) -> ucapi.Request
     _LOG.info("Text over tcp terminator: " +  str(tcp_text_terminator))
 
     try:
+        config.validate_response_expression(tcp_text_response_regex, "text over tcp response regular expression")
         config.Setup.set("tcp_text_response_regex", tcp_text_response_regex)
     except Exception as e:
         _LOG.error(e)
@@ -434,6 +448,7 @@ async def handle_response_advanced(msg: ucapi.UserDataResponse) -> ucapi.Request
     _LOG.info("Http requests user agent: \"" +  str(rq_user_agent) + "\"")
 
     try:
+        config.validate_response_expression(rq_response_regex, "http request response regular expression")
         config.Setup.set("rq_response_regex", rq_response_regex)
     except Exception as e:
         _LOG.error(e)
@@ -596,6 +611,20 @@ async def handle_response_custom(msg: ucapi.UserDataResponse) -> ucapi.RequestUs
 
 
 
+async def start_profiler(setup_data: dict) -> ucapi.SetupAction:
+    """Start a profiler capture with an optional duration in seconds from the profile_duration setup data field and finish the setup"""
+
+    try:
+        duration = float(setup_data.get("profile_duration", 0))
+    except ValueError:
+        _LOG.error("Invalid profile_duration value: " + str(setup_data.get("profile_duration")) + ". Using the default duration")
+        duration = 0
+    profiler.start(duration)
+
+    return await finish_setup()
+
+
+
 async def finish_setup() -> ucapi.SetupAction:
     """Finish the setup process and add all entities"""
 
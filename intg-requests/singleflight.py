@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""Module that lets identical commands that are sent while the same command is still running share its result instead of sending it again"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Hashable
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_SUPPORTED = ("get", "head")
+_TYPES = {cmd_type.strip().lower() for cmd_type in os.getenv("UC_SINGLEFLIGHT", "").split(",") if cmd_type.strip()}
+
+if _TYPES - set(_SUPPORTED):
+    _LOG.warning(f"UC_SINGLEFLIGHT only supports the command types {', '.join(_SUPPORTED)}. Ignoring {', '.join(sorted(_TYPES - set(_SUPPORTED)))}")
+    _TYPES &= set(_SUPPORTED)
+
+_calls: dict[Hashable, asyncio.Future] = {}
+_leaders = 0
+_shared = 0
+_gauge_registered = False
+
+
+
+def enabled(cmd_type: str) -> bool:
+    """Return True if identical in-flight commands of this type share their result. Activated per command type with UC_SINGLEFLIGHT"""
+    return cmd_type in _TYPES
+
+
+
+async def run(key: Hashable, func: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+    """Run func or wait for the result of an identical call with the same key that is currently running.
+    Returns the result and True if the result has been shared from another call. If the running call is cancelled
+    the waiting calls run func again instead of being cancelled as well"""
+    global _leaders, _shared, _gauge_registered
+
+    if not _gauge_registered:
+        _gauge_registered = True
+        metrics.Collector.register_gauge("uc_requests_singleflight", "Commands that have been sent and commands that shared the result of an identical running command since start",
+                                         lambda: {"sent": _leaders, "shared": _shared})
+
+    while (future := _calls.get(key)) is not None:
+        _shared += 1
+        _LOG.debug("Identical command is already running. Waiting for its result")
+        try:
+            return await asyncio.shield(future), True
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling() or not future.cancelled():
+                raise
+            # Only the running command has been cancelled, e.g. because its entity has been removed. Send this command itself
+            _shared -= 1
+            _LOG.debug("The identical running command has been cancelled. Sending the command again")
+
+    future = asyncio.get_running_loop().create_future()
+    _calls[key] = future
+    _leaders += 1
+    try:
+        result = await func()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark the exception as retrieved if no other call is waiting
+        raise
+    else:
+        future.set_result(result)
+        return result, False
+    finally:
+        del _calls[key]
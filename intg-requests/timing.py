@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""Module that records optional phase-level timings (parse, dns, connect, tls, write, ttfb, body, extract, sensor) of executed commands"""
+
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3 import connection, connectionpool
+from urllib3.util import connection as util_connection
+from urllib3.exceptions import NameResolutionError, ConnectTimeoutError, NewConnectionError
+
+_LOG = logging.getLogger(__name__)
+
+_ENABLED = os.getenv("UC_COMMAND_TIMING", "false").lower() in ("true", "1")
+_FILE = os.getenv("UC_COMMAND_TIMING_FILE", "")
+_HISTORY = deque(maxlen=int(os.getenv("UC_COMMAND_TIMING_HISTORY", "50")))
+
+_current: ContextVar["Timing | None"] = ContextVar("command_timing", default=None)
+
+
+
+class Timing:
+    """Phase timings of a single command. Each phase contains the time since the previous phase in milliseconds"""
+
+    __slots__ = ("cmd_type", "target", "entity_id", "started", "last", "phases", "status", "total")
+
+    def __init__(self, cmd_type: str, target: str, entity_id: str):
+        self.cmd_type = cmd_type
+        self.target = target
+        self.entity_id = entity_id
+        self.started = time.time()
+        self.last = time.perf_counter()
+        self.phases = []
+        self.status = None
+        self.total = 0.0
+
+    def lap(self, phase: str):
+        """Add the time since the last phase as a new phase"""
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def as_dict(self) -> dict:
+        """Return the timing as a json serializable dict"""
+        return {
+            "time": self.started,
+            "type": self.cmd_type,
+            "target": self.target,
+            "entity_id": self.entity_id,
+            "status": self.status,
+            "total_ms": round(self.total, 3),
+            "phases": [[phase, round(duration, 3)] for phase, duration in self.phases]
+        }
+
+    def describe(self) -> str:
+        """Return a short human readable version of all phases"""
+        phases = " | ".join(f"{phase} {duration:.1f} ms" for phase, duration in self.phases)
+        return f"{self.cmd_type} {self.target} ({self.entity_id}): {phases} | total {self.total:.1f} ms | status {self.status}"
+
+
+
+def enabled() -> bool:
+    """Return True if phase timings are recorded. Can be activated with the UC_COMMAND_TIMING environment variable"""
+    return _ENABLED
+
+
+
+def start(cmd_type: str, target: str, entity_id: str) -> Token | None:
+    """Start recording phase timings for a command. Returns None if timings are deactivated"""
+    if not _ENABLED:
+        return None
+    return _current.set(Timing(cmd_type, target, entity_id))
+
+
+
+def lap(phase: str):
+    """Record the time since the last phase for the current command. Does nothing if no timing is recorded"""
+    timing = _current.get()
+    if timing is not None:
+        timing.lap(phase)
+
+
+
+def finish(token: Token | None, status: int):
+    """Finish the timing started with start(), add it to the history and write it to the log and optionally a jsonl trace file"""
+    if token is None:
+        return
+    timing = _current.get()
+    _current.reset(token)
+
+    timing.status = int(status)
+    timing.total = (time.perf_counter() - timing.last) * 1000 + sum(duration for _, duration in timing.phases)
+    _HISTORY.append(timing)
+    _LOG.debug("Command timing: " + timing.describe())
+
+    if _FILE:
+        try:
+            with open(_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(timing.as_dict()) + "\n")
+        except OSError as o:
+            _LOG.error(f"Could not write command timing to {_FILE}: {o}")
+
+
+
+def history() -> list[Timing]:
+    """Return the timings of the last commands. The amount can be changed with UC_COMMAND_TIMING_HISTORY"""
+    return list(_HISTORY)
+
+
+
+def log_history():
+    """Log the timings of the last commands as one debug block"""
+    if not _HISTORY:
+        return
+    lines = [timing.describe() for timing in _HISTORY]
+    _LOG.debug("Timings of the last " + str(len(lines)) + " commands:\n" + "\n".join(lines))
+
+
+
+class _TimedConnection:
+    """Adds dns, connect, tls, write and ttfb phases to urllib3 connections. Resolves the host name itself to separately
+    measure the dns lookup and connects to the first resolved address"""
+
+    def _new_conn(self) -> socket.socket:
+        try:
+            address = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        lap("dns")
+
+        try:
+            sock = util_connection.create_connection(
+                (address, self.port),
+                self.timeout,
+                source_address=self.source_address,
+                socket_options=self.socket_options,
+            )
+        except socket.timeout as e:
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+        lap("connect")
+        return sock
+
+    def request(self, *args, **kwargs):
+        """Send the request and record the write phase"""
+        super().request(*args, **kwargs)
+        lap("write")
+
+    def getresponse(self, *args, **kwargs):
+        """Wait for the response headers and record the time to first byte"""
+        response = super().getresponse(*args, **kwargs)
+        lap("ttfb")
+        return response
+
+
+
+class _TimedHTTPConnection(_TimedConnection, connection.HTTPConnection):
+    pass
+
+
+
+class _TimedHTTPSConnection(_TimedConnection, connection.HTTPSConnection):
+
+    def connect(self):
+        """Connect and record the tls handshake phase"""
+        super().connect()
+        lap("tls")
+
+
+
+class _TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+
+class _TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+
+class _TimedAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+
+def http_session() -> Session:
+    """Return a requests session that records the dns, connect, tls, write and ttfb phases of the current command"""
+    session = Session()
+    adapter = _TimedAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""Module with a dedicated and bounded thread pool for blocking command work like http requests, wake-on-lan and mac address discovery.
+Work from interactive commands is started before background work and has reserved worker threads"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable
+
+import metrics
+
+_LOG = logging.getLogger(__name__)
+
+_THREADS = max(1, int(os.getenv("UC_WORKER_THREADS", str(min(32, (os.cpu_count() or 1) + 4)))))
+_QUEUE_SIZE = int(os.getenv("UC_WORKER_QUEUE", "64"))
+_RESERVED = max(0, min(_THREADS - 1, int(os.getenv("UC_WORKER_RESERVED", "2"))))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+_lane: ContextVar[str] = ContextVar("worker_lane", default=BACKGROUND)
+
+
+
+class WorkersBusyError(Exception):
+    """Raised if all worker threads are busy and the maximum number of waiting jobs has been reached"""
+
+
+
+class _State:
+    """Worker pool, waiting jobs and counters. Only changed from the event loop thread"""
+
+    executor: ThreadPoolExecutor | None = None
+    waiting: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+    busy: dict[str, int] = {lane: 0 for lane in LANES}
+    rejected: dict[str, int] = {lane: 0 for lane in LANES}
+    wait = {}
+    window = None
+
+
+
+def _executor() -> ThreadPoolExecutor:
+    """Return the worker pool and create it on first use"""
+    if _State.executor is None:
+        _State.executor = ThreadPoolExecutor(max_workers=_THREADS, thread_name_prefix="command-worker")
+        # Created here as metrics indirectly imports modules that import this module
+        _State.wait = {lane: metrics.Histogram() for lane in LANES}
+        _State.window = metrics.Histogram()
+        metrics.Collector.register_gauge("uc_requests_worker_jobs", "Jobs waiting for and running in a command worker thread per lane and rejected jobs since start", stats)
+        metrics.Collector.register_gauge("uc_requests_worker_wait_seconds", "Time jobs waited for a free command worker thread per lane (percentiles and maximum since start)", wait_time)
+        _LOG.debug(f"Started {_THREADS} command worker threads ({_RESERVED} reserved for interactive commands) with a queue size of {_QUEUE_SIZE}")
+    return _State.executor
+
+
+
+def interactive(handler: Callable) -> Callable:
+    """Decorator for entity command handlers. All blocking work of the command is started before background work
+    and can also use the worker threads that are reserved for interactive commands"""
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        token = _lane.set(INTERACTIVE)
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            _lane.reset(token)
+
+    return wrapper
+
+
+
+def background(func: Callable) -> Callable:
+    """Decorator for coroutine functions that are not started by a user, e.g. polling or background dispatching.
+    Their blocking work only starts if no interactive work is waiting and doesn't use the reserved worker threads"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _lane.set(BACKGROUND)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _lane.reset(token)
+
+    return wrapper
+
+
+
+def _can_start(lane: str) -> bool:
+    busy = _State.busy[INTERACTIVE] + _State.busy[BACKGROUND]
+    if busy >= _THREADS:
+        return False
+    if lane == INTERACTIVE:
+        return True
+    return not _State.waiting[INTERACTIVE] and _State.busy[BACKGROUND] < _THREADS - _RESERVED
+
+
+
+def _dispatch():
+    """Start waiting jobs on free worker threads. Interactive jobs are always started first"""
+    for lane in LANES:
+        waiting = _State.waiting[lane]
+        while waiting and _can_start(lane):
+            ticket = waiting.popleft()
+            if not ticket.done():
+                _State.busy[lane] += 1
+                ticket.set_result(None)
+
+
+
+async def run(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function in a command worker thread and return its result. Context variables are passed to the worker thread
+    like with asyncio.to_thread(). The priority lane is taken from the current context (see interactive() and background()).
+    Raises WorkersBusyError if UC_WORKER_QUEUE jobs of the same lane are already waiting for a free worker thread"""
+
+    executor = _executor()
+    lane = _lane.get()
+    waiting = _State.waiting[lane]
+    submitted = time.perf_counter()
+
+    if not waiting and _can_start(lane):
+        _State.busy[lane] += 1
+    else:
+        if len(waiting) >= _QUEUE_SIZE:
+            _State.rejected[lane] += 1
+            raise WorkersBusyError(f"All {_THREADS} command worker threads are busy and {len(waiting)} {lane} jobs are already waiting")
+        ticket = asyncio.get_running_loop().create_future()
+        waiting.append(ticket)
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            if ticket in waiting:
+                waiting.remove(ticket)
+            elif ticket.done() and not ticket.cancelled():
+                # A worker thread has already been assigned to this job
+                _State.busy[lane] -= 1
+                _dispatch()
+            raise
+
+    wait = (time.perf_counter() - submitted) * 1_000_000
+    _State.wait[lane].record(wait)
+    _State.window.record(wait)
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    job = executor.submit(context.run, func, *args, **kwargs)
+    # The worker thread is only free again when the job has finished. A cancelled command doesn't stop the running job
+    job.add_done_callback(lambda _job: _release_threadsafe(loop, lane))
+    return await asyncio.wrap_future(job)
+
+
+
+def _release_threadsafe(loop: asyncio.AbstractEventLoop, lane: str):
+    """Called from the worker thread when a job has finished or from the event loop thread when a waiting job has been cancelled"""
+    try:
+        loop.call_soon_threadsafe(_release, lane)
+    except RuntimeError:
+        pass # The event loop has already been closed
+
+
+
+def _release(lane: str):
+    _State.busy[lane] -= 1
+    _dispatch()
+
+
+
+def stats() -> dict[str, int]:
+    """Return the number of waiting, running and rejected jobs per lane as well as the number of (reserved) worker threads"""
+    values = {"threads": _THREADS, "reserved": _RESERVED}
+    for lane in LANES:
+        values[f"{lane}_queued"] = len(_State.waiting[lane])
+        values[f"{lane}_busy"] = _State.busy[lane]
+        values[f"{lane}_rejected"] = _State.rejected[lane]
+    return values
+
+
+
+def wait_time() -> dict[str, float]:
+    """Return the percentiles and the maximum of the time jobs waited for a free worker thread per lane since the start in seconds"""
+    values = {}
+    for lane, histogram in _State.wait.items():
+        for p in metrics.PERCENTILES:
+            values[f"{lane}_p{p}"] = histogram.percentile(p) / 1_000_000
+        values[f"{lane}_max"] = histogram.max / 1_000_000
+    return values
+
+
+
+def log_summary():
+    """Log the wait time percentiles of jobs since the last summary. Logged at info level if a job had to wait
+    for more than 10 ms or jobs have been rejected"""
+    if _State.window is None or _State.window.count == 0:
+        return
+    rejected = sum(_State.rejected.values())
+    interactive_wait = _State.wait[INTERACTIVE].describe()
+    message = f"Command worker wait time: {_State.window.describe()} | interactive since start: {interactive_wait} | {rejected} jobs rejected since start"
+    if _State.window.max > 10_000 or rejected:
+        _LOG.info(message)
+    else:
+        _LOG.debug(message)
+    _State.window = metrics.Histogram()